@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Benchmarks the startup of the command line scripts: the wall time of `--help`, which imports the whole script and
+parses its arguments, and the slowest imports reported by `python -X importtime`. Each run is a fresh interpreter.
+Save the results with --save, and compare a later run against them with --compare to see a regression.
+
+Usage:
+    python -m experiments.bench_startup --runs 10 --save startup.json
+    python -m experiments.bench_startup --compare startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+from experiments.constants import REPO_ROOT
+
+SCRIPTS = ["experiments.eternal_chat", "experiments.script_writer"]
+
+
+def run_python(args: List[str]) -> subprocess.CompletedProcess:
+    """
+    Run a fresh Python interpreter from the repository root.
+    :param args: the arguments of the interpreter.
+    :return: the completed process.
+    """
+    return subprocess.run([sys.executable] + args, cwd=REPO_ROOT, capture_output=True, text=True)
+
+
+def time_help(module: str, runs: int) -> float:
+    """
+    Time `python -m module --help`.
+    :param module: the module of the script.
+    :param runs: the number of runs.
+    :return: the median wall time, in seconds.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = run_python(["-m", module, "--help"])
+        timings.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{module} --help failed:\n{result.stderr}")
+    return statistics.median(timings)
+
+
+def slowest_imports(module: str, count: int) -> List[Tuple[str, float]]:
+    """
+    Import the module with `python -X importtime`, and find the imports that took the longest, counting the
+    imports they triggered.
+    :param module: the module to import.
+    :param count: the number of imports to return.
+    :return: the names of the imports and their cumulative times in seconds, slowest first.
+    """
+    result = run_python(["-X", "importtime", "-c", f"import {module}"])
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda entry: entry[1], reverse=True)[:count]
+
+
+def main():
+    """
+    The main function for the startup benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the startup of the command line scripts.")
+    parser.add_argument("--runs", type=int, default=5, help="The number of --help runs per script, the median is kept.")
+    parser.add_argument("--top", type=int, default=10, help="The number of slowest imports to list per script.")
+    parser.add_argument("--save", help="The path of a JSON file to save the results to.")
+    parser.add_argument("--compare", help="The path of a JSON file of earlier results to compare against.")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for module in SCRIPTS:
+        help_seconds = time_help(module, args.runs)
+        results[module] = help_seconds
+        line = f"{module}: --help in {help_seconds * 1000:.0f} ms"
+        if module in baseline:
+            line += f", was {baseline[module] * 1000:.0f} ms ({(help_seconds / baseline[module] - 1) * 100:+.0f}%)"
+        print(line)
+        for name, seconds in slowest_imports(module, args.top):
+            print(f"    {seconds * 1000:>8.1f} ms  {name}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved to {os.path.realpath(args.save)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+OPEN_AI_KEY = "sk-xxx"
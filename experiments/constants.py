@@ -1,4 +1,3 @@
-from os import makedirs
 from os.path import dirname, join, realpath
 
 CURRENT_DIR = realpath(dirname(__file__))
@@ -7,13 +6,15 @@ ASSETS_DIR = join(REPO_ROOT, "assets")
 
 DATA_DIR = join(REPO_ROOT, "data")
 
+# The data directories are created when something is first saved in them, not on import
 CHATS_DIR = join(DATA_DIR, "chats")
-makedirs(CHATS_DIR, exist_ok=True)
-
-
 SCRIPT_WRITER_DIR = join(DATA_DIR, "script_writer")
-makedirs(SCRIPT_WRITER_DIR, exist_ok=True)
+ALL_COMPLETIONS_PATH = join(SCRIPT_WRITER_DIR, "all_completions.json")
+ALL_COMPLETIONS_LOG_PATH = join(SCRIPT_WRITER_DIR, "all_completions.jsonl")
 
 # See: https://platform.openai.com/docs/models/model-endpoint-compatibility
 MODEL_NAME = "gpt-4"  # Basic 8k token context
 # MODEL_NAME = "gpt-4-32k" # Larger 32k token context
+
+# See: https://platform.openai.com/docs/guides/embeddings
+EMBEDDING_MODEL_NAME = "text-embedding-ada-002"
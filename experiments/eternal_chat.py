@@ -1,21 +1,25 @@
 #!/usr/bin/env python
 
 import argparse
+import os
 from argparse import Namespace
 
 import openai
 
 from experiments.config import OPEN_AI_KEY
+from experiments.helpers.chat_client import get_chat_client
+from experiments.helpers.chat_memory import ChatMemory
+from experiments.helpers.chat_transcript import ChatTranscript
+from experiments.helpers.context_window import DEFAULT_REPLY_TOKENS, SUMMARY_PREFIX, ContextWindow
 from experiments.helpers.io_helpers import multiline_input
-from experiments.helpers.openai_api_helpers import count_messages_tokens
 from experiments.helpers.file_helpers import (
     save_json,
     load_json,
-    get_fs_safe_timestamp,
     generate_run_dir,
 )
 from experiments.constants import (
     CHATS_DIR,
+    MODEL_NAME,
 )
 from experiments.helpers.openai_completion_helpers import get_completion, get_valid_temperature
 
@@ -35,6 +39,23 @@ def parse_args() -> Namespace:
     # Add the '--fresh' option as a boolean flag, which will be True when the option is specified, and False otherwise.
     parser.add_argument("--fresh", action="store_true", help="Indicates if the system should start from scratch.")
     parser.add_argument("--temperature", type=float, default=1.0, help="The temperature to use for the chat completion.")
+    parser.add_argument("--reply-tokens", type=int, default=DEFAULT_REPLY_TOKENS, help="The tokens to leave for the reply.")
+    parser.add_argument(
+        "--context-budget",
+        type=int,
+        default=None,
+        help="The most tokens to send with each prompt. Defaults to the context window minus the reply tokens.",
+    )
+    parser.add_argument(
+        "--summarize",
+        action="store_true",
+        help="Also send a summary of the chat, written in the background, on top of the messages retrieved by embedding.",
+    )
+    parser.add_argument(
+        "--fsync",
+        action="store_true",
+        help="Sync each turn to the disk before going on, so a power loss does not lose it.",
+    )
     # Add the '--save-file-path' option, which requires a file path as its argument.
     # The 'default' value will be used if this option is not specified on the command line.
     defaultdir = generate_run_dir(CHATS_DIR)
@@ -64,42 +85,147 @@ THE END USER WILL NOT SEE THIS MESSAGE OR YOUR RESPONSE.
     "\n", " "
 )
 
+# The number of messages printed when a chat is resumed
+RESUME_PRINT_COUNT = 10
+# The most seconds to wait on exit for a summary being written in the background
+SUMMARY_EXIT_TIMEOUT = 60
+
+
+def make_summarizer(temperature: float):
+    """
+    Make the function that summarizes the chat for the ContextWindow, in a request of its own.
+    :param temperature: The temperature to use for the summary.
+    :return: The summarizer.
+    """
+
+    def summarize(messages, previous_summary):
+        context = []
+        if previous_summary is not None:
+            context.append({"role": "system", "content": SUMMARY_PREFIX + previous_summary})
+        context += messages + [{"role": "user", "content": SYSTEM_MESSAGE}]
+        response = get_chat_client().complete(context, model=MODEL_NAME, temperature=temperature)
+        return response["choices"][0]["message"]["content"]
+
+    return summarize
+
+
+def migrate_messages_json(save_dir_path: str, transcript_path: str) -> None:
+    """
+    Move the messages of a chat saved before the transcript, as a messages.json rewritten on every turn, into the
+    transcript, once. Chats saved before the summaries were kept in summary.json have them in the messages, after a
+    SYSTEM_MESSAGE prompt: these pairs are left out, and the last summary is saved in summary.json.
+    The transcript is written to a temporary file, moved into place once complete, so an interrupted migration is
+    started over on the next run, and the messages.json is left as it was until then.
+    :param save_dir_path: The save directory of the chat.
+    :param transcript_path: The path of the transcript, which must not exist yet.
+    """
+    try:
+        legacy_messages = load_json(save_dir_path + "/messages.json")
+    except FileNotFoundError:
+        return
+    messages = []
+    summary = None
+    idx = 0
+    while idx < len(legacy_messages):
+        message = legacy_messages[idx]
+        if message["role"] == "user" and message["content"] == SYSTEM_MESSAGE:
+            if idx + 1 < len(legacy_messages):
+                summary = {"summary": legacy_messages[idx + 1]["content"], "covers": len(messages)}
+            idx += 2
+            continue
+        messages.append(message)
+        idx += 1
+    try:
+        load_json(save_dir_path + "/summary.json")
+    except FileNotFoundError:
+        if summary is not None:
+            save_json(summary, save_dir_path + "/summary.json")
+    temp_path = transcript_path + ".tmp"
+    # Left behind by an interrupted migration
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    with ChatTranscript(temp_path, fsync=True) as migrated:
+        migrated.extend(messages)
+    os.replace(temp_path, transcript_path)
+    # The index still describes the moved file
+    os.replace(migrated.index_path, transcript_path + ".idx")
+
+
+def save_summary(window: ContextWindow, save_dir_path: str) -> None:
+    """
+    Save the summary of the chat to summary.json, if it has one.
+    :param window: The ContextWindow of the chat.
+    :param save_dir_path: The save directory of the chat.
+    """
+    summary = window.summary_record()
+    if summary is not None:
+        save_json(summary, save_dir_path + "/summary.json")
+
+
+def load_context_window(args: Namespace, transcript: ChatTranscript, temperature: float) -> ContextWindow:
+    """
+    Load a chat into a ContextWindow, that retrieves the older messages most relevant to each prompt by embedding,
+    with its summary, if it has one and summaries are on. The messages are read from the transcript as they are
+    needed, and the new ones are appended to it.
+    :param args: The parsed arguments.
+    :param transcript: The transcript of the chat.
+    :param temperature: The temperature to use for the summaries.
+    :return: The ContextWindow.
+    """
+    window = ContextWindow(
+        MODEL_NAME,
+        reply_tokens=args.reply_tokens,
+        budget=args.context_budget,
+        summarizer=make_summarizer(temperature) if args.summarize else None,
+        retriever=ChatMemory(store_dir=args.save_dir_path + "/embeddings"),
+        messages=transcript,
+    )
+    if args.summarize:
+        try:
+            summary = load_json(args.save_dir_path + "/summary.json")
+            window.set_summary(summary["summary"], summary["covers"])
+        except FileNotFoundError:
+            pass
+    return window
+
 
 def main():
     args = parse_args()
     temperature = get_valid_temperature(args.temperature)
-    try:
-        all_messages = load_json(args.save_dir_path + "/messages.json")
-    except FileNotFoundError:
-        all_messages = []
-    messages = all_messages
-    for message in messages:
+    transcript_path = args.save_dir_path + "/messages.jsonl"
+    if not os.path.exists(transcript_path):
+        migrate_messages_json(args.save_dir_path, transcript_path)
+    # Each turn is appended to the transcript, and a snapshot of the whole chat is written every so often
+    transcript = ChatTranscript(transcript_path, fsync=args.fsync, snapshot_path=args.save_dir_path + "/messages.json")
+    if len(transcript) > RESUME_PRINT_COUNT:
+        print(f"... {len(transcript) - RESUME_PRINT_COUNT} earlier messages")
+    for message in transcript[-RESUME_PRINT_COUNT:]:
         if message["role"] == "user":
             print(fg(0, 1, 0) + message["content"] + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
         elif message["role"] == "system":
             print(fg(0.5, 0.5, 0.9) + "SYSTEM: " + message["content"] + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
         else:
             print(fg(0, 1, 1) + message["content"] + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
-    for idx, message in enumerate(all_messages):
-        if message["role"] == "user" and message["content"] == SYSTEM_MESSAGE:
-            messages = all_messages[max(idx - 4, 0) :]
+    # Each message is counted once, as it is first needed, rather than the whole chat on every turn
+    window = load_context_window(args, transcript, temperature)
     user_prompt = multiline_input()
     while user_prompt != "exit":
-        token_count = count_messages_tokens(messages)
-        print_pricing_message(token_count)
-        if token_count > 6500:
-            print("\n\n\n   ======== TRUNCATING CHAT =========  \n\n\n")
-            full_text, messages = get_completion(SYSTEM_MESSAGE, messages, temperature=temperature)
-            all_messages.append(messages[-2])
-            all_messages.append(messages[-1])
-            messages = messages[-6:]
+        messages, token_count = window.pack(user_prompt)
+        print_pricing_message(token_count, MODEL_NAME)
         full_text, messages = get_completion(user_prompt, messages, temperature=temperature)
-        all_messages.append(messages[-2])
-        all_messages.append(messages[-1])
-        json_filename = args.save_dir_path + f"/messages_{get_fs_safe_timestamp()}.json"
-        save_json(all_messages, json_filename)
-        save_json(all_messages, args.save_dir_path + "/messages.json")
+        # Appends the prompt and the reply to the transcript
+        window.extend(messages[-2:])
+        # The summary is written while the user types the next prompt, and used once it is ready
+        window.summarize_in_background()
+        save_summary(window, args.save_dir_path)
         user_prompt = multiline_input()
+    if window.is_summarizing:
+        print("Waiting for the summary of the chat...")
+        # A summary that finishes after the last turn would otherwise be paid for, and lost
+        window.wait_for_summary(SUMMARY_EXIT_TIMEOUT)
+    save_summary(window, args.save_dir_path)
+    transcript.snapshot()
+    transcript.close()
 
 
 if __name__ == "__main__":
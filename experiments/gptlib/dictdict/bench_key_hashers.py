@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Benchmarks hashing DictDict keys shaped like the script_writer keys, a prompt and the conversation so far, at
+about 1KB, 12KB and 100KB: json.dumps and SHA-256 as DictDict.generate_hash used to run them, each key hasher,
+a get_completion style lookup, contains then get then contains, with the key hashed on each operation or
+once with hash_key, and appending the prompt to the ConversationKey of the conversation, which hashes only the
+new message.
+
+Usage:
+    python -m experiments.gptlib.dictdict.bench_key_hashers --sizes-kb 1 12 100
+"""
+import argparse
+import hashlib
+import json
+import timeit
+
+from experiments.gptlib.dictdict.conversation_key import ConversationKey
+from experiments.gptlib.dictdict.dictdict import DictDict
+from experiments.gptlib.dictdict.key_hashers import Blake2bKeyHasher, Sha256KeyHasher, XxHashKeyHasher, xxhash
+
+MESSAGE_CONTENT = "Write a Python function that returns the nth fibonacci number, with memoization.\n"
+
+
+def make_key(size_kb: int) -> dict:
+    """
+    Make a key shaped like a script_writer key, of roughly the given size once serialized.
+    :param size_kb: the approximate size of the key, in KB.
+    :return: the key.
+    """
+    messages = []
+    while len(json.dumps(messages)) < size_kb * 1024:
+        role = "user" if len(messages) % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": MESSAGE_CONTENT * 4})
+    return {"prompt": "Now add type hints.", "initial_messages": messages}
+
+
+def original_generate_hash(d: dict) -> str:
+    """
+    DictDict.generate_hash as it was before the key hashers, kept as the baseline.
+    """
+    return hashlib.sha256(json.dumps(d, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def time_microseconds(function, number: int) -> float:
+    """
+    Time a function, keeping the best of 5 runs.
+    :param function: the function to time.
+    :param number: the number of calls per run.
+    :return: the time of one call, in microseconds.
+    """
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def lookup(store: DictDict, key) -> None:
+    """
+    The lookups of script_writer.get_completion on a cache hit.
+    """
+    if key in store:
+        _ = store[key]
+    if key not in store:
+        pass
+
+
+def main():
+    """
+    The main function for the key hashers benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark hashing DictDict keys.")
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[1, 12, 100], help="The approximate key sizes, in KB.")
+    args = parser.parse_args()
+
+    hashers = [Sha256KeyHasher(), Blake2bKeyHasher()]
+    if xxhash is not None:
+        hashers.append(XxHashKeyHasher())
+    else:
+        print("xxhash is not installed, skipping the XxHashKeyHasher")
+
+    names = ["original"] + [hasher.name for hasher in hashers] + ["lookup", "hash once", "append"]
+    print(f"{'key':>8} " + " ".join(f"{name:>10}" for name in names) + "   (microseconds)")
+    for size_kb in args.sizes_kb:
+        key = make_key(size_kb)
+        number = max(10, 20000 // size_kb)
+        timings = [time_microseconds(lambda: original_generate_hash(key), number)]
+        timings += [time_microseconds(lambda: hasher(key), number) for hasher in hashers]
+        store = DictDict()
+        store[key] = "completion"
+        timings.append(time_microseconds(lambda: lookup(store, key), number))
+        timings.append(time_microseconds(lambda: lookup(store, store.hash_key(key)), number))
+        conversation = ConversationKey.from_messages(key["initial_messages"])
+        prompt_message = {"role": "user", "content": key["prompt"]}
+        timings.append(time_microseconds(lambda: conversation.append(prompt_message), number))
+        key_kb = len(json.dumps(key)) / 1024
+        print(f"{key_kb:>6.1f}KB " + " ".join(f"{timing:>10.1f}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Benchmarks opening a big completion store: replaying the whole log with the LogDictDict, against opening the
+LazyDictDict with its saved index, and without it, when the log has to be scanned. Each open runs in a fresh
+process, so the reported peak RSS is the cost of that open alone. The values look like the streamed completions
+saved by script_writer, a list of small chunks.
+
+Usage:
+    python -m experiments.gptlib.dictdict.bench_lazy_dictdict --size-mb 1024
+"""
+import argparse
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from experiments.gptlib.dictdict.lazy_dictdict import LazyDictDict
+from experiments.gptlib.dictdict.log_dictdict import LogDictDict
+
+WORDS = ["the", "model", "returns", "a", "stream", "of", "chunks", "with", "one", "token", "each", "def", "return"]
+
+
+def make_completion(value_kb: int, rng: random.Random) -> dict:
+    """
+    Make a value shaped like a streamed completion, of roughly the given size once serialized.
+    :param value_kb: the approximate size of the value, in KB.
+    :param rng: the random generator.
+    :return: the value.
+    """
+    chunks = [{"choices": [{"delta": {"content": rng.choice(WORDS) + " "}, "index": 0}]} for _ in range(value_kb * 1024 // 60)]
+    return {"prompt": "benchmark", "initial_messages": [], "completion": chunks}
+
+
+def build_store(log_path: str, size_mb: int, value_kb: int) -> int:
+    """
+    Write a store of roughly the given size.
+    :param log_path: the path of the log.
+    :param size_mb: the approximate size of the log, in MB.
+    :param value_kb: the approximate size of each value, in KB.
+    :return: the number of items.
+    """
+    rng = random.Random(0)
+    completions = [make_completion(value_kb, rng) for _ in range(16)]
+    count = 0
+    with LazyDictDict(log_path) as store:
+        while store._log.tell() < size_mb * 1024 * 1024:
+            store[{"prompt": f"prompt {count}", "initial_messages": []}] = completions[count % len(completions)]
+            count += 1
+    return count
+
+
+def time_open(store_class: type, log_path: str, drop_index: bool) -> dict:
+    """
+    Open the store, read one value twice, and measure it, in a worker process.
+    :param store_class: the LogDictDict class to open.
+    :param log_path: the path of the log.
+    :param drop_index: whether to delete the saved index first.
+    :return: the timings in seconds, and the peak RSS in MB.
+    """
+    if drop_index and os.path.exists(f"{log_path}.idx"):
+        os.remove(f"{log_path}.idx")
+    start = time.perf_counter()
+    store = store_class(log_path)
+    open_seconds = time.perf_counter() - start
+    key = {"prompt": "prompt 1", "initial_messages": []}
+    start = time.perf_counter()
+    _ = store[key]
+    first_get_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    _ = store[key]
+    cached_get_seconds = time.perf_counter() - start
+    # Reading without saving an index keeps the next measurement honest
+    LogDictDict.close(store)
+    return {
+        "open": open_seconds,
+        "first_get": first_get_seconds,
+        "cached_get": cached_get_seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def measure(store_class: type, log_path: str, drop_index: bool) -> dict:
+    """
+    Run time_open in a fresh process.
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(time_open, store_class, log_path, drop_index).result()
+
+
+def main():
+    """
+    The main function for the LazyDictDict benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark opening a big DictDict store.")
+    parser.add_argument("--size-mb", type=int, default=1024, help="The approximate size of the store, in MB.")
+    parser.add_argument("--value-kb", type=int, default=16, help="The approximate size of each stored completion, in KB.")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="bench_lazy_dictdict_")
+    try:
+        log_path = os.path.join(temp_dir, "all_completions.jsonl")
+        start = time.perf_counter()
+        count = build_store(log_path, args.size_mb, args.value_kb)
+        print(f"{count} completions, {os.path.getsize(log_path) / 1024 / 1024:.0f} MB, written in {time.perf_counter() - start:.1f} s")
+        print(f"{'open':>22} {'open':>9} {'first get':>10} {'cached get':>11} {'peak RSS':>10}")
+        runs = [
+            ("LazyDictDict, index", LazyDictDict, False),
+            ("LazyDictDict, no index", LazyDictDict, True),
+            ("LogDictDict, replay", LogDictDict, False),
+        ]
+        for name, store_class, drop_index in runs:
+            result = measure(store_class, log_path, drop_index)
+            if drop_index:
+                # Save the index again for the runs that follow
+                LazyDictDict(log_path).close()
+            print(
+                f"{name:>22} {result['open']:>8.3f}s {result['first_get'] * 1000:>8.2f}ms "
+                f"{result['cached_get'] * 1000:>9.3f}ms {result['peak_rss_mb']:>8.0f}MB"
+            )
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+A cache key for a conversation, that is hashed one message at a time. The digest of a conversation is a hash chain:
+the digest of each message is folded into the digest of the conversation before it, so appending a turn only
+encodes and hashes the new message, instead of the whole history like hashing {"prompt", "initial_messages"}.
+
+A ConversationKey is a HashedKey, so it can be used as is as the key of a DictDict, and as it is a hex string, as
+the key of a DiskCache. It remembers the key of the conversation one message shorter, so the longest prefix of a
+conversation that is in a cache can be found without hashing anything.
+"""
+from typing import Iterable, Iterator, Optional
+
+from experiments.gptlib.dictdict.key_hashers import SHA256_KEY_HASHER, HashedKey, KeyHasher
+
+
+class ConversationKey(HashedKey):
+    """
+    The digest of a conversation, a list of messages, chained one message at a time. It is immutable, appending a
+    message returns a new key that shares this one as its parent.
+    """
+
+    def __new__(cls, digest: str, parent: Optional["ConversationKey"] = None, key_hasher: KeyHasher = SHA256_KEY_HASHER):
+        """
+        Create the ConversationKey, use ConversationKey.root or ConversationKey.from_messages instead.
+        :param digest: the digest of the conversation.
+        :param parent: the key of the conversation without its last message, or None for the empty conversation.
+        :param key_hasher: the key hasher that digests the messages.
+        """
+        key = super().__new__(cls, digest)
+        key.parent = parent
+        key.key_hasher = key_hasher
+        key.length = 0 if parent is None else parent.length + 1
+        return key
+
+    def __getnewargs__(self) -> tuple:
+        return str(self), self.parent, self.key_hasher
+
+    @classmethod
+    def root(cls, key_hasher: KeyHasher = SHA256_KEY_HASHER) -> "ConversationKey":
+        """
+        Get the key of the empty conversation.
+        :param key_hasher: the key hasher that digests the messages.
+        :return: the ConversationKey.
+        """
+        return cls(key_hasher.digest(b""), key_hasher=key_hasher)
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[dict], key_hasher: KeyHasher = SHA256_KEY_HASHER) -> "ConversationKey":
+        """
+        Get the key of a conversation.
+        :param messages: the messages of the conversation.
+        :param key_hasher: the key hasher that digests the messages.
+        :return: the ConversationKey.
+        """
+        return cls.root(key_hasher).extend(messages)
+
+    def append(self, message: dict) -> "ConversationKey":
+        """
+        Get the key of this conversation followed by the given message, hashing only that message.
+        :param message: the message, it must be JSON serializable.
+        :return: the ConversationKey.
+        """
+        message_digest = self.key_hasher(message)
+        digest = self.key_hasher.digest(f"{self}:{message_digest}".encode("ascii"))
+        return ConversationKey(digest, self, self.key_hasher)
+
+    def extend(self, messages: Iterable[dict]) -> "ConversationKey":
+        """
+        Get the key of this conversation followed by the given messages.
+        :param messages: the messages.
+        :return: the ConversationKey.
+        """
+        key = self
+        for message in messages:
+            key = key.append(message)
+        return key
+
+    def prefixes(self) -> Iterator["ConversationKey"]:
+        """
+        Iterate over the keys of the prefixes of this conversation, from this one down to the empty conversation.
+        :return: the ConversationKeys, longest first.
+        """
+        key = self
+        while key is not None:
+            yield key
+            key = key.parent
+
+    def longest_cached_prefix(self, cache) -> Optional["ConversationKey"]:
+        """
+        Find the longest prefix of this conversation that is a key of the cache, to resume a conversation that
+        diverged from a cached one where they last agreed.
+        :param cache: a DictDict, a DiskCache, or anything that supports `key in cache`.
+        :return: the ConversationKey of the prefix, or None if no prefix is cached.
+        """
+        for key in self.prefixes():
+            if key in cache:
+                return key
+        return None
@@ -3,51 +3,71 @@
 I want to write a class called "DictDict" that subclasses collections.UserDict, uses "self.data", but accepts keys that are themselves dictionaries, and the key might be huge, more than 12KB. I also want the DictDict class to have a function "DictDict.load(file_path:str)" that loads a saved DictDict from a file into a new DictDict object, and also a save(file_path:str) function that saves the self dictdict to the specified file.
 """
 import collections
-import hashlib
 import json
+from typing import Optional, Union
+
+from experiments.gptlib.dictdict.key_hashers import SHA256_KEY_HASHER, HashedKey, KeyHasher
 
 
 class DictDict(collections.UserDict):
     """
     A dictionary-like class that subclasses collections.UserDict.
-    This class accepts keys that are dictionaries.
+    This class accepts keys that are dictionaries, or the HashedKey of a dictionary, from hash_key.
     """
 
-    def __getitem__(self, key: dict) -> any:
+    def __init__(self, key_hasher: Optional[KeyHasher] = None):
+        """
+        Initialize the DictDict.
+        :param key_hasher: the key hasher, the SHA-256 one by default.
+        """
+        self.key_hasher = key_hasher if key_hasher is not None else SHA256_KEY_HASHER
+        super().__init__()
+
+    def hash_key(self, key: Union[dict, HashedKey]) -> HashedKey:
+        """
+        Hash the key once, so it can be used for several operations without being hashed again.
+        :param key: The dictionary key, or its HashedKey
+        :return: The HashedKey
+        """
+        if isinstance(key, HashedKey):
+            return key
+        return HashedKey(self.key_hasher(key))
+
+    def __getitem__(self, key: Union[dict, HashedKey]) -> any:
         """
         Get the value associated with the given key (which is a dictionary)
         :param key: The dictionary key
         :return: The value associated with the key
         """
-        hashed_key = DictDict.generate_hash(key)
+        hashed_key = self.hash_key(key)
         return self.data[hashed_key]
 
-    def __setitem__(self, key: dict, value: any) -> None:
+    def __setitem__(self, key: Union[dict, HashedKey], value: any) -> None:
         """
         Set the value associated with the given key (which is a dictionary)
         :param key: The dictionary key
         :param value: The value to be set
         :return: None
         """
-        hashed_key = DictDict.generate_hash(key)
+        hashed_key = self.hash_key(key)
         self.data[hashed_key] = value
 
-    def __delitem__(self, key: dict) -> None:
+    def __delitem__(self, key: Union[dict, HashedKey]) -> None:
         """
         Delete the item with the given key (which is a dictionary)
         :param key: The dictionary key
         :return: None
         """
-        hashed_key = DictDict.generate_hash(key)
+        hashed_key = self.hash_key(key)
         del self.data[hashed_key]
 
-    def __contains__(self, key: dict) -> bool:
+    def __contains__(self, key: Union[dict, HashedKey]) -> bool:
         """
         Checks if a key is in the dictionary
         :param key: The dictionary key
         :return: True if the key is in the dictionary, False otherwise
         """
-        hashed_key = DictDict.generate_hash(key)
+        hashed_key = self.hash_key(key)
         return hashed_key in self.data
 
     def save(self, file_path: str) -> None:
@@ -62,16 +82,11 @@ class DictDict(collections.UserDict):
     @staticmethod
     def generate_hash(d: dict) -> str:
         """
-        Generate a hash for the given dictionary.
+        Generate the SHA-256 hash for the given dictionary, the hash of the default key hasher.
         :param d: The dictionary to generate a hash for.
         :return: The generated hash as a string.
         """
-        try:
-            json_data = json.dumps(d, sort_keys=True).encode("utf-8")
-        except ValueError as e:
-            # Dictionary is not serializable
-            raise TypeError(str(e))
-        return hashlib.sha256(json_data).hexdigest()
+        return SHA256_KEY_HASHER(d)
 
     @classmethod
     def load(cls, file_path: str) -> "DictDict":
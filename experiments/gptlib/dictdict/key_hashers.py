@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+The key hashers of a DictDict. A key hasher encodes a dictionary key canonically, as JSON with sorted keys, and
+digests the encoding into the hex string that the DictDict stores the value under.
+
+The SHA-256 hasher is the one DictDict always used, its hashes are the ones in the stores already saved, so it
+stays the default. A store must be opened with the hasher that wrote it, or none of its keys will be found.
+
+Hashing a 12KB key mostly costs the JSON encoding, not the digest, so the cheapest hash is the one not computed:
+DictDict.hash_key returns a HashedKey, which the DictDict operations use as is, instead of hashing it again.
+"""
+import abc
+import hashlib
+import json
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+class HashedKey(str):
+    """
+    The digest of a dictionary key, as returned by DictDict.hash_key. It can be passed to a DictDict in place of the
+    key, to skip hashing the key again.
+    """
+
+
+class KeyHasher(abc.ABC):
+    """
+    Hashes dictionary keys, by encoding them with a JSON encoder and digesting the encoding.
+    Subclasses implement digest.
+    """
+
+    name = "abstract"
+
+    def __init__(self, encoder: json.JSONEncoder):
+        """
+        Initialize the KeyHasher.
+        :param encoder: the JSON encoder, it must sort the keys so equal dictionaries have equal encodings.
+        """
+        self.encoder = encoder
+
+    def encode(self, key: dict) -> bytes:
+        """
+        Encode the key canonically.
+        :param key: the dictionary key.
+        :return: the encoding of the key.
+        """
+        try:
+            return self.encoder.encode(key).encode("utf-8")
+        except (ValueError, RecursionError) as e:
+            # Dictionary is not serializable, because it contains itself for instance
+            raise TypeError(str(e))
+
+    @abc.abstractmethod
+    def digest(self, data: bytes) -> str:
+        """
+        Digest the encoding of a key.
+        :param data: the encoding of the key.
+        :return: the digest, as a hex string.
+        """
+
+    def __call__(self, key: dict) -> str:
+        """
+        Hash the key.
+        :param key: the dictionary key.
+        :return: the digest, as a hex string.
+        """
+        return self.digest(self.encode(key))
+
+
+class Sha256KeyHasher(KeyHasher):
+    """
+    The original DictDict hashing, SHA-256 of json.dumps(key, sort_keys=True). The encoder is built once, instead of
+    on every json.dumps call, and encodes byte for byte like json.dumps.
+    """
+
+    name = "sha256"
+
+    def __init__(self):
+        super().__init__(json.JSONEncoder(sort_keys=True))
+
+    def digest(self, data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+
+class Blake2bKeyHasher(KeyHasher):
+    """
+    A 128 bit BLAKE2b of the compact JSON encoding of the key, which skips the whitespace and the circular reference
+    checks of json.dumps.
+    """
+
+    name = "blake2b"
+
+    def __init__(self):
+        super().__init__(json.JSONEncoder(sort_keys=True, separators=(",", ":"), check_circular=False))
+
+    def digest(self, data: bytes) -> str:
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class XxHashKeyHasher(KeyHasher):
+    """
+    A 128 bit XXH3 of the compact JSON encoding of the key. It is not a cryptographic hash, and needs the xxhash
+    package.
+    """
+
+    name = "xxh3"
+
+    def __init__(self):
+        if xxhash is None:
+            raise ImportError("The XxHashKeyHasher needs the xxhash package, install it with: pip install xxhash")
+        super().__init__(json.JSONEncoder(sort_keys=True, separators=(",", ":"), check_circular=False))
+
+    def digest(self, data: bytes) -> str:
+        return xxhash.xxh3_128_hexdigest(data)
+
+
+SHA256_KEY_HASHER = Sha256KeyHasher()
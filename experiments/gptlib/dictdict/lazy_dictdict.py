@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+A read-through LogDictDict, that opens without reading any value. Opening only loads the index of where the last
+record of each hashed key is in the log, and a value is parsed from the memory-mapped log the first time it is
+read, then kept in a small LRU cache.
+
+The index is saved next to the log, as <log>.idx, when the store is closed or compacted. It remembers how much of
+the log it covers, so records appended after it was saved, by a process that crashed for instance, are indexed
+by scanning only the end of the log. Without a usable index, the whole log is scanned, but the values are still
+not parsed: the records are written by LogDictDict, so the hash can be sliced out of each line.
+"""
+import json
+import mmap
+import os
+import pickle
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, Optional, Tuple
+
+from experiments.gptlib.dictdict.key_hashers import KeyHasher
+from experiments.gptlib.dictdict.log_dictdict import LogDictDict
+
+DEFAULT_CACHE_SIZE = 256
+RECORD_PREFIX = b'{"h":"'
+TOMBSTONE_SUFFIX = b',"d":true}\n'
+
+
+class LazyValues(MutableMapping):
+    """
+    The self.data of a LazyDictDict: a mapping from hashed keys to values, that knows where each value is in the
+    log, and parses it on demand.
+    """
+
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE):
+        """
+        Initialize the LazyValues.
+        :param cache_size: the number of parsed values to keep in the LRU cache.
+        """
+        self.locations: Dict[str, Tuple[int, int]] = {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._mmap: Optional[mmap.mmap] = None
+        self._log_file = None
+
+    def attach(self, log_file) -> None:
+        """
+        Read the values from the given log file, opened for reading in binary mode.
+        :param log_file: the log file.
+        """
+        self.detach()
+        self._log_file = log_file
+
+    def detach(self) -> None:
+        """
+        Stop reading from the log file, and close it.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def read_record(self, offset: int, length: int) -> bytes:
+        """
+        Read the bytes of a record from the memory-mapped log. The log is mapped again when it has grown past the
+        end of the current mapping.
+        :param offset: the offset of the record.
+        :param length: the length of the record.
+        :return: the bytes of the record.
+        """
+        if self._mmap is None or offset + length > len(self._mmap):
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap[offset:offset + length]
+
+    def put(self, hashed_key: str, location: Tuple[int, int], value: any) -> None:
+        """
+        Remember where the value of a hashed key is in the log, and cache the value.
+        :param hashed_key: the hashed key.
+        :param location: the offset and the length of the record.
+        :param value: the value.
+        """
+        self.locations[hashed_key] = location
+        self._remember(hashed_key, value)
+
+    def _remember(self, hashed_key: str, value: any) -> None:
+        """
+        Add a value to the LRU cache, evicting the least recently used one if the cache is full.
+        :param hashed_key: the hashed key.
+        :param value: the value.
+        """
+        self._cache[hashed_key] = value
+        self._cache.move_to_end(hashed_key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def __getitem__(self, hashed_key: str) -> any:
+        if hashed_key in self._cache:
+            self._cache.move_to_end(hashed_key)
+            return self._cache[hashed_key]
+        offset, length = self.locations[hashed_key]
+        value = json.loads(self.read_record(offset, length))["v"]
+        self._remember(hashed_key, value)
+        return value
+
+    def __setitem__(self, hashed_key: str, value: any) -> None:
+        raise TypeError("The values of a LazyDictDict are set through the store, so they are appended to the log")
+
+    def __delitem__(self, hashed_key: str) -> None:
+        del self.locations[hashed_key]
+        self._cache.pop(hashed_key, None)
+
+    def __contains__(self, hashed_key: object) -> bool:
+        return hashed_key in self.locations
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.locations)
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+
+class LazyDictDict(LogDictDict):
+    """
+    A LogDictDict that only loads the index of the log when it is opened, and reads the values on first access.
+    """
+
+    def __init__(
+        self, file_path: str, fsync: bool = False, cache_size: int = DEFAULT_CACHE_SIZE, key_hasher: Optional[KeyHasher] = None
+    ):
+        """
+        Open the log at the given path, creating it if needed, and load or rebuild its index.
+        :param file_path: the path of the JSON lines log.
+        :param fsync: whether to fsync after every record, to survive a power loss and not only a crash.
+        :param cache_size: the number of parsed values to keep in the LRU cache.
+        :param key_hasher: the key hasher the log was written with, the SHA-256 one by default.
+        """
+        self.cache_size = cache_size
+        super().__init__(file_path, fsync=fsync, key_hasher=key_hasher)
+        self.data.attach(open(file_path, "rb"))
+
+    @property
+    def index_path(self) -> str:
+        """
+        The path of the index file.
+        """
+        return f"{self.file_path}.idx"
+
+    def _replay(self) -> None:
+        """
+        Load the saved index, and index the records of the log that it does not cover.
+        """
+        self.data = LazyValues(self.cache_size)
+        if not os.path.exists(self.file_path):
+            return
+        scan_from = 0
+        saved = self._load_index()
+        if saved is not None:
+            self.data.locations = saved["locations"]
+            self.record_count = saved["record_count"]
+            scan_from = saved["log_size"]
+        self._scan(scan_from)
+
+    def _load_index(self) -> Optional[dict]:
+        """
+        Load the saved index, if it exists and still describes the log.
+        :return: the saved index, or None.
+        """
+        try:
+            with open(self.index_path, "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        log_stat = os.stat(self.file_path)
+        # A compacted log is a new file, so its inode changed, and a truncated one is shorter than the index says
+        if saved.get("log_inode") != log_stat.st_ino or saved.get("log_size", 0) > log_stat.st_size:
+            return None
+        return saved
+
+    def _scan(self, offset: int) -> None:
+        """
+        Index the records of the log from the given offset. A last record cut short by a crash is truncated away.
+        :param offset: the offset of the first record to index.
+        """
+        locations = self.data.locations
+        with open(self.file_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                if line.startswith(RECORD_PREFIX):
+                    hash_end = line.index(b'"', len(RECORD_PREFIX))
+                    hashed_key = line[len(RECORD_PREFIX):hash_end].decode("ascii")
+                    is_tombstone = line[hash_end + 1:] == TOMBSTONE_SUFFIX
+                else:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    hashed_key = record["h"]
+                    is_tombstone = bool(record.get("d"))
+                if is_tombstone:
+                    locations.pop(hashed_key, None)
+                else:
+                    locations[hashed_key] = (offset, len(line))
+                self.record_count += 1
+                offset += len(line)
+        if offset != os.path.getsize(self.file_path):
+            os.truncate(self.file_path, offset)
+
+    def save_index(self) -> None:
+        """
+        Save the index next to the log, so the next open does not need to scan the log.
+        """
+        self._log.flush()
+        saved = {
+            "log_inode": os.stat(self.file_path).st_ino,
+            "log_size": self._log.tell(),
+            "record_count": self.record_count,
+            "locations": self.data.locations,
+        }
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(saved, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.index_path)
+
+    def _set_hashed(self, hashed_key: str, value: any) -> None:
+        """
+        Append a value to the log, and remember where it is.
+        :param hashed_key: the hash of the dictionary key.
+        :param value: the value, it must be JSON serializable.
+        """
+        location = self._append({"h": hashed_key, "v": value})
+        self.data.put(hashed_key, location, value)
+
+    def compact(self) -> None:
+        """
+        Rewrite the log with one record per live item, copying the records without parsing them, and atomically
+        replace the old log and index with it.
+        """
+        temp_path = f"{self.file_path}.compact"
+        locations = {}
+        with open(temp_path, "wb") as f:
+            for hashed_key, (offset, length) in self.data.locations.items():
+                locations[hashed_key] = (f.tell(), length)
+                f.write(self.data.read_record(offset, length))
+            f.flush()
+            os.fsync(f.fileno())
+        self._log.close()
+        self.data.detach()
+        os.replace(temp_path, self.file_path)
+        self._log = open(self.file_path, "ab")
+        self.data.attach(open(self.file_path, "rb"))
+        self.data.locations = locations
+        self.record_count = len(locations)
+        self.save_index()
+
+    def save(self, file_path: str) -> None:
+        """
+        Save the whole store to a file in the DictDict.save format, reading every value.
+        :param file_path: The path to the file where the DictDict will be saved
+        :return: None
+        """
+        with open(file_path, "w") as f:
+            json.dump(dict(self.data.items()), f)
+
+    def close(self) -> None:
+        """
+        Save the index, and close the log.
+        """
+        if self._log.closed:
+            return
+        self.save_index()
+        self._log.close()
+        self.data.detach()
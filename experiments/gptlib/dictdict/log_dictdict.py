@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+A DictDict that persists itself as an append-only log, so saving a change costs one small write, however big the
+store is, instead of rewriting the whole file like DictDict.save.
+
+The log is a JSON lines file. Setting an item appends {"h": "<hash>", "v": <value>}, and deleting one appends
+the tombstone {"h": "<hash>", "d": true}. Opening the store replays the log, the last record of each hash wins.
+compact rewrites the log with only the live values, dropping the overwritten and deleted ones.
+"""
+import json
+import os
+from typing import Optional, Tuple, Type, Union
+
+from experiments.gptlib.dictdict.dictdict import DictDict
+from experiments.gptlib.dictdict.key_hashers import HashedKey, KeyHasher
+
+
+class LogDictDict(DictDict):
+    """
+    A DictDict that appends every change to a JSON lines log file, and replays the log when it is opened.
+    """
+
+    def __init__(self, file_path: str, fsync: bool = False, key_hasher: Optional[KeyHasher] = None):
+        """
+        Open the log at the given path, creating it if needed, and replay it.
+        :param file_path: the path of the JSON lines log.
+        :param fsync: whether to fsync after every record, to survive a power loss and not only a crash.
+        :param key_hasher: the key hasher the log was written with, the SHA-256 one by default.
+        """
+        super().__init__(key_hasher)
+        self.file_path = file_path
+        self.fsync = fsync
+        self.record_count = 0
+        self._replay()
+        self._log = open(file_path, "ab")
+
+    @classmethod
+    def load(cls, file_path: str) -> "LogDictDict":
+        """
+        Open the log at the given path, creating it if needed.
+        :param file_path: the path of the JSON lines log.
+        :return: the LogDictDict.
+        """
+        return cls(file_path)
+
+    def _replay(self) -> None:
+        """
+        Read every record of the log into self.data. A last record cut short by a crash is truncated away.
+        """
+        if not os.path.exists(self.file_path):
+            return
+        valid_bytes = 0
+        with open(self.file_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("d"):
+                    self.data.pop(record["h"], None)
+                else:
+                    self.data[record["h"]] = record["v"]
+                self.record_count += 1
+                valid_bytes += len(line)
+        if valid_bytes != os.path.getsize(self.file_path):
+            os.truncate(self.file_path, valid_bytes)
+
+    def _append(self, record: dict) -> Tuple[int, int]:
+        """
+        Append a record to the log, and flush it to the operating system.
+        :param record: the record to append.
+        :return: the offset and the length in bytes of the record in the log.
+        """
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        offset = self._log.tell()
+        self._log.write(line)
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self.record_count += 1
+        return offset, len(line)
+
+    def _set_hashed(self, hashed_key: str, value: any) -> None:
+        """
+        Append a value to the log, and keep it under its hashed key.
+        :param hashed_key: the hash of the dictionary key.
+        :param value: the value, it must be JSON serializable.
+        """
+        self._append({"h": hashed_key, "v": value})
+        self.data[hashed_key] = value
+
+    def _delete_hashed(self, hashed_key: str) -> None:
+        """
+        Append a tombstone to the log, and forget the value of the hashed key.
+        :param hashed_key: the hash of the dictionary key.
+        """
+        if hashed_key not in self.data:
+            raise KeyError(hashed_key)
+        self._append({"h": hashed_key, "d": True})
+        del self.data[hashed_key]
+
+    def __setitem__(self, key: Union[dict, HashedKey], value: any) -> None:
+        """
+        Set the value associated with the given key, and append it to the log.
+        :param key: The dictionary key
+        :param value: The value to be set, it must be JSON serializable
+        :return: None
+        """
+        self._set_hashed(self.hash_key(key), value)
+
+    def __delitem__(self, key: Union[dict, HashedKey]) -> None:
+        """
+        Delete the item with the given key, and append a tombstone to the log.
+        :param key: The dictionary key
+        :return: None
+        """
+        self._delete_hashed(self.hash_key(key))
+
+    @property
+    def dead_record_count(self) -> int:
+        """
+        The number of records of the log that compact would drop.
+        """
+        return self.record_count - len(self.data)
+
+    def compact(self) -> None:
+        """
+        Rewrite the log with one record per live item, and atomically replace the old log with it.
+        """
+        temp_path = f"{self.file_path}.compact"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for hashed_key, value in self.data.items():
+                f.write(json.dumps({"h": hashed_key, "v": value}, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._log.close()
+        os.replace(temp_path, self.file_path)
+        self._log = open(self.file_path, "ab")
+        self.record_count = len(self.data)
+
+    def import_json(self, json_path: str) -> int:
+        """
+        Append every item of a store saved with DictDict.save, to migrate it to the log format.
+        :param json_path: the path of the JSON file written by DictDict.save.
+        :return: the number of items imported.
+        """
+        with open(json_path, "r") as f:
+            data = json.load(f)
+        for hashed_key, value in data.items():
+            self._set_hashed(hashed_key, value)
+        return len(data)
+
+    def close(self) -> None:
+        """
+        Close the log file.
+        """
+        self._log.close()
+
+    def __enter__(self) -> "LogDictDict":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def open_migrated(log_path: str, legacy_json_path: Optional[str] = None, store_class: Type[LogDictDict] = LogDictDict) -> LogDictDict:
+    """
+    Open a LogDictDict, first importing the store saved by DictDict.save at legacy_json_path, if the log does not
+    exist yet and the legacy store does. The legacy file is left in place.
+    The import is written to a temporary log, moved into place once complete, so an interrupted import is started
+    over on the next open, instead of leaving a partial log that would never be completed.
+    :param log_path: the path of the JSON lines log.
+    :param legacy_json_path: the path of the legacy JSON store, if any.
+    :param store_class: the LogDictDict class to open, such as the LazyDictDict.
+    :return: the LogDictDict.
+    """
+    needs_migration = legacy_json_path is not None and not os.path.exists(log_path) and os.path.exists(legacy_json_path)
+    if needs_migration:
+        temp_path = f"{log_path}.tmp"
+        # Left behind by an interrupted import
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        with LogDictDict(temp_path) as migrated:
+            migrated.import_json(legacy_json_path)
+            migrated._log.flush()
+            os.fsync(migrated._log.fileno())
+        os.replace(temp_path, log_path)
+    return store_class(log_path)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Tests for the ConversationKey, the cache key of a conversation that is hashed one message at a time.
+"""
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from experiments.gptlib.diskcache.disk_cache import DiskCache
+from experiments.gptlib.dictdict.conversation_key import ConversationKey
+from experiments.gptlib.dictdict.dictdict import DictDict
+from experiments.gptlib.dictdict.key_hashers import Blake2bKeyHasher, HashedKey
+
+MESSAGES = [
+    {"role": "system", "content": "You write Python."},
+    {"role": "user", "content": "Write fib."},
+    {"role": "assistant", "content": "def fib(n): ..."},
+    {"role": "user", "content": "Now add tests."},
+]
+
+
+class TestConversationKey(unittest.TestCase):
+    def test_appending_matches_hashing_the_whole_conversation(self):
+        key = ConversationKey.root()
+        for message in MESSAGES:
+            key = key.append(message)
+        self.assertEqual(ConversationKey.from_messages(MESSAGES), key)
+        self.assertEqual(len(MESSAGES), key.length)
+        self.assertIsInstance(key, HashedKey)
+
+    def test_digest_depends_on_messages_and_order(self):
+        key = ConversationKey.from_messages(MESSAGES)
+        self.assertNotEqual(key, ConversationKey.from_messages(MESSAGES[:-1]))
+        self.assertNotEqual(key, ConversationKey.from_messages(MESSAGES[::-1]))
+        self.assertNotEqual(key, ConversationKey.from_messages(MESSAGES, Blake2bKeyHasher()))
+        reordered = [{"content": message["content"], "role": message["role"]} for message in MESSAGES]
+        self.assertEqual(key, ConversationKey.from_messages(reordered))
+
+    def test_prefixes(self):
+        key = ConversationKey.from_messages(MESSAGES)
+        expected = [ConversationKey.from_messages(MESSAGES[:length]) for length in range(len(MESSAGES), -1, -1)]
+        self.assertEqual(expected, list(key.prefixes()))
+
+    def test_key_of_dictdict(self):
+        dd = DictDict()
+        dd[ConversationKey.from_messages(MESSAGES[:2])] = "completion"
+        self.assertEqual("completion", dd[ConversationKey.root().extend(MESSAGES[:2])])
+
+    def test_longest_cached_prefix(self):
+        dd = DictDict()
+        dd[ConversationKey.from_messages(MESSAGES[:1])] = "short"
+        dd[ConversationKey.from_messages(MESSAGES[:3])] = "long"
+        diverged = ConversationKey.from_messages(MESSAGES[:3] + [{"role": "user", "content": "Now add docs."}])
+        self.assertEqual(ConversationKey.from_messages(MESSAGES[:3]), diverged.longest_cached_prefix(dd))
+        self.assertEqual(1, ConversationKey.from_messages(MESSAGES[:2]).longest_cached_prefix(dd).length)
+        self.assertIsNone(ConversationKey.from_messages(MESSAGES[1:]).longest_cached_prefix(dd))
+
+    def test_key_of_disk_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        cache = DiskCache(cache_dir=temp_dir)
+        key = ConversationKey.from_messages(MESSAGES[:2])
+        cache.get(key, lambda: {"completion": "def fib(n): ..."})
+        resumed = key.extend(MESSAGES[2:]).longest_cached_prefix(cache)
+        self.assertEqual(key, resumed)
+        self.assertEqual({"completion": "def fib(n): ..."}, cache.get(resumed, lambda: {}))
+
+    def test_pickle(self):
+        key = ConversationKey.from_messages(MESSAGES, Blake2bKeyHasher())
+        unpickled = pickle.loads(pickle.dumps(key))
+        self.assertEqual(key, unpickled)
+        self.assertEqual(list(key.prefixes()), list(unpickled.prefixes()))
+        self.assertEqual(key.append(MESSAGES[0]), unpickled.append(MESSAGES[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
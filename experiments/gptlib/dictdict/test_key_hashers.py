@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Tests for the key hashers of the DictDict, and for passing a HashedKey in place of the key.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from experiments.gptlib.dictdict.dictdict import DictDict
+from experiments.gptlib.dictdict.key_hashers import (
+    Blake2bKeyHasher,
+    HashedKey,
+    KeyHasher,
+    Sha256KeyHasher,
+    XxHashKeyHasher,
+    xxhash,
+)
+from experiments.gptlib.dictdict.log_dictdict import LogDictDict
+
+KEY = {"prompt": "write fib", "initial_messages": [{"role": "user", "content": "héllo \"world\"\n"}], "n": 1.5}
+
+
+class TestKeyHashers(unittest.TestCase):
+    def hashers(self) -> list:
+        hashers = [Sha256KeyHasher(), Blake2bKeyHasher()]
+        if xxhash is not None:
+            hashers.append(XxHashKeyHasher())
+        return hashers
+
+    def test_sha256_matches_the_original_hash(self):
+        original = hashlib.sha256(json.dumps(KEY, sort_keys=True).encode("utf-8")).hexdigest()
+        self.assertEqual(original, Sha256KeyHasher()(KEY))
+        self.assertEqual(original, DictDict.generate_hash(KEY))
+
+    def test_hashes_are_canonical(self):
+        reordered = {"n": 1.5, "initial_messages": [{"content": "héllo \"world\"\n", "role": "user"}], "prompt": "write fib"}
+        for hasher in self.hashers():
+            with self.subTest(hasher.name):
+                self.assertEqual(hasher(KEY), hasher(reordered))
+                self.assertNotEqual(hasher(KEY), hasher({**KEY, "n": 2}))
+
+    def test_circular_key_raises_type_error(self):
+        circular = {"a": "b"}
+        circular["c"] = circular
+        for hasher in self.hashers():
+            with self.subTest(hasher.name):
+                with self.assertRaises(TypeError):
+                    hasher(circular)
+
+    def test_hasher_without_digest_cannot_be_created(self):
+        class IncompleteKeyHasher(KeyHasher):
+            name = "incomplete"
+
+        with self.assertRaises(TypeError):
+            IncompleteKeyHasher(json.JSONEncoder(sort_keys=True))
+
+    @unittest.skipIf(xxhash is not None, "xxhash is installed")
+    def test_xxhash_needs_the_package(self):
+        with self.assertRaises(ImportError):
+            XxHashKeyHasher()
+
+
+class TestHashedKey(unittest.TestCase):
+    def test_hashed_key_is_not_hashed_again(self):
+        calls = []
+
+        class CountingKeyHasher(Blake2bKeyHasher):
+            def __call__(self, key: dict) -> str:
+                calls.append(key)
+                return super().__call__(key)
+
+        dd = DictDict(CountingKeyHasher())
+        key = dd.hash_key(KEY)
+        self.assertIsInstance(key, HashedKey)
+        self.assertIs(key, dd.hash_key(key))
+        dd[key] = "value"
+        self.assertTrue(key in dd)
+        self.assertEqual("value", dd[key])
+        del dd[key]
+        self.assertEqual(1, len(calls))
+
+    def test_hashed_key_and_key_are_interchangeable(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        log_path = os.path.join(temp_dir, "store.jsonl")
+        with LogDictDict(log_path, key_hasher=Blake2bKeyHasher()) as store:
+            store[store.hash_key(KEY)] = "value"
+        with LogDictDict(log_path, key_hasher=Blake2bKeyHasher()) as store:
+            self.assertEqual("value", store[KEY])
+            del store[KEY]
+            self.assertFalse(store.hash_key(KEY) in store)
+
+
+if __name__ == "__main__":
+    unittest.main()
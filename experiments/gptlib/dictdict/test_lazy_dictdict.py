@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Tests for the LazyDictDict, the LogDictDict that reads its values from the memory-mapped log on first access.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from experiments.gptlib.dictdict.dictdict import DictDict
+from experiments.gptlib.dictdict.lazy_dictdict import LazyDictDict
+from experiments.gptlib.dictdict.log_dictdict import LogDictDict
+
+
+class TestLazyDictDict(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.log_path = os.path.join(self.temp_dir, "store.jsonl")
+
+    def open_store(self, **kwargs) -> LazyDictDict:
+        store = LazyDictDict(self.log_path, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def fill(self, store: LogDictDict) -> dict:
+        for index in range(20):
+            store[{"index": index}] = {"completion": [index] * index}
+        store[{"index": 3}] = "overwritten"
+        del store[{"index": 4}]
+        expected = {DictDict.generate_hash({"index": index}): {"completion": [index] * index} for index in range(20)}
+        expected[DictDict.generate_hash({"index": 3})] = "overwritten"
+        del expected[DictDict.generate_hash({"index": 4})]
+        return expected
+
+    def test_operations(self):
+        store = self.open_store()
+        store[{1: "a", 2: "b"}] = "test1"
+        self.assertEqual("test1", store[{1: "a", 2: "b"}])
+        self.assertTrue({1: "a", 2: "b"} in store)
+        del store[{1: "a", 2: "b"}]
+        self.assertFalse({1: "a", 2: "b"} in store)
+        with self.assertRaises(KeyError):
+            _ = store[{1: "a", 2: "b"}]
+
+    def test_reads_values_written_by_log_dictdict(self):
+        with LogDictDict(self.log_path) as log_store:
+            expected = self.fill(log_store)
+        store = self.open_store()
+        self.assertFalse(os.path.exists(store.index_path))
+        self.assertEqual(len(expected), len(store))
+        self.assertEqual(expected, dict(store.data.items()))
+
+    def test_opening_does_not_parse_values(self):
+        with LazyDictDict(self.log_path) as writer:
+            expected = self.fill(writer)
+        store = self.open_store(cache_size=4)
+        self.assertEqual(0, len(store.data._cache))
+        self.assertEqual(expected, dict(store.data.items()))
+        self.assertEqual(4, len(store.data._cache))
+
+    def test_index_is_saved_and_caught_up(self):
+        store = LazyDictDict(self.log_path)
+        expected = self.fill(store)
+        store.close()
+        self.assertTrue(os.path.exists(store.index_path))
+
+        # Records appended after the index was saved are found by scanning the end of the log
+        with LogDictDict(self.log_path) as log_store:
+            log_store[{"index": "late"}] = "appended"
+        expected[DictDict.generate_hash({"index": "late"})] = "appended"
+        reopened = self.open_store()
+        self.assertEqual(expected, dict(reopened.data.items()))
+        with LogDictDict(self.log_path) as log_store:
+            self.assertEqual(log_store.record_count, reopened.record_count)
+
+    def test_stale_index_is_rebuilt(self):
+        store = LazyDictDict(self.log_path)
+        self.fill(store)
+        store.close()
+        with LogDictDict(self.log_path) as log_store:
+            log_store.compact()
+            log_store[{"index": "after"}] = "compaction"
+            expected = dict(log_store.data)
+        self.assertEqual(expected, dict(self.open_store().data.items()))
+
+    def test_reads_values_appended_after_open(self):
+        store = self.open_store(cache_size=1)
+        for index in range(5):
+            store[{"index": index}] = "x" * index
+        for index in range(5):
+            self.assertEqual("x" * index, store[{"index": index}])
+
+    def test_compact(self):
+        store = LazyDictDict(self.log_path)
+        expected = self.fill(store)
+        store.compact()
+        self.assertEqual(0, store.dead_record_count)
+        self.assertEqual(expected, dict(store.data.items()))
+        store.close()
+        with LogDictDict(self.log_path) as log_store:
+            self.assertEqual(expected, log_store.data)
+        self.assertEqual(expected, dict(self.open_store().data.items()))
+
+    def test_torn_last_record_is_dropped(self):
+        store = LazyDictDict(self.log_path)
+        store[{"a": 1}] = "kept"
+        store.close()
+        with open(self.log_path, "a") as f:
+            f.write('{"h":"abc","v":"cut sh')
+        self.assertEqual({DictDict.generate_hash({"a": 1}): "kept"}, dict(self.open_store().data.items()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Tests for the LogDictDict, the DictDict that persists itself as an append-only log.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from experiments.gptlib.dictdict.dictdict import DictDict
+from experiments.gptlib.dictdict.log_dictdict import LogDictDict, open_migrated
+
+
+class TestLogDictDict(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.log_path = os.path.join(self.temp_dir, "store.jsonl")
+
+    def open_store(self) -> LogDictDict:
+        store = LogDictDict(self.log_path)
+        self.addCleanup(store.close)
+        return store
+
+    def test_operations(self):
+        store = self.open_store()
+        store[{1: "a", 2: "b"}] = "test1"
+        self.assertEqual("test1", store[{1: "a", 2: "b"}])
+        self.assertTrue({1: "a", 2: "b"} in store)
+        del store[{1: "a", 2: "b"}]
+        with self.assertRaises(KeyError):
+            _ = store[{1: "a", 2: "b"}]
+        with self.assertRaises(KeyError):
+            del store[{1: "a", 2: "b"}]
+
+    def test_reopen_replays_the_log(self):
+        store = self.open_store()
+        store[{"prompt": "one"}] = {"completion": [1, 2]}
+        store[{"prompt": "two"}] = "first"
+        store[{"prompt": "two"}] = "second"
+        store[{"prompt": "three"}] = "deleted"
+        del store[{"prompt": "three"}]
+        store.close()
+
+        reopened = self.open_store()
+        self.assertEqual(store.data, reopened.data)
+        self.assertEqual("second", reopened[{"prompt": "two"}])
+        self.assertFalse({"prompt": "three"} in reopened)
+
+    def test_set_appends_one_line(self):
+        store = self.open_store()
+        for index in range(100):
+            store[{"index": index}] = "x" * 100
+        size_before = os.path.getsize(self.log_path)
+        store[{"index": "new"}] = "y"
+        with open(self.log_path, "rb") as f:
+            f.seek(size_before)
+            appended = f.read()
+        self.assertEqual(1, appended.count(b"\n"))
+        self.assertLess(len(appended), 100)
+
+    def test_torn_last_record_is_dropped(self):
+        store = self.open_store()
+        store[{"a": 1}] = "kept"
+        store.close()
+        with open(self.log_path, "a") as f:
+            f.write('{"h":"abc","v":"cut sh')
+
+        reopened = self.open_store()
+        self.assertEqual({DictDict.generate_hash({"a": 1}): "kept"}, reopened.data)
+        reopened[{"b": 2}] = "after"
+        reopened.close()
+        self.assertEqual(2, len(self.open_store()))
+
+    def test_compact(self):
+        store = self.open_store()
+        for index in range(10):
+            store[{"index": index % 3}] = index
+        del store[{"index": 0}]
+        self.assertEqual(9, store.dead_record_count)
+        data = dict(store.data)
+        store.compact()
+        self.assertEqual(0, store.dead_record_count)
+        with open(self.log_path) as f:
+            self.assertEqual(2, len(f.readlines()))
+        store[{"index": 5}] = "after compaction"
+        store.close()
+        data[DictDict.generate_hash({"index": 5})] = "after compaction"
+        self.assertEqual(data, self.open_store().data)
+
+    def test_open_migrated_imports_the_legacy_json(self):
+        legacy = DictDict()
+        legacy[{1: "a"}] = "test1"
+        legacy[{2: "b"}] = {"completion": ["x"]}
+        json_path = os.path.join(self.temp_dir, "store.json")
+        legacy.save(json_path)
+
+        store = open_migrated(self.log_path, json_path)
+        self.addCleanup(store.close)
+        self.assertEqual(legacy.data, store.data)
+        store.close()
+
+        # Once the log exists, the legacy file is not imported again
+        store = open_migrated(self.log_path, json_path)
+        self.addCleanup(store.close)
+        self.assertEqual(2, store.record_count)
+
+    def test_interrupted_migration_is_started_over(self):
+        legacy = DictDict()
+        for index in range(3):
+            legacy[{"index": index}] = f"value {index}"
+        json_path = os.path.join(self.temp_dir, "store.json")
+        legacy.save(json_path)
+
+        set_hashed = LogDictDict._set_hashed
+        calls = 0
+
+        def interrupted_set_hashed(store, hashed_key, value):
+            nonlocal calls
+            calls += 1
+            if calls == 2:
+                raise KeyboardInterrupt
+            set_hashed(store, hashed_key, value)
+
+        with mock.patch.object(LogDictDict, "_set_hashed", interrupted_set_hashed):
+            with self.assertRaises(KeyboardInterrupt):
+                open_migrated(self.log_path, json_path)
+        self.assertFalse(os.path.exists(self.log_path))
+
+        store = open_migrated(self.log_path, json_path)
+        self.addCleanup(store.close)
+        self.assertEqual(legacy.data, store.data)
+        self.assertEqual(3, store.record_count)
+        self.assertFalse(os.path.exists(f"{self.log_path}.tmp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmarks the DiskCache storage backends against each other.
+For each key count, it fills a fresh cache with small completion-like entries, then times the writes,
+reopening the cache, and random-order reads of every key, for both the one-file-per-key and the segment layouts.
+
+Usage:
+    python -m experiments.gptlib.diskcache.bench_disk_cache --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from experiments.gptlib.diskcache.disk_cache import DiskCache
+from experiments.gptlib.diskcache.storage import FileStorage, SegmentStorage
+
+STORAGE_FACTORIES = {
+    "files": FileStorage,
+    "segments": SegmentStorage,
+}
+
+
+def make_entry(idx: int) -> dict:
+    """
+    Build a small JSON serializable entry, roughly the shape of a cached completion.
+    :param idx: the number of the entry.
+    :return: the entry.
+    """
+    return {"prompt": f"prompt number {idx}", "completion": "lorem ipsum dolor sit amet " * 8, "tokens": idx % 4096}
+
+
+def bench_storage(storage_name: str, key_count: int) -> dict:
+    """
+    Time writing, reopening and reading back key_count entries with the given storage backend.
+    :param storage_name: the name of the backend in STORAGE_FACTORIES.
+    :param key_count: the number of keys to write and read.
+    :return: the timings in seconds, by phase.
+    """
+    storage_factory = STORAGE_FACTORIES[storage_name]
+    cache_dir = tempfile.mkdtemp(prefix=f"bench_{storage_name}_")
+    keys = [f"key_{idx}" for idx in range(key_count)]
+    try:
+        start = time.perf_counter()
+        cache = DiskCache(storage=storage_factory(cache_dir))
+        for idx, key in enumerate(keys):
+            cache.get(key, lambda: make_entry(idx))
+        cache.close()
+        write_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cache = DiskCache(storage=storage_factory(cache_dir))
+        open_seconds = time.perf_counter() - start
+
+        random.shuffle(keys)
+        start = time.perf_counter()
+        for key in keys:
+            cache.get(key, lambda: make_entry(0))
+        read_seconds = time.perf_counter() - start
+        cache.close()
+    finally:
+        shutil.rmtree(cache_dir)
+    return {"write": write_seconds, "open": open_seconds, "read": read_seconds}
+
+
+def main():
+    """
+    The main function for the DiskCache benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the DiskCache storage backends.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="The key counts to benchmark.")
+    parser.add_argument("--storage", choices=sorted(STORAGE_FACTORIES), nargs="+", default=sorted(STORAGE_FACTORIES), help="The backends to benchmark.")
+    args = parser.parse_args()
+
+    print(f"{'storage':>10} {'keys':>10} {'write s':>10} {'open s':>10} {'read s':>10} {'reads/s':>12}")
+    for key_count in args.sizes:
+        for storage_name in args.storage:
+            timings = bench_storage(storage_name, key_count)
+            reads_per_second = key_count / timings["read"]
+            print(
+                f"{storage_name:>10} {key_count:>10} {timings['write']:>10.2f} {timings['open']:>10.2f} {timings['read']:>10.2f} {reads_per_second:>12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,52 +2,329 @@
 """
 Please write me a python class which will implement an on-disk cache. The DiskCache object should have a `get(key,getter_fn)` function that will return the data saved onto the disk, in the event that the data exists. If it does not exist, then it should call the getter_fn, and write down the result to disk. the getter_fn always returns a JSON serializable dict. The data from each key should be stored in a separate file.
 """
-import os
-import json
-from os.path import realpath
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from experiments.gptlib.diskcache.memory_cache import LRUMemoryCache
+from experiments.gptlib.diskcache.storage import FileStorage
+
+# When the disk is over budget, evict down to this fraction of max_disk_bytes, so the next writes do not evict again.
+EVICTION_LOW_WATER_MARK = 0.9
+
+
+class CacheStats:
+    """
+    Counters describing how well a DiskCache is doing, to help size its memory and disk budgets.
+    """
+
+    def __init__(self):
+        """
+        Initialize every counter to zero.
+        """
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+        self.expirations = 0
+
+    @property
+    def hits(self) -> int:
+        """
+        The number of lookups answered from either the memory or the disk tier.
+        """
+        return self.memory_hits + self.disk_hits
+
+    def as_dict(self) -> dict:
+        """
+        Get the counters as a dictionary, handy for logging.
+        :return: the counter values by name.
+        """
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "memory_evictions": self.memory_evictions,
+            "disk_evictions": self.disk_evictions,
+            "expirations": self.expirations,
+        }
 
 
 class DiskCache:
     """
     A Python class that implements an on-disk cache.
-    Each cached value will be stored in a separate file.
+    By default each cached value will be stored in a separate file, pass a SegmentStorage to pack them instead.
+    Concurrent misses on the same key are coalesced, so the getter_fn only runs once and every caller gets its result.
+    An optional LRU memory tier answers repeated reads without touching the disk, and the disk itself can be bounded
+    by a time-to-live and by a total size, past which the least recently accessed entries are evicted.
     """
 
-    def __init__(self, cache_dir: str = "cache"):
+    def __init__(
+        self,
+        cache_dir: str = "cache",
+        storage=None,
+        memory_max_entries: Optional[int] = None,
+        memory_max_bytes: Optional[int] = None,
+        max_disk_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+    ):
         """
         Initialize the DiskCache object.
         :param cache_dir: cache directory where the cached files will be stored.
+        :param storage: the storage backend to use, defaults to a FileStorage in cache_dir.
+        :param memory_max_entries: the number of entries to keep in memory, the memory tier is off if neither budget is set.
+        :param memory_max_bytes: the total JSON size of the entries to keep in memory.
+        :param max_disk_bytes: the total size of the stored entries, past which the least recently accessed are evicted.
+        :param ttl_seconds: the age after which a stored entry is treated as missing and deleted.
         """
-        self.cache_dir = realpath(cache_dir)
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
+        if storage is None:
+            storage = FileStorage(cache_dir)
+        self.storage = storage
+        self.cache_dir = storage.cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stats = CacheStats()
+        self.memory = None
+        if memory_max_entries is not None or memory_max_bytes is not None:
+            self.memory = LRUMemoryCache(max_entries=memory_max_entries, max_bytes=memory_max_bytes)
+        # An upper bound on the bytes stored on disk, None until the storage has been measured.
+        self._disk_bytes = None
+        self._eviction_lock = threading.Lock()
+        # key -> Future of the getter_fn call that is currently filling it, for the threaded get()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # (event loop, key) -> Task that is currently filling it, for the asyncio aget()
+        self._async_inflight = {}
 
     def _get_cache_path(self, key: str) -> str:
         """
-        Get the cache file path for the given key.
+        Get the cache file path for the given key, only meaningful for the one-file-per-key FileStorage.
         :param key: the key to get the cache file path for.
         :return: the cache file path.
         """
-        return os.path.join(self.cache_dir, f"{key}.json")
+        return self.storage.path_for(key)
+
+    def _lookup(self, key: str) -> Optional[dict]:
+        """
+        Look the key up in the memory tier, then on disk, dropping it from the disk if it has expired.
+        :param key: the key to look up.
+        :return: the cached data, or None if there is none.
+        """
+        data = self._lookup_memory(key)
+        if data is not None:
+            return data
+        return self._lookup_disk(key)
+
+    def _lookup_memory(self, key: str) -> Optional[dict]:
+        """
+        Look the key up in the memory tier only.
+        :param key: the key to look up.
+        :return: the cached data, or None if it is not in memory.
+        """
+        if self.memory is None:
+            return None
+        data = self.memory.get(key)
+        if data is not None:
+            self.stats.memory_hits += 1
+        return data
+
+    def _lookup_disk(self, key: str) -> Optional[dict]:
+        """
+        Look the key up on disk, dropping it if it has expired, and put what is found in the memory tier.
+        :param key: the key to look up.
+        :return: the cached data, or None if there is none.
+        """
+        expires_at = None
+        if self.ttl_seconds is not None:
+            info = self.storage.info(key)
+            if info is None:
+                return None
+            expires_at = info.written_at + self.ttl_seconds
+            if time.time() > expires_at:
+                self.storage.delete(key)
+                self.stats.expirations += 1
+                return None
+        data = self.storage.read(key)
+        if data is None:
+            return None
+        self.stats.disk_hits += 1
+        if self.max_disk_bytes is not None:
+            self.storage.touch(key)
+        self._remember(key, data, expires_at)
+        return data
+
+    def __contains__(self, key: str) -> bool:
+        """
+        Check whether the key is cached and has not expired, without reading its data or counting a hit.
+        :param key: the key to look up.
+        :return: True if get would return the cached data for the key.
+        """
+        info = self.storage.info(key)
+        if info is None:
+            return self.memory is not None and self.memory.get(key) is not None
+        return self.ttl_seconds is None or time.time() <= info.written_at + self.ttl_seconds
+
+    def _remember(self, key: str, data: dict, expires_at: Optional[float]) -> None:
+        """
+        Put the data in the memory tier, if there is one.
+        :param key: the key of the data.
+        :param data: the data.
+        :param expires_at: the unix time when the data expires, or None.
+        """
+        if self.memory is not None:
+            evictions_before = self.memory.evictions
+            self.memory.put(key, data, expires_at)
+            self.stats.memory_evictions += self.memory.evictions - evictions_before
+
+    def _store(self, key: str, data: dict) -> None:
+        """
+        Save freshly fetched data to disk and memory, then evict from the disk if it is over budget.
+        :param key: the key of the data.
+        :param data: the data.
+        """
+        written_bytes = self.storage.write(key, data)
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds is not None else None
+        self._remember(key, data, expires_at)
+        if self.max_disk_bytes is not None:
+            with self._eviction_lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(info.size for info in self.storage.entries())
+                else:
+                    self._disk_bytes += written_bytes
+                over_budget = self._disk_bytes > self.max_disk_bytes
+            if over_budget:
+                self.evict()
+
+    def evict(self) -> None:
+        """
+        Delete the expired entries from the disk, then the least recently accessed ones until the stored entries fit
+        in the disk budget, with some headroom. This runs on its own after writes, but can be called at any time.
+        """
+        with self._eviction_lock:
+            now = time.time()
+            live_entries = []
+            for info in self.storage.entries():
+                if self.ttl_seconds is not None and now > info.written_at + self.ttl_seconds:
+                    self._delete(info.key)
+                    self.stats.expirations += 1
+                else:
+                    live_entries.append(info)
+            total_bytes = sum(info.size for info in live_entries)
+            if self.max_disk_bytes is not None and total_bytes > self.max_disk_bytes:
+                target_bytes = self.max_disk_bytes * EVICTION_LOW_WATER_MARK
+                for info in sorted(live_entries, key=lambda entry: entry.accessed_at):
+                    if total_bytes <= target_bytes:
+                        break
+                    self._delete(info.key)
+                    total_bytes -= info.size
+                    self.stats.disk_evictions += 1
+            self._disk_bytes = total_bytes
+            self.storage.compact()
+
+    def _delete(self, key: str) -> None:
+        """
+        Delete the key from both tiers.
+        :param key: the key to delete.
+        """
+        self.storage.delete(key)
+        if self.memory is not None:
+            self.memory.discard(key)
 
     def get(self, key: str, getter_fn) -> dict:
         """
         Return the data from the disk cache if it exists.
         If it does not exist, call the getter_fn, save the result to disk, and return the result.
+        If another thread is already calling the getter_fn for this key, wait for it and return its result instead.
         :param key: the key to look up in the cache.
         :param getter_fn: the function to call if the data does not exist in the cache.
         :return: the data.
         """
-        cache_path = self._get_cache_path(key)
+        data = self._lookup(key)
+        if data is not None:
+            return data
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                # The previous leader may have finished between our lookup and taking the lock.
+                data = self._lookup(key)
+                if data is not None:
+                    return data
+                future = Future()
+                self._inflight[key] = future
+        if not is_leader:
+            self.stats.coalesced += 1
+            return future.result()
+        try:
+            self.stats.misses += 1
+            data = getter_fn()
+            self._store(key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
 
-        if os.path.exists(cache_path):
-            with open(cache_path, "r") as cache_file:
-                return json.load(cache_file)
+    async def aget(self, key: str, getter_fn) -> dict:
+        """
+        The asyncio version of get, where getter_fn is a coroutine function, or any function returning an awaitable.
+        If another task on this event loop is already filling this key, wait for it and return its result instead.
+        The fill runs in its own task, so cancelling one of the waiting callers does not cancel it for the others.
+        Only the memory tier is looked up on the event loop, the disk is used from a worker thread.
+        :param key: the key to look up in the cache.
+        :param getter_fn: the function to await if the data does not exist in the cache.
+        :return: the data.
+        """
+        data = self._lookup_memory(key)
+        if data is not None:
+            return data
+        # The disk is read, written and evicted from in a worker thread, so other tasks run in the meantime
+        data = await asyncio.to_thread(self._lookup_disk, key)
+        if data is not None:
+            return data
+        loop = asyncio.get_running_loop()
+        inflight_key = (loop, key)
+        task = self._async_inflight.get(inflight_key)
+        if task is None:
+            task = loop.create_task(self._async_fill(inflight_key, getter_fn))
+            self._async_inflight[inflight_key] = task
         else:
-            data = getter_fn()
-            with open(cache_path, "w") as cache_file:
-                json.dump(data, cache_file)
+            self.stats.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _async_fill(self, inflight_key: tuple, getter_fn) -> dict:
+        """
+        Await the getter_fn and save its result, then forget about the in-flight fill.
+        :param inflight_key: the (event loop, key) pair being filled.
+        :param getter_fn: the function to await for the data.
+        :return: the data.
+        """
+        _, key = inflight_key
+        try:
+            # The previous fill may have finished between our lookup and this task starting.
+            data = await asyncio.to_thread(self._lookup, key)
+            if data is None:
+                self.stats.misses += 1
+                data = await getter_fn()
+                await asyncio.to_thread(self._store, key, data)
             return data
+        finally:
+            del self._async_inflight[inflight_key]
+
+    def close(self) -> None:
+        """
+        Release any file handles held by the storage backend.
+        """
+        self.storage.close()
 
 
 if __name__ == "__main__":
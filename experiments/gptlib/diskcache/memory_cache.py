@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+A bounded, in-process least-recently-used cache, used by the DiskCache as a tier in front of the disk.
+The budget can be a number of entries, a number of bytes, or both. The size of a value is the length of its JSON.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class LRUMemoryCache:
+    """
+    An in-memory cache that evicts its least recently used entries once it is over budget.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        """
+        Initialize the LRUMemoryCache.
+        :param max_entries: the maximum number of entries to keep, or None for no limit.
+        :param max_bytes: the maximum total JSON size of the values to keep, or None for no limit.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        # key -> (value, size in bytes, unix time after which it has expired or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get the value for the given key, marking it as the most recently used.
+        :param key: the key to look up.
+        :return: the value, or None if it is not cached or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, _, expires_at = entry
+            if expires_at is not None and time.time() > expires_at:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, expires_at: Optional[float] = None) -> None:
+        """
+        Cache the value for the given key, evicting the least recently used entries if that goes over budget.
+        A value larger than the whole byte budget is not cached.
+        :param key: the key to cache.
+        :param value: the JSON serializable value.
+        :param expires_at: the unix time after which the value should no longer be returned, or None.
+        """
+        size = len(json.dumps(value)) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+            while (self.max_entries is not None and len(self._entries) > self.max_entries) or (
+                self.max_bytes is not None and self.total_bytes > self.max_bytes
+            ):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        """
+        Remove the value for the given key, if it is cached.
+        :param key: the key to remove.
+        """
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        """
+        Remove the value for the given key, if it is cached. The caller must hold the lock.
+        :param key: the key to remove.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
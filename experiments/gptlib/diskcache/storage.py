@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+"""
+Storage backends for the DiskCache. A backend knows how to read, write and check for the serialized data of a key.
+The FileStorage keeps the original one-JSON-file-per-key layout, and the SegmentStorage packs every entry into a few
+append-only segment files, with an in-memory index of where each key's latest record lives.
+"""
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from os.path import realpath
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+# Each record in a segment file is a fixed header followed by the UTF-8 key and the JSON value.
+# The header holds the CRC32 of the value bytes, the unix time it was written, the key length and the value length.
+RECORD_HEADER = struct.Struct("<IdHI")
+# A value length of TOMBSTONE marks a record that deletes the key, it has no value bytes.
+TOMBSTONE = 0xFFFFFFFF
+SEGMENT_NAME_REGEX = re.compile(r"^segment_(\d{6})\.log$")
+DEFAULT_MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+
+
+class EntryInfo(NamedTuple):
+    """
+    The metadata of a stored entry, used to decide what to evict.
+    """
+
+    key: str
+    size: int
+    written_at: float
+    accessed_at: float
+
+
+class FileStorage:
+    """
+    Stores each cached value in a separate `{key}.json` file inside the cache directory.
+    The write time is the file's mtime, and the last access time is its atime, which touch() sets explicitly
+    so that it does not depend on how the filesystem is mounted.
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Initialize the FileStorage.
+        :param cache_dir: the directory where the cached files will be stored.
+        """
+        self.cache_dir = realpath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        """
+        Get the cache file path for the given key.
+        :param key: the key to get the cache file path for.
+        :return: the cache file path.
+        """
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path_for(key))
+
+    def read(self, key: str) -> Optional[dict]:
+        """
+        Read the data saved for the given key.
+        :param key: the key to read.
+        :return: the deserialized data, or None if the key has not been stored.
+        """
+        try:
+            with open(self.path_for(key), "r") as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: dict) -> int:
+        """
+        Save the data for the given key, replacing anything previously stored for it.
+        The data is written to a temporary file that is then renamed over the cache file,
+        so a concurrent reader sees either the old file, or the complete new one.
+        The temporary file name is unique per process and thread, which is much cheaper than tempfile.mkstemp.
+        :param key: the key to write.
+        :param data: the JSON serializable data to save.
+        :return: the number of bytes written.
+        """
+        temp_path = os.path.join(self.cache_dir, f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(temp_path, "w") as cache_file:
+                json.dump(data, cache_file)
+                size = cache_file.tell()
+            os.replace(temp_path, self.path_for(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return size
+
+    def delete(self, key: str) -> None:
+        """
+        Delete the data saved for the given key, if there is any.
+        :param key: the key to delete.
+        """
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    def info(self, key: str) -> Optional[EntryInfo]:
+        """
+        Get the metadata of the entry for the given key.
+        :param key: the key to look up.
+        :return: the entry's metadata, or None if the key has not been stored.
+        """
+        try:
+            stat_result = os.stat(self.path_for(key))
+        except FileNotFoundError:
+            return None
+        return EntryInfo(key, stat_result.st_size, stat_result.st_mtime, stat_result.st_atime)
+
+    def touch(self, key: str) -> None:
+        """
+        Record that the entry for the given key has just been accessed, leaving its write time alone.
+        :param key: the key that was accessed.
+        """
+        cache_path = self.path_for(key)
+        try:
+            stat_result = os.stat(cache_path)
+            os.utime(cache_path, ns=(time.time_ns(), stat_result.st_mtime_ns))
+        except FileNotFoundError:
+            pass
+
+    def entries(self) -> Iterator[EntryInfo]:
+        """
+        List the metadata of every stored entry.
+        :return: an iterator over the entries, in no particular order.
+        """
+        with os.scandir(self.cache_dir) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name.endswith(".json") and not dir_entry.name.startswith("."):
+                    stat_result = dir_entry.stat()
+                    yield EntryInfo(dir_entry.name[: -len(".json")], stat_result.st_size, stat_result.st_mtime, stat_result.st_atime)
+
+    def compact(self, force: bool = False) -> None:
+        """
+        Nothing to compact, deleting a file releases its space straight away.
+        :param force: ignored.
+        """
+
+    def close(self) -> None:
+        """
+        Nothing to release, every operation opens and closes its own file.
+        """
+
+
+class SegmentStorage:
+    """
+    Stores cached values as records appended to a small number of segment files.
+    Only the newest segment is ever written to, once it grows past max_segment_bytes a new one is started.
+    The location of each key's latest record is kept in memory, and rebuilt from the record headers on startup,
+    so a lookup never touches the filesystem metadata and a read is a single seek and read.
+    Deleting a key appends a tombstone record, and the space used by dead records is reclaimed by compact().
+    Access times are only tracked in memory, after a restart they start out equal to the write times.
+    The file handles are shared, so reads and writes are serialized with a lock.
+    """
+
+    def __init__(self, cache_dir: str, max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES):
+        """
+        Initialize the SegmentStorage, and index any segments already present in the cache directory.
+        :param cache_dir: the directory where the segment files will be stored.
+        :param max_segment_bytes: the size after which the active segment is closed and a new one is started.
+        """
+        self.cache_dir = realpath(cache_dir)
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # key -> [segment number, record offset, record length, written at, accessed at]
+        self._index: Dict[str, List] = {}
+        self._readers = {}
+        self._lock = threading.Lock()
+        # The bytes of records that have been overwritten or deleted, and could be reclaimed by compact().
+        self.dead_bytes = 0
+        segment_numbers = sorted(self._list_segments())
+        for segment_number in segment_numbers:
+            self._index_segment(segment_number)
+        self._active_number = segment_numbers[-1] if segment_numbers else 0
+        self._writer = open(self._segment_path(self._active_number), "ab")
+
+    @property
+    def live_bytes(self) -> int:
+        """
+        The bytes of the records that are still the latest for their key.
+        """
+        return sum(location[2] for location in self._index.values())
+
+    def _segment_path(self, segment_number: int) -> str:
+        """
+        Get the path of the segment file with the given number.
+        :param segment_number: the number of the segment.
+        :return: the segment file path.
+        """
+        return os.path.join(self.cache_dir, f"segment_{segment_number:06d}.log")
+
+    def _list_segments(self) -> Iterator[int]:
+        """
+        List the numbers of the segment files in the cache directory.
+        :return: an iterator over the segment numbers, in no particular order.
+        """
+        for filename in os.listdir(self.cache_dir):
+            match = SEGMENT_NAME_REGEX.match(filename)
+            if match:
+                yield int(match.group(1))
+
+    def _index_segment(self, segment_number: int) -> None:
+        """
+        Add every record of a segment to the index, reading only the record headers and keys.
+        A record cut short by a crash can only be at the end of the segment, it is truncated away.
+        :param segment_number: the number of the segment to index.
+        """
+        segment_path = self._segment_path(segment_number)
+        segment_size = os.path.getsize(segment_path)
+        offset = 0
+        with open(segment_path, "rb") as segment_file:
+            while offset + RECORD_HEADER.size <= segment_size:
+                segment_file.seek(offset)
+                _, written_at, key_length, value_length = RECORD_HEADER.unpack(segment_file.read(RECORD_HEADER.size))
+                record_end = offset + RECORD_HEADER.size + key_length + (0 if value_length == TOMBSTONE else value_length)
+                if record_end > segment_size:
+                    break
+                key = segment_file.read(key_length).decode("utf-8")
+                self._forget(key)
+                if value_length == TOMBSTONE:
+                    self.dead_bytes += record_end - offset
+                else:
+                    self._index[key] = [segment_number, offset, record_end - offset, written_at, written_at]
+                offset = record_end
+        if offset < segment_size:
+            with open(segment_path, "r+b") as segment_file:
+                segment_file.truncate(offset)
+
+    def _forget(self, key: str) -> None:
+        """
+        Drop the key from the index, counting its record as dead.
+        :param key: the key to drop.
+        """
+        location = self._index.pop(key, None)
+        if location is not None:
+            self.dead_bytes += location[2]
+
+    def _reader(self, segment_number: int):
+        """
+        Get a cached read handle for the given segment.
+        :param segment_number: the number of the segment.
+        :return: a binary file object opened for reading.
+        """
+        reader = self._readers.get(segment_number)
+        if reader is None:
+            reader = open(self._segment_path(segment_number), "rb")
+            self._readers[segment_number] = reader
+        return reader
+
+    def _read_record(self, segment_number: int, record_offset: int, record_length: int) -> bytes:
+        """
+        Read the raw bytes of a record. The caller must hold the lock.
+        :param segment_number: the number of the segment holding the record.
+        :param record_offset: the offset of the record in the segment.
+        :param record_length: the length of the record, header included.
+        :return: the record bytes.
+        """
+        reader = self._reader(segment_number)
+        reader.seek(record_offset)
+        return reader.read(record_length)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def read(self, key: str) -> Optional[dict]:
+        """
+        Read the data saved for the given key.
+        A record that fails its checksum is treated as if it had never been stored.
+        :param key: the key to read.
+        :return: the deserialized data, or None if the key has not been stored.
+        """
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            record = self._read_record(*location[:3])
+        checksum, _, key_length, _ = RECORD_HEADER.unpack_from(record)
+        value_bytes = record[RECORD_HEADER.size + key_length :]
+        if zlib.crc32(value_bytes) != checksum:
+            return None
+        return json.loads(value_bytes)
+
+    def _append(self, key: str, value_bytes: Optional[bytes]) -> List:
+        """
+        Append a record to the active segment. The caller must hold the lock.
+        :param key: the key of the record.
+        :param value_bytes: the serialized value, or None to append a tombstone.
+        :return: the index entry of the new record.
+        """
+        key_bytes = key.encode("utf-8")
+        written_at = time.time()
+        if value_bytes is None:
+            header = RECORD_HEADER.pack(0, written_at, len(key_bytes), TOMBSTONE)
+            value_bytes = b""
+        else:
+            header = RECORD_HEADER.pack(zlib.crc32(value_bytes), written_at, len(key_bytes), len(value_bytes))
+        record = header + key_bytes + value_bytes
+        if self._writer.tell() >= self.max_segment_bytes:
+            self._rotate()
+        record_offset = self._writer.tell()
+        self._writer.write(record)
+        self._writer.flush()
+        return [self._active_number, record_offset, len(record), written_at, written_at]
+
+    def write(self, key: str, data: dict) -> int:
+        """
+        Append a record for the given key to the active segment, and point the index at it.
+        :param key: the key to write.
+        :param data: the JSON serializable data to save.
+        :return: the number of bytes written.
+        """
+        value_bytes = json.dumps(data).encode("utf-8")
+        with self._lock:
+            location = self._append(key, value_bytes)
+            self._forget(key)
+            self._index[key] = location
+        return location[2]
+
+    def delete(self, key: str) -> None:
+        """
+        Delete the data saved for the given key, if there is any, by appending a tombstone record.
+        :param key: the key to delete.
+        """
+        with self._lock:
+            if key in self._index:
+                self.dead_bytes += self._append(key, None)[2]
+                self._forget(key)
+
+    def info(self, key: str) -> Optional[EntryInfo]:
+        """
+        Get the metadata of the entry for the given key.
+        :param key: the key to look up.
+        :return: the entry's metadata, or None if the key has not been stored.
+        """
+        location = self._index.get(key)
+        if location is None:
+            return None
+        return EntryInfo(key, location[2], location[3], location[4])
+
+    def touch(self, key: str) -> None:
+        """
+        Record that the entry for the given key has just been accessed.
+        :param key: the key that was accessed.
+        """
+        location = self._index.get(key)
+        if location is not None:
+            location[4] = time.time()
+
+    def entries(self) -> Iterator[EntryInfo]:
+        """
+        List the metadata of every stored entry.
+        :return: an iterator over the entries, in no particular order.
+        """
+        for key, location in list(self._index.items()):
+            yield EntryInfo(key, location[2], location[3], location[4])
+
+    def compact(self, force: bool = False) -> None:
+        """
+        Copy every live record into fresh segments, then delete the old segments.
+        If the process dies halfway, the copies are in higher numbered segments, so replaying finds the same data.
+        :param force: compact even when less than half of the stored bytes are dead.
+        """
+        with self._lock:
+            if not force and self.dead_bytes <= self.live_bytes:
+                return
+            old_segment_numbers = sorted(self._list_segments())
+            self._rotate()
+            locations = sorted(self._index.values(), key=lambda location: (location[0], location[1]))
+            for location in locations:
+                record = self._read_record(*location[:3])
+                if self._writer.tell() >= self.max_segment_bytes:
+                    self._rotate()
+                location[0], location[1] = self._active_number, self._writer.tell()
+                self._writer.write(record)
+            self._writer.flush()
+            for segment_number in old_segment_numbers:
+                reader = self._readers.pop(segment_number, None)
+                if reader is not None:
+                    reader.close()
+                os.remove(self._segment_path(segment_number))
+            self.dead_bytes = 0
+
+    def _rotate(self) -> None:
+        """
+        Close the active segment and start appending to a new one.
+        """
+        self._writer.close()
+        self._active_number += 1
+        self._writer = open(self._segment_path(self._active_number), "ab")
+
+    def close(self) -> None:
+        """
+        Close the write handle and every cached read handle.
+        """
+        with self._lock:
+            self._writer.close()
+            for reader in self._readers.values():
+                reader.close()
+            self._readers = {}
@@ -4,12 +4,16 @@ Please write me a python class which will implement an on-disk cache. The DiskCa
 """
 import os
 import json
+import asyncio
 import tempfile
 import shutil
+import threading
+import time
 from os.path import realpath
 from unittest import TestCase
 
 from experiments.gptlib.diskcache.disk_cache import DiskCache
+from experiments.gptlib.diskcache.storage import SegmentStorage
 
 
 class TestDiskCache(TestCase):
@@ -60,3 +64,148 @@ class TestDiskCache(TestCase):
         with open(cache_path, "r") as cache_file:
             saved_data = json.load(cache_file)
         self.assertEqual(test_data, saved_data)
+
+    def test_concurrent_misses_call_getter_once(self):
+        # Test that threads missing on the same key share a single getter_fn call.
+        call_count = 0
+        release_getter = threading.Event()
+
+        def slow_getter_fn():
+            nonlocal call_count
+            call_count += 1
+            release_getter.wait(timeout=5)
+            return {"value": 42}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get("test_key", slow_getter_fn))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release_getter.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, call_count)
+        self.assertEqual([{"value": 42}] * 8, results)
+
+    def test_failed_getter_is_not_cached(self):
+        # Test that an exception from the getter_fn reaches the caller, and the next get tries again.
+        def failing_getter_fn():
+            raise ValueError("API error")
+
+        with self.assertRaises(ValueError):
+            self.cache.get("test_key", failing_getter_fn)
+        self.assertEqual({"value": 42}, self.cache.get("test_key", lambda: {"value": 42}))
+
+    def test_aget_concurrent_misses_call_getter_once(self):
+        # Test that asyncio tasks missing on the same key share a single awaited getter_fn call.
+        call_count = 0
+
+        async def slow_getter_fn():
+            nonlocal call_count
+            call_count += 1
+            await asyncio.sleep(0.05)
+            return {"value": 42}
+
+        async def get_many():
+            return await asyncio.gather(*(self.cache.aget("test_key", slow_getter_fn) for _ in range(8)))
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(get_many())
+        finally:
+            loop.close()
+        self.assertEqual(1, call_count)
+        self.assertEqual([{"value": 42}] * 8, results)
+        self.assertEqual({"value": 42}, self.cache.get("test_key", lambda: {"value": "should_not_be_returned"}))
+
+    def test_aget_reads_the_disk_off_the_event_loop(self):
+        # Test that a slow disk read in aget does not stop the other tasks on the event loop.
+        self.cache.get("test_key", lambda: {"value": 42})
+        read = self.cache.storage.read
+
+        def slow_read(key):
+            time.sleep(0.2)
+            return read(key)
+
+        self.cache.storage.read = slow_read
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async def get_while_ticking():
+            ticker = asyncio.ensure_future(tick())
+            try:
+                return await self.cache.aget("test_key", None)
+            finally:
+                ticker.cancel()
+
+        loop = asyncio.new_event_loop()
+        try:
+            data = loop.run_until_complete(get_while_ticking())
+        finally:
+            loop.close()
+        self.assertEqual({"value": 42}, data)
+        self.assertGreater(ticks, 5)
+
+    def test_writes_leave_no_temporary_files(self):
+        # Test that the atomic write renames its temporary file into place.
+        self.cache.get("test_key", lambda: {"value": 42})
+        self.assertEqual(["test_key.json"], os.listdir(self.temp_dir))
+
+    def test_memory_tier_answers_repeated_reads(self):
+        # Test that a second read is served from memory, even once the file is gone.
+        cache = DiskCache(cache_dir=self.temp_dir, memory_max_entries=10)
+        cache.get("test_key", lambda: {"value": 42})
+        os.remove(cache._get_cache_path("test_key"))
+        self.assertEqual({"value": 42}, cache.get("test_key", lambda: {"value": "should_not_be_returned"}))
+        self.assertEqual(1, cache.stats.misses)
+        self.assertEqual(1, cache.stats.memory_hits)
+        self.assertEqual(0, cache.stats.disk_hits)
+
+    def test_ttl_expires_entries(self):
+        # Test that an entry older than the TTL is refetched.
+        cache = DiskCache(cache_dir=self.temp_dir, ttl_seconds=60)
+        cache.get("test_key", lambda: {"value": 42})
+        cache_path = cache._get_cache_path("test_key")
+        an_hour_ago = time.time() - 3600
+        os.utime(cache_path, (an_hour_ago, an_hour_ago))
+
+        self.assertEqual({"value": 43}, cache.get("test_key", lambda: {"value": 43}))
+        self.assertEqual(1, cache.stats.expirations)
+        self.assertEqual(2, cache.stats.misses)
+
+    def test_contains(self):
+        # Test that contains sees cached entries, but not expired ones, and does not count as a hit.
+        cache = DiskCache(cache_dir=self.temp_dir, ttl_seconds=60)
+        self.assertFalse("test_key" in cache)
+        cache.get("test_key", lambda: {"value": 42})
+        self.assertTrue("test_key" in cache)
+        self.assertEqual(0, cache.stats.hits)
+        an_hour_ago = time.time() - 3600
+        os.utime(cache._get_cache_path("test_key"), (an_hour_ago, an_hour_ago))
+        self.assertFalse("test_key" in cache)
+
+    def test_size_budget_evicts_least_recently_accessed(self):
+        # Test that going over the disk budget evicts the entries that were read the longest time ago.
+        # Each entry takes 117 bytes as a file, and 140 bytes as a segment record, so the budgets fit 4 but not 5.
+        for storage, max_disk_bytes in [(None, 520), (SegmentStorage(os.path.join(self.temp_dir, "segments")), 620)]:
+            entry = {"value": "x" * 100}
+            cache = DiskCache(cache_dir=os.path.join(self.temp_dir, "files"), storage=storage, max_disk_bytes=max_disk_bytes)
+            for idx in range(4):
+                cache.get(f"key_{idx}", lambda: entry)
+                time.sleep(0.01)
+            # Reading key_0 makes key_1 the least recently accessed.
+            cache.get("key_0", lambda: {"value": "should_not_be_returned"})
+            time.sleep(0.01)
+            cache.get("key_4", lambda: entry)
+
+            self.assertGreaterEqual(cache.stats.disk_evictions, 1)
+            self.assertEqual(entry, cache.get("key_4", lambda: {"value": "refetched"}))
+            self.assertEqual(entry, cache.get("key_0", lambda: {"value": "refetched"}))
+            self.assertEqual({"value": "refetched"}, cache.get("key_1", lambda: {"value": "refetched"}))
+            cache.close()
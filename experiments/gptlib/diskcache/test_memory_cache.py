@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+A bounded, in-process least-recently-used cache, used by the DiskCache as a tier in front of the disk.
+The budget can be a number of entries, a number of bytes, or both. The size of a value is the length of its JSON.
+"""
+import time
+from unittest import TestCase
+
+from experiments.gptlib.diskcache.memory_cache import LRUMemoryCache
+
+
+class TestLRUMemoryCache(TestCase):
+    def test_entry_budget_evicts_least_recently_used(self):
+        cache = LRUMemoryCache(max_entries=2)
+        cache.put("a", {"value": 1})
+        cache.put("b", {"value": 2})
+        # Reading "a" makes "b" the least recently used.
+        self.assertEqual({"value": 1}, cache.get("a"))
+        cache.put("c", {"value": 3})
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual({"value": 1}, cache.get("a"))
+        self.assertEqual({"value": 3}, cache.get("c"))
+        self.assertEqual(1, cache.evictions)
+
+    def test_byte_budget(self):
+        # Each of these values is 23 bytes of JSON, so only two fit in the budget.
+        cache = LRUMemoryCache(max_bytes=50)
+        cache.put("a", {"value": "x" * 10})
+        cache.put("b", {"value": "y" * 10})
+        self.assertEqual(46, cache.total_bytes)
+        cache.put("c", {"value": "z" * 10})
+        self.assertEqual(2, len(cache))
+        self.assertEqual(46, cache.total_bytes)
+        self.assertIsNone(cache.get("a"))
+
+        # A value larger than the whole budget is not cached.
+        cache.put("huge", {"value": "h" * 100})
+        self.assertIsNone(cache.get("huge"))
+
+    def test_expiry(self):
+        cache = LRUMemoryCache(max_entries=10)
+        cache.put("expired", {"value": 1}, expires_at=time.time() - 1)
+        cache.put("fresh", {"value": 2}, expires_at=time.time() + 60)
+        self.assertIsNone(cache.get("expired"))
+        self.assertEqual({"value": 2}, cache.get("fresh"))
+
+    def test_discard(self):
+        cache = LRUMemoryCache(max_bytes=100)
+        cache.put("a", {"value": 1})
+        cache.discard("a")
+        cache.discard("missing")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.total_bytes)
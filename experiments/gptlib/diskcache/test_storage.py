@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Storage backends for the DiskCache. A backend knows how to read, write and check for the serialized data of a key.
+The FileStorage keeps the original one-JSON-file-per-key layout, and the SegmentStorage packs every entry into a few
+append-only segment files, with an in-memory index of where each key's latest record lives.
+"""
+import os
+import shutil
+import tempfile
+from os.path import realpath
+from unittest import TestCase
+
+from experiments.gptlib.diskcache.disk_cache import DiskCache
+from experiments.gptlib.diskcache.storage import FileStorage, SegmentStorage
+
+
+class TestFileStorage(TestCase):
+    def setUp(self):
+        self.temp_dir = realpath(tempfile.mkdtemp())
+        self.storage = FileStorage(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_read_write(self):
+        self.assertIsNone(self.storage.read("missing"))
+        self.assertFalse("key" in self.storage)
+        self.storage.write("key", {"value": 42})
+        self.assertTrue("key" in self.storage)
+        self.assertEqual({"value": 42}, self.storage.read("key"))
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, "key.json")))
+
+    def test_delete_and_entries(self):
+        size = self.storage.write("key", {"value": 42})
+        self.storage.write("other", {"value": 43})
+        info = self.storage.info("key")
+        self.assertEqual(size, info.size)
+        self.assertEqual({"key", "other"}, {entry.key for entry in self.storage.entries()})
+
+        self.storage.delete("key")
+        self.storage.delete("missing")
+        self.assertIsNone(self.storage.info("key"))
+        self.assertEqual(["other"], [entry.key for entry in self.storage.entries()])
+
+    def test_touch_keeps_write_time(self):
+        self.storage.write("key", {"value": 42})
+        written_at = self.storage.info("key").written_at
+        self.storage.touch("key")
+        info = self.storage.info("key")
+        self.assertEqual(written_at, info.written_at)
+        self.assertGreaterEqual(info.accessed_at, written_at)
+
+
+class TestSegmentStorage(TestCase):
+    def setUp(self):
+        self.temp_dir = realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_read_write(self):
+        storage = SegmentStorage(self.temp_dir)
+        self.assertIsNone(storage.read("missing"))
+        storage.write("key", {"value": 42})
+        storage.write("other", {"value": "text"})
+        storage.write("key", {"value": 43})
+        self.assertEqual({"value": 43}, storage.read("key"))
+        self.assertEqual({"value": "text"}, storage.read("other"))
+        self.assertEqual(2, len(storage))
+        storage.close()
+
+    def test_reopen_rebuilds_index(self):
+        storage = SegmentStorage(self.temp_dir)
+        for idx in range(100):
+            storage.write(f"key_{idx}", {"value": idx})
+        storage.write("key_5", {"value": "overwritten"})
+        storage.close()
+
+        reopened = SegmentStorage(self.temp_dir)
+        self.assertEqual(100, len(reopened))
+        self.assertEqual({"value": 99}, reopened.read("key_99"))
+        self.assertEqual({"value": "overwritten"}, reopened.read("key_5"))
+        reopened.close()
+
+    def test_segments_rotate(self):
+        storage = SegmentStorage(self.temp_dir, max_segment_bytes=256)
+        for idx in range(50):
+            storage.write(f"key_{idx}", {"value": idx})
+        storage.close()
+
+        segment_files = [name for name in os.listdir(self.temp_dir) if name.startswith("segment_")]
+        self.assertGreater(len(segment_files), 1)
+        reopened = SegmentStorage(self.temp_dir, max_segment_bytes=256)
+        for idx in range(50):
+            self.assertEqual({"value": idx}, reopened.read(f"key_{idx}"))
+        reopened.close()
+
+    def test_truncated_record_is_dropped(self):
+        storage = SegmentStorage(self.temp_dir)
+        storage.write("complete", {"value": 1})
+        storage.write("partial", {"value": 2})
+        storage.close()
+
+        # Simulate a crash in the middle of writing the last record.
+        segment_path = os.path.join(self.temp_dir, "segment_000000.log")
+        with open(segment_path, "r+b") as segment_file:
+            segment_file.truncate(os.path.getsize(segment_path) - 3)
+
+        reopened = SegmentStorage(self.temp_dir)
+        self.assertEqual({"value": 1}, reopened.read("complete"))
+        self.assertIsNone(reopened.read("partial"))
+        reopened.write("partial", {"value": 3})
+        self.assertEqual({"value": 3}, reopened.read("partial"))
+        reopened.close()
+
+    def test_delete_survives_reopen(self):
+        storage = SegmentStorage(self.temp_dir)
+        storage.write("deleted", {"value": 1})
+        storage.write("kept", {"value": 2})
+        storage.delete("deleted")
+        self.assertIsNone(storage.read("deleted"))
+        self.assertEqual(["kept"], [entry.key for entry in storage.entries()])
+        storage.close()
+
+        reopened = SegmentStorage(self.temp_dir)
+        self.assertIsNone(reopened.read("deleted"))
+        self.assertEqual({"value": 2}, reopened.read("kept"))
+        reopened.close()
+
+    def test_compact_reclaims_dead_records(self):
+        storage = SegmentStorage(self.temp_dir, max_segment_bytes=512)
+        for idx in range(100):
+            storage.write(f"key_{idx % 10}", {"value": idx})
+        storage.delete("key_0")
+        self.assertGreater(storage.dead_bytes, storage.live_bytes)
+        size_before = sum(os.path.getsize(os.path.join(self.temp_dir, name)) for name in os.listdir(self.temp_dir))
+
+        storage.compact()
+        size_after = sum(os.path.getsize(os.path.join(self.temp_dir, name)) for name in os.listdir(self.temp_dir))
+        self.assertEqual(0, storage.dead_bytes)
+        self.assertEqual(storage.live_bytes, size_after)
+        self.assertLess(size_after, size_before)
+        for idx in range(1, 10):
+            self.assertEqual({"value": 90 + idx}, storage.read(f"key_{idx}"))
+        storage.close()
+
+        reopened = SegmentStorage(self.temp_dir, max_segment_bytes=512)
+        self.assertEqual(9, len(reopened))
+        self.assertIsNone(reopened.read("key_0"))
+        self.assertEqual({"value": 99}, reopened.read("key_9"))
+        reopened.close()
+
+    def test_disk_cache_with_segment_storage(self):
+        cache = DiskCache(storage=SegmentStorage(self.temp_dir))
+        self.assertEqual({"value": 42}, cache.get("key", lambda: {"value": 42}))
+        self.assertEqual({"value": 42}, cache.get("key", lambda: {"value": "should_not_be_returned"}))
+        cache.close()
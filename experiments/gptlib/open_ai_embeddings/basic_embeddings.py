@@ -40,79 +40,359 @@ Output:
 I want the script to be called basic_embeddings.py and it should have a generate_embedding(text: str) -> List[float]: function that takes an input string, and calls the openai.Embedding.create endpoint with that input string.
 """
 import concurrent
+import itertools
+import json
+import os
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Dict
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import openai
 
 
 import logging
 import asyncio
-from aiohttp import ClientSession
 
 from experiments.config import OPEN_AI_KEY
+from experiments.constants import EMBEDDING_MODEL_NAME
+from experiments.gptlib.open_ai_embeddings.embedding_store import EmbeddingStore
+from experiments.helpers.openai_session import OpenAISession
+from experiments.helpers.rate_limiter import RateLimiter, ThroughputStats, backoff_delay, get_retry_after, is_retryable
+from experiments.helpers.token_helpers import count_tokens
 
 openai.api_key = OPEN_AI_KEY
 
+# The embeddings endpoint accepts up to 2048 inputs per request.
+DEFAULT_MAX_BATCH_ITEMS = 2048
+# Keeps each request well inside the API limits, and bounds how much work is lost when a request fails.
+DEFAULT_MAX_BATCH_TOKENS = 50_000
+# The default rate limits of a pay-as-you-go account for the embeddings models.
+DEFAULT_REQUESTS_PER_MINUTE = 3000
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+DEFAULT_MAX_ATTEMPTS = 6
+
+
+def batch_texts(
+    texts: Iterable[str],
+    max_batch_items: int = DEFAULT_MAX_BATCH_ITEMS,
+    max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+    token_counter: Callable[[str], int] = count_tokens,
+) -> Iterator[List[str]]:
+    """
+    Pack texts into batches, in order, bounded by a number of items and a total number of tokens.
+    A text that has more tokens than max_batch_tokens on its own is put in a batch by itself.
+    :param texts: the texts to pack.
+    :param max_batch_items: the maximum number of texts in a batch.
+    :param max_batch_tokens: the maximum total number of tokens in a batch.
+    :param token_counter: the function that counts the tokens of a text.
+    :return: an iterator over the batches.
+    """
+    for batch, _ in batch_texts_with_tokens(texts, max_batch_items, max_batch_tokens, token_counter):
+        yield batch
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="[%(levelname)s] (%(threadName)-10s) %(message)s",
-)
-sleep_seconds = 0.5
+
+def batch_texts_with_tokens(
+    texts: Iterable[str],
+    max_batch_items: int = DEFAULT_MAX_BATCH_ITEMS,
+    max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+    token_counter: Callable[[str], int] = count_tokens,
+) -> Iterator[Tuple[List[str], int]]:
+    """
+    Pack texts into batches like batch_texts, and also give the total number of tokens of each batch.
+    :param texts: the texts to pack.
+    :param max_batch_items: the maximum number of texts in a batch.
+    :param max_batch_tokens: the maximum total number of tokens in a batch.
+    :param token_counter: the function that counts the tokens of a text.
+    :return: an iterator over the (batch, total tokens) pairs.
+    """
+    batch = []
+    batch_tokens = 0
+    for text in texts:
+        text_tokens = token_counter(text)
+        if batch and (len(batch) >= max_batch_items or batch_tokens + text_tokens > max_batch_tokens):
+            yield batch, batch_tokens
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += text_tokens
+    if batch:
+        yield batch, batch_tokens
 
 
 class EmbeddingsGenerator:
     """
-    A class that generates word embeddings concurrently using multiple threads.
+    A class that generates word embeddings concurrently, packing the words into batched requests.
+    The requests are paced by a RateLimiter, and failed batches are sent again with a jittered exponential backoff.
     """
 
-    def __init__(self, num_workers: int = 10):
+    def __init__(
+        self,
+        num_workers: int = 10,
+        max_batch_items: int = DEFAULT_MAX_BATCH_ITEMS,
+        max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+        model: str = EMBEDDING_MODEL_NAME,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        session: Optional[OpenAISession] = None,
+    ):
         """
         Initialize the EmbeddingsGenerator.
-        :param num_workers: The number of worker threads to use.
+        :param num_workers: The number of requests in flight at once.
+        :param max_batch_items: The maximum number of words sent in one request, 1 sends a request per word.
+        :param max_batch_tokens: The maximum total number of tokens sent in one request.
+        :param model: The OpenAI model name
+        :param requests_per_minute: The rate limit of the account, in requests per minute.
+        :param tokens_per_minute: The rate limit of the account, in tokens per minute.
+        :param max_attempts: The number of times a batch is sent before its words are given up on.
+        :param session: The OpenAISession to send the requests with. By default the generator owns one,
+            with a connection per worker, that stays open until close is called.
         """
         self.num_workers = num_workers
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.model = model
+        self.max_attempts = max_attempts
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # The ThroughputStats of the last run of iter_embeddings to finish
+        self.last_stats: Optional[ThroughputStats] = None
+        self.session = session or OpenAISession(limit=num_workers, limit_per_host=num_workers)
+
+    async def close(self) -> None:
+        """
+        Close the session, and its pooled connections.
+        """
+        await self.session.close()
+
+    async def __aenter__(self) -> "EmbeddingsGenerator":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
 
     async def multi_generate_embeddings(self, words: List[str]) -> Dict[str, List[float]]:
         """
-        Generate word embeddings for the list of words using the slow function in multiple threads.
+        Generate word embeddings for the list of words, with num_workers batched requests in flight at once.
+        The throughput achieved is logged at the end, and kept in self.last_stats.
         :param words: A list of words to generate embeddings for.
         :return: A dictionary where the key is the input word, and the value is the generated embedding.
+            Words whose batch failed max_attempts times are left out.
         """
+        word_embeddings = {}
+        async for word, embedding in self.iter_embeddings(dict.fromkeys(words)):
+            word_embeddings[word] = embedding
+        return word_embeddings
 
-        # Semaphore to limit number of concurrent requests
-        semaphore = asyncio.Semaphore(10)
+    async def iter_embeddings(
+        self,
+        texts: Iterable[str],
+        store: Optional[EmbeddingStore] = None,
+        checkpoint_path: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, List[float]]]:
+        """
+        Generate the embeddings of a stream of texts, yielding (text, embedding) pairs as the requests complete.
+        The texts are read lazily, and at most num_workers * 2 batches are read ahead of the results taken from
+        this iterator, so memory stays flat however many texts there are.
+
+        With a store, each embedding is written to it before it is yielded, and texts already in it are skipped.
+        With a checkpoint_path, the number of texts handled without a gap is saved after each batch, and a later
+        run over the same texts with the same checkpoint_path starts after them. The checkpoint never moves past
+        a batch that failed max_attempts times, so a resumed run sends it again.
+        :param texts: the texts to embed, for example read_texts(path) to stream the lines of a file.
+        :param store: the EmbeddingStore to write the embeddings to, if any.
+        :param checkpoint_path: the JSON file to save the progress in, if any.
+        :return: an async iterator over the (text, embedding) pairs, in completion order.
+        """
+        # Each run counts its own requests, so concurrent runs on this generator do not mix their counts
+        stats = ThroughputStats()
+        checkpoint = EmbeddingsCheckpoint(checkpoint_path) if checkpoint_path else None
+        read_position = checkpoint.load() if checkpoint else 0
+        work_queue = asyncio.Queue()
+        results = asyncio.Queue()
+        # Bounds the number of batches read but not yet taken from this iterator
+        read_ahead = asyncio.Semaphore(self.num_workers * 2)
+        # The read position after the last text of each batch, by batch sequence number
+        batch_ends = []
+        producer_done = False
+
+        def unstored_texts(text_positions: deque) -> Iterator[str]:
+            nonlocal read_position
+            for text in itertools.islice(texts, read_position, None):
+                read_position += 1
+                if store is None or not store.contains(text, self.model):
+                    text_positions.append(read_position)
+                    yield text
+
+        async def produce():
+            nonlocal producer_done
+            text_positions = deque()
+            try:
+                for batch, batch_tokens in batch_texts_with_tokens(unstored_texts(text_positions), self.max_batch_items, self.max_batch_tokens):
+                    for _ in range(len(batch)):
+                        batch_end = text_positions.popleft()
+                    await read_ahead.acquire()
+                    work_queue.put_nowait(_PendingBatch(len(batch_ends), batch, batch_tokens))
+                    batch_ends.append(batch_end)
+                producer_done = True
+                results.put_nowait(None)
+            except Exception as e:
+                results.put_nowait(e)
+
+        async def worker():
+            while True:
+                pending_batch = await work_queue.get()
+                embeddings = await self._send_batch(work_queue, pending_batch, stats)
+                if embeddings is not None or pending_batch.failed:
+                    results.put_nowait((pending_batch, embeddings))
+
+        # Tasks copy the context they are created in, so the workers keep using this session
+        await self.session.open()
+        with self.session.activate():
+            tasks = [asyncio.create_task(produce())] + [asyncio.create_task(worker()) for _ in range(self.num_workers)]
+        finished_count = 0
+        succeeded = set()
+        next_sequence = 0
+        try:
+            while not producer_done or finished_count < len(batch_ends):
+                result = await results.get()
+                if isinstance(result, Exception):
+                    raise result
+                if result is None:
+                    continue
+                pending_batch, embeddings = result
+                finished_count += 1
+                read_ahead.release()
+                if embeddings is None:
+                    continue
+                if store is not None:
+                    store.put_many(pending_batch.texts, embeddings, self.model)
+                for text, embedding in zip(pending_batch.texts, embeddings):
+                    yield text, embedding
+                succeeded.add(pending_batch.sequence)
+                if checkpoint:
+                    # Save the end of the longest run of batches that succeeded, from the start
+                    previous_sequence = next_sequence
+                    while next_sequence in succeeded:
+                        succeeded.remove(next_sequence)
+                        next_sequence += 1
+                    if next_sequence > previous_sequence:
+                        checkpoint.save(batch_ends[next_sequence - 1])
+            if checkpoint and next_sequence == len(batch_ends):
+                # Also count the stored texts skipped after the last batch
+                checkpoint.save(read_position)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            stats.finish()
+            self.last_stats = stats
+            logging.info(f"Embeddings throughput: {stats.as_dict()}")
+
+    async def _send_batch(
+        self, work_queue: asyncio.Queue, pending_batch: "_PendingBatch", stats: ThroughputStats
+    ) -> Optional[List[List[float]]]:
+        """
+        Send one batch, once the rate limiter allows it. If it fails, queue it up again, or mark it as failed
+        when it is not worth retrying.
+        :param work_queue: the queue of batches to send.
+        :param pending_batch: the batch to send.
+        :param stats: the ThroughputStats of the run the batch belongs to.
+        :return: the embeddings of the texts of the batch, or None if the request failed.
+        """
+        pending_batch.attempt += 1
+        await self.rate_limiter.acquire(pending_batch.tokens)
+        stats.requests += 1
+        try:
+            embeddings = await generate_embeddings(pending_batch.texts, model=self.model)
+        except Exception as e:
+            if not is_retryable(e) or pending_batch.attempt >= self.max_attempts:
+                logging.warning(f"Giving up on a batch of {len(pending_batch.texts)} texts after {pending_batch.attempt} attempts: {e}")
+                stats.failed_items += len(pending_batch.texts)
+                pending_batch.failed = True
+                return None
+            stats.retries += 1
+            if isinstance(e, openai.error.RateLimitError):
+                stats.rate_limited += 1
+                delay = self.rate_limiter.on_rate_limited(get_retry_after(e), pending_batch.attempt)
+                logging.info(f"Rate limited, pausing requests for {delay:.2f}s: {e}")
+            else:
+                delay = backoff_delay(pending_batch.attempt)
+                logging.info(f"Failed to generate embeddings for a batch of {len(pending_batch.texts)} texts, retrying in {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+            work_queue.put_nowait(pending_batch)
+            return None
+        self.rate_limiter.on_success()
+        stats.items += len(pending_batch.texts)
+        stats.tokens += pending_batch.tokens
+        return embeddings
+
+
+class _PendingBatch:
+    """
+    A batch of texts waiting for its embeddings, with the number of times it has been sent.
+    """
 
-        # Submit each word as a separate task, store a list of Future objects.
-        openai.aiosession.set(ClientSession())
+    def __init__(self, sequence: int, texts: List[str], tokens: int):
+        """
+        Initialize the _PendingBatch.
+        :param sequence: the position of the batch in the stream of batches.
+        :param texts: the texts to embed.
+        :param tokens: the total number of tokens of the texts.
+        """
+        self.sequence = sequence
+        self.texts = texts
+        self.tokens = tokens
+        self.attempt = 0
+        self.failed = False
 
-        # This is your worker function
-        async def worker(word):
-            global sleep_seconds
-            async with semaphore:
-                try:
-                    embedding = await generate_embedding(word)
-                    return word, embedding
-                except Exception as e:  # Handle exceptions here
-                    print(f"Failed to generate embedding for {word}: {e}")
-                    sleep_seconds += 0.1
-                    await asyncio.sleep(sleep_seconds)
-                    return word, None
 
-        # Start the tasks and collect the results
-        results = await asyncio.gather(*(worker(word) for word in words))
+class EmbeddingsCheckpoint:
+    """
+    The number of input texts an embeddings run has handled, saved in a small JSON file so the run can be resumed.
+    """
 
-        # Gather results from completed tasks, and build a dictionary of word -> embedding
-        word_embeddings = {}
-        for word, embedding in results:
-            if embedding is not None:
-                word_embeddings[word] = embedding
-        await openai.aiosession.get().close()
-        return word_embeddings
+    def __init__(self, path: str):
+        """
+        Initialize the EmbeddingsCheckpoint.
+        :param path: the path of the JSON file.
+        """
+        self.path = path
+
+    def load(self) -> int:
+        """
+        Load the saved position.
+        :return: the number of input texts handled, 0 if nothing was saved yet.
+        """
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            return json.load(f)["position"]
+
+    def save(self, position: int) -> None:
+        """
+        Save the position, atomically, so a crash leaves either the old or the new position.
+        :param position: the number of input texts handled.
+        """
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"position": position}, f)
+        os.replace(temp_path, self.path)
+
+
+def read_texts(path: str) -> Iterator[str]:
+    """
+    Stream the lines of a text file, one text per line, without their line endings. Blank lines are skipped.
+    :param path: the path of the text file.
+    :return: an iterator over the texts.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            text = line.rstrip("\r\n")
+            if text.strip():
+                yield text
 
 
-async def generate_embedding(text: str, model="text-embedding-ada-002") -> List[float]:
+async def generate_embedding(text: str, model=EMBEDDING_MODEL_NAME) -> List[float]:
     """
     Generates an embedding for the given text using the OpenAI API.
 
@@ -128,6 +408,25 @@ async def generate_embedding(text: str, model="text-embedding-ada-002") -> List[
     return embeddings
 
 
+async def generate_embeddings(texts: List[str], model=EMBEDDING_MODEL_NAME) -> List[List[float]]:
+    """
+    Generates the embeddings of several texts with a single request to the OpenAI API.
+    The API does not promise to return them in order, so they are put back in order using their index.
+
+    :param texts: The input texts for which to generate the embeddings.
+    :param model: The OpenAI model name
+    :return: The generated embeddings, in the same order as the texts.
+    """
+    logging.debug(f"Creating embeddings for a batch of {len(texts)} texts...")
+
+    response = await openai.Embedding.acreate(input=texts, model=model)
+    logging.debug(f"Done embeddings for a batch of {len(texts)} texts")
+    embeddings = [None] * len(texts)
+    for data in response["data"]:
+        embeddings[data["index"]] = data["embedding"]
+    return embeddings
+
+
 async def main():
     """
     The main function for the basic_embeddings script.
@@ -142,14 +441,13 @@ async def main():
     # Print the generated embedding
     print(embedding)
 
-    # Initialize the EmbeddingsGenerator with 10 worker threads
-    generator = EmbeddingsGenerator()
-
-    # Define a list of words for which to generate embeddings
-    words = ["apple", "banana", "orange", "grape", "watermelon"]
+    # Initialize the EmbeddingsGenerator with 10 workers
+    async with EmbeddingsGenerator() as generator:
+        # Define a list of words for which to generate embeddings
+        words = ["apple", "banana", "orange", "grape", "watermelon"]
 
-    # Generate the embeddings using the defined list of words
-    word_embeddings = await generator.multi_generate_embeddings(words)
+        # Generate the embeddings using the defined list of words
+        word_embeddings = await generator.multi_generate_embeddings(words)
 
     # Print the generated embeddings
     for word, embedding in word_embeddings.items():
@@ -157,4 +455,9 @@ async def main():
 
 
 if __name__ == "__main__":
+    # Configured here rather than on import, so modules that import this one keep their own logging
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="[%(levelname)s] (%(threadName)-10s) %(message)s",
+    )
     asyncio.run(main())
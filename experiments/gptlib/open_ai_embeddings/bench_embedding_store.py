@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Benchmarks the EmbeddingStore against keeping embeddings as a JSON dictionary of text -> list of floats.
+It writes random vectors for the given number of texts, then times opening each format and looking up a batch of texts.
+
+Usage:
+    python -m experiments.gptlib.open_ai_embeddings.bench_embedding_store --counts 10000 100000 1000000
+"""
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+from os.path import join
+
+import numpy as np
+
+from experiments.gptlib.open_ai_embeddings.embedding_store import EmbeddingStore
+
+DIMENSIONS = 1536
+WRITE_BATCH_SIZE = 10_000
+
+
+def bench_store(count: int, lookups: int, with_json: bool) -> dict:
+    """
+    Time writing, opening and batch lookups for count random embeddings.
+    :param count: the number of embeddings to store.
+    :param lookups: the number of texts to look up in one batch.
+    :param with_json: whether to also time the JSON dictionary format.
+    :return: the timings in seconds, by phase.
+    """
+    store_dir = tempfile.mkdtemp(prefix="bench_embedding_store_")
+    texts = [f"text number {idx}" for idx in range(count)]
+    rng = np.random.default_rng(0)
+    timings = {}
+    try:
+        start = time.perf_counter()
+        store = EmbeddingStore(store_dir, dimensions=DIMENSIONS)
+        for batch_start in range(0, count, WRITE_BATCH_SIZE):
+            batch_texts = texts[batch_start : batch_start + WRITE_BATCH_SIZE]
+            store.put_many(batch_texts, rng.standard_normal((len(batch_texts), DIMENSIONS), dtype=np.float32))
+        timings["store write"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = EmbeddingStore(store_dir)
+        timings["store open"] = time.perf_counter() - start
+
+        lookup_texts = random.sample(texts, min(lookups, count))
+        start = time.perf_counter()
+        store.get_many(lookup_texts)
+        timings["store get_many"] = time.perf_counter() - start
+
+        if with_json:
+            json_path = join(store_dir, "embeddings.json")
+            with open(json_path, "w") as f:
+                json.dump({text: store.get(text).tolist() for text in texts}, f)
+            start = time.perf_counter()
+            with open(json_path) as f:
+                json_embeddings = json.load(f)
+            timings["json open"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            np.array([json_embeddings[text] for text in lookup_texts], dtype=np.float32)
+            timings["json get_many"] = time.perf_counter() - start
+    finally:
+        shutil.rmtree(store_dir)
+    return timings
+
+
+def main():
+    """
+    The main function for the EmbeddingStore benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the EmbeddingStore against a JSON dictionary.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="The numbers of embeddings to store.")
+    parser.add_argument("--lookups", type=int, default=1000, help="The number of texts to look up in one batch.")
+    parser.add_argument("--json-max-count", type=int, default=100_000, help="Skip the (slow) JSON format above this count.")
+    args = parser.parse_args()
+
+    for count in args.counts:
+        timings = bench_store(count, args.lookups, with_json=count <= args.json_max_count)
+        print(f"{count} embeddings of {DIMENSIONS} dimensions:")
+        for phase, seconds in timings.items():
+            print(f"    {phase:>16}: {seconds:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmarks the throughput of EmbeddingsGenerator.multi_generate_embeddings, sending one request per word
+against packing the words into batched requests. It runs against a local FakeOpenAIServer, so it costs nothing.
+Use --rate-limit-every to have the server answer some requests with 429s, and see how the retries affect throughput.
+
+Usage:
+    python -m experiments.gptlib.open_ai_embeddings.bench_embeddings_batching --words 2000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from os.path import dirname, join
+
+import openai
+
+from experiments.gptlib.open_ai_embeddings.basic_embeddings import EmbeddingsGenerator
+from experiments.helpers.fake_openai_server import FakeOpenAIServer
+
+COMMON_WORDS_PATH = join(dirname(__file__), "common_words.json")
+
+
+async def bench_mode(server: FakeOpenAIServer, words: list, max_batch_items: int, num_workers: int) -> dict:
+    """
+    Generate the embeddings of the words with the given batch size, and measure the throughput.
+    :param server: the running fake server.
+    :param words: the words to embed.
+    :param max_batch_items: the maximum number of words per request.
+    :param num_workers: the number of requests in flight at once.
+    :return: the elapsed seconds, the number of requests and connections, the words embedded per second and the retries.
+    """
+    requests_before = server.request_count
+    connections_before = server.connection_count
+    async with EmbeddingsGenerator(num_workers=num_workers, max_batch_items=max_batch_items) as generator:
+        start = time.perf_counter()
+        word_embeddings = await generator.multi_generate_embeddings(words)
+        elapsed = time.perf_counter() - start
+    if len(word_embeddings) != len(set(words)):
+        raise RuntimeError(f"Only {len(word_embeddings)} of {len(set(words))} words were embedded")
+    return {
+        "seconds": elapsed,
+        "requests": server.request_count - requests_before,
+        "connections": server.connection_count - connections_before,
+        "words_per_second": len(words) / elapsed,
+        "retries": generator.last_stats.retries,
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    """
+    Run every mode against the same fake server, and print a table of the results.
+    :param args: the parsed command line arguments.
+    """
+    with open(COMMON_WORDS_PATH) as f:
+        words = json.load(f)[: args.words]
+    server = FakeOpenAIServer(dimensions=args.dimensions, request_latency=args.latency, rate_limit_every=args.rate_limit_every)
+    async with server:
+        openai.api_base = server.url
+        print(f"{'mode':>10} {'requests':>10} {'conns':>10} {'retries':>10} {'seconds':>10} {'words/s':>10}")
+        for mode, max_batch_items in [("per-item", 1), ("batched", args.batch_items)]:
+            result = await bench_mode(server, words, max_batch_items, args.workers)
+            print(
+                f"{mode:>10} {result['requests']:>10} {result['connections']:>10} {result['retries']:>10} "
+                f"{result['seconds']:>10.2f} {result['words_per_second']:>10.0f}"
+            )
+
+
+def main():
+    """
+    The main function for the embeddings batching benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark per-item and batched embeddings requests against a fake server.")
+    parser.add_argument("--words", type=int, default=2000, help="The number of words to embed.")
+    parser.add_argument("--batch-items", type=int, default=256, help="The maximum number of words per batched request.")
+    parser.add_argument("--dimensions", type=int, default=1536, help="The number of dimensions of the fake embeddings.")
+    parser.add_argument("--latency", type=float, default=0.05, help="The simulated seconds taken by every request.")
+    parser.add_argument("--workers", type=int, default=10, help="The number of requests in flight at once.")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Have the server answer every Nth request with a 429.")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
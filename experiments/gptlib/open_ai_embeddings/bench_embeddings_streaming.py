@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Benchmarks the peak memory of EmbeddingsGenerator.iter_embeddings writing straight to an EmbeddingStore,
+against multi_generate_embeddings building a dictionary of every embedding.
+It runs against a local FakeOpenAIServer, so it costs nothing.
+
+Usage:
+    python -m experiments.gptlib.open_ai_embeddings.bench_embeddings_streaming --counts 10000 100000
+"""
+import argparse
+import asyncio
+import logging
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import openai
+
+from experiments.gptlib.open_ai_embeddings.basic_embeddings import EmbeddingsGenerator
+from experiments.gptlib.open_ai_embeddings.embedding_store import EmbeddingStore
+from experiments.helpers.fake_openai_server import FakeOpenAIServer
+
+
+async def bench_streaming(count: int, batch_items: int) -> None:
+    """
+    Embed count texts into a temporary EmbeddingStore.
+    :param count: the number of texts to embed.
+    :param batch_items: the maximum number of texts per request.
+    """
+    store_dir = tempfile.mkdtemp(prefix="bench_embeddings_streaming_")
+    try:
+        store = EmbeddingStore(store_dir)
+        texts = (f"text number {idx}" for idx in range(count))
+        async with EmbeddingsGenerator(max_batch_items=batch_items) as generator:
+            async for _ in generator.iter_embeddings(texts, store=store):
+                pass
+    finally:
+        shutil.rmtree(store_dir)
+
+
+async def bench_dictionary(count: int, batch_items: int) -> None:
+    """
+    Embed count texts into a dictionary.
+    :param count: the number of texts to embed.
+    :param batch_items: the maximum number of texts per request.
+    """
+    async with EmbeddingsGenerator(max_batch_items=batch_items) as generator:
+        await generator.multi_generate_embeddings([f"text number {idx}" for idx in range(count)])
+
+
+async def run(args: argparse.Namespace) -> None:
+    """
+    Run every mode for every count against the same fake server, and print a table of the results.
+    :param args: the parsed command line arguments.
+    """
+    async with FakeOpenAIServer(dimensions=args.dimensions, request_latency=args.latency, per_input_latency=0) as server:
+        openai.api_base = server.url
+        print(f"{'texts':>10} {'mode':>12} {'seconds':>10} {'peak MB':>10}")
+        for count in args.counts:
+            for mode, bench in [("streaming", bench_streaming), ("dictionary", bench_dictionary)]:
+                tracemalloc.start()
+                start = time.perf_counter()
+                await bench(count, args.batch_items)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f"{count:>10} {mode:>12} {elapsed:>10.2f} {peak / 1e6:>10.1f}")
+
+
+def main():
+    """
+    The main function for the embeddings streaming benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the memory of streaming embeddings to a store against a dictionary.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10_000, 100_000], help="The numbers of texts to embed.")
+    parser.add_argument("--batch-items", type=int, default=512, help="The maximum number of texts per request.")
+    parser.add_argument("--dimensions", type=int, default=256, help="The number of dimensions of the fake embeddings.")
+    parser.add_argument("--latency", type=float, default=0.01, help="The simulated seconds taken by every request.")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+A persistent store for embeddings, that keeps the vectors as one contiguous float32 matrix on disk instead of JSON lists.
+Each vector is keyed by a hash of the model name and the embedded text. The store directory holds:
+
+- vectors.f32: the raw float32 rows, memory-mapped when read, so looking a vector up does not copy it.
+- keys.bin: the 16 byte key of each row, in row order, loaded into a dictionary of key -> row when the store is opened.
+- meta.json: the number of dimensions of the vectors.
+
+Both data files are only ever appended to. The vectors are written before the keys, so after a crash the store
+only trusts as many rows as both files hold.
+"""
+import hashlib
+import json
+import os
+import threading
+from os.path import join, realpath
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from experiments.constants import EMBEDDING_MODEL_NAME
+
+KEY_BYTES = 16
+VECTOR_DTYPE = np.float32
+
+
+def make_key(text: str, model: str = EMBEDDING_MODEL_NAME) -> bytes:
+    """
+    Get the key of the embedding of the given text by the given model.
+    :param text: the embedded text.
+    :param model: the name of the embedding model.
+    :return: the 16 byte key.
+    """
+    return hashlib.blake2b(model.encode("utf-8") + b"\0" + text.encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+
+class EmbeddingStore:
+    """
+    An append-only, memory-mapped store of embedding vectors, keyed by (model, text).
+    """
+
+    def __init__(self, store_dir: str, dimensions: Optional[int] = None):
+        """
+        Open the store in the given directory, creating it if needed.
+        :param store_dir: the directory holding the store files.
+        :param dimensions: the number of dimensions of the vectors, only needed when creating a new store.
+        """
+        self.store_dir = realpath(store_dir)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._vectors_path = join(self.store_dir, "vectors.f32")
+        self._keys_path = join(self.store_dir, "keys.bin")
+        self._meta_path = join(self.store_dir, "meta.json")
+        self._lock = threading.Lock()
+        self.dimensions = self._load_dimensions(dimensions)
+        self._rows: Dict[bytes, int] = {}
+        self._vectors = np.empty((0, self.dimensions or 0), dtype=VECTOR_DTYPE)
+        if self.dimensions is not None:
+            self._load_rows()
+
+    def _load_dimensions(self, dimensions: Optional[int]) -> Optional[int]:
+        """
+        Read the number of dimensions from the metadata file, or write it there for a new store.
+        :param dimensions: the number of dimensions given by the caller, if any.
+        :return: the number of dimensions, or None if the store is new and it is not known yet.
+        """
+        try:
+            with open(self._meta_path) as f:
+                stored_dimensions = json.load(f)["dimensions"]
+        except FileNotFoundError:
+            if dimensions is not None:
+                self._save_dimensions(dimensions)
+            return dimensions
+        if dimensions is not None and dimensions != stored_dimensions:
+            raise ValueError(f"The store at {self.store_dir} holds {stored_dimensions} dimension vectors, not {dimensions}")
+        return stored_dimensions
+
+    def _save_dimensions(self, dimensions: int) -> None:
+        """
+        Write the metadata file of a new store.
+        :param dimensions: the number of dimensions of the vectors.
+        """
+        with open(self._meta_path, "w") as f:
+            json.dump({"dimensions": dimensions, "dtype": np.dtype(VECTOR_DTYPE).name}, f)
+
+    def _load_rows(self) -> None:
+        """
+        Load the key of every row, and memory-map the vectors.
+        Rows that only made it into one of the two files before a crash are truncated away.
+        """
+        row_bytes = self.dimensions * np.dtype(VECTOR_DTYPE).itemsize
+        vector_rows = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+        key_rows = os.path.getsize(self._keys_path) // KEY_BYTES if os.path.exists(self._keys_path) else 0
+        row_count = min(vector_rows, key_rows)
+        for path, size in [(self._vectors_path, row_count * row_bytes), (self._keys_path, row_count * KEY_BYTES)]:
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+        if row_count > 0:
+            with open(self._keys_path, "rb") as f:
+                keys = f.read()
+            self._rows = {keys[row * KEY_BYTES : (row + 1) * KEY_BYTES]: row for row in range(row_count)}
+        self._map_vectors(row_count)
+
+    def _map_vectors(self, row_count: int) -> None:
+        """
+        Memory-map the first row_count rows of the vectors file, read only.
+        :param row_count: the number of rows to map.
+        """
+        if row_count == 0:
+            self._vectors = np.empty((0, self.dimensions), dtype=VECTOR_DTYPE)
+        else:
+            self._vectors = np.memmap(self._vectors_path, dtype=VECTOR_DTYPE, mode="r", shape=(row_count, self.dimensions))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def contains(self, text: str, model: str = EMBEDDING_MODEL_NAME) -> bool:
+        """
+        Check whether the embedding of the given text is stored.
+        :param text: the embedded text.
+        :param model: the name of the embedding model.
+        :return: True if the embedding is stored, False otherwise.
+        """
+        return make_key(text, model) in self._rows
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        The read-only matrix of every stored vector, one row per embedding, in insertion order.
+        """
+        return self._vectors
+
+    def keys(self) -> List[bytes]:
+        """
+        Get the key of every stored vector, in row order, so keys()[row] is the key of vectors[row].
+        :return: the list of 16 byte keys.
+        """
+        return list(self._rows)
+
+    def get(self, text: str, model: str = EMBEDDING_MODEL_NAME) -> Optional[np.ndarray]:
+        """
+        Get the embedding of the given text, as a read-only view into the memory-mapped file.
+        :param text: the embedded text.
+        :param model: the name of the embedding model.
+        :return: the vector, or None if it is not stored.
+        """
+        row = self._rows.get(make_key(text, model))
+        if row is None:
+            return None
+        return self._vectors[row]
+
+    def get_many(self, texts: Sequence[str], model: str = EMBEDDING_MODEL_NAME) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the embeddings of many texts at once, gathered into one matrix.
+        :param texts: the embedded texts.
+        :param model: the name of the embedding model.
+        :return: a (len(texts), dimensions) matrix, and a boolean mask of the texts that were found.
+            The rows of the texts that were not found are zeros.
+        """
+        rows = np.fromiter((self._rows.get(make_key(text, model), -1) for text in texts), dtype=np.int64, count=len(texts))
+        found = rows >= 0
+        vectors = np.zeros((len(texts), self.dimensions or 0), dtype=VECTOR_DTYPE)
+        if found.any():
+            vectors[found] = self._vectors[rows[found]]
+        return vectors, found
+
+    def put(self, text: str, vector: Sequence[float], model: str = EMBEDDING_MODEL_NAME) -> None:
+        """
+        Store the embedding of the given text. Nothing happens if it is already stored.
+        :param text: the embedded text.
+        :param vector: the embedding.
+        :param model: the name of the embedding model.
+        """
+        self.put_many([text], [vector], model)
+
+    def put_many(self, texts: Sequence[str], vectors: Iterable[Sequence[float]], model: str = EMBEDDING_MODEL_NAME) -> None:
+        """
+        Store the embeddings of many texts at once, with a single append to each file.
+        Texts that are already stored, or repeated in the batch, are skipped.
+        :param texts: the embedded texts.
+        :param vectors: the embeddings, one per text, as lists or as a matrix.
+        :param model: the name of the embedding model.
+        """
+        if len(texts) == 0:
+            # There is nothing to store, and np.asarray([]) is not a matrix to check the shape of
+            return
+        matrix = np.asarray(vectors, dtype=VECTOR_DTYPE)
+        if matrix.ndim != 2 or matrix.shape[0] != len(texts):
+            raise ValueError(f"Expected {len(texts)} vectors, got an array of shape {matrix.shape}")
+        with self._lock:
+            if self.dimensions is None:
+                self.dimensions = matrix.shape[1]
+                self._save_dimensions(self.dimensions)
+            elif matrix.shape[1] != self.dimensions:
+                raise ValueError(f"Expected {self.dimensions} dimension vectors, got {matrix.shape[1]}")
+            new_keys: List[bytes] = []
+            new_indexes: List[int] = []
+            seen = set()
+            for idx, text in enumerate(texts):
+                key = make_key(text, model)
+                if key not in self._rows and key not in seen:
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_indexes.append(idx)
+            if not new_keys:
+                return
+            with open(self._vectors_path, "ab") as f:
+                f.write(matrix[new_indexes].tobytes())
+            with open(self._keys_path, "ab") as f:
+                f.write(b"".join(new_keys))
+            first_row = len(self._rows)
+            for offset, key in enumerate(new_keys):
+                self._rows[key] = first_row + offset
+            self._map_vectors(len(self._rows))
+
+
+def main():
+    """
+    The main function for the embedding_store script.
+    This is called when the script is run directly.
+    """
+    store = EmbeddingStore("embeddings", dimensions=4)
+    store.put_many(["apple", "banana"], [[0.1, 0.2, 0.3, 0.4], [0.5, 0.6, 0.7, 0.8]])
+    print(store.get("apple"))
+    vectors, found = store.get_many(["apple", "cherry", "banana"])
+    print(vectors, found)
+
+
+if __name__ == "__main__":
+    main()
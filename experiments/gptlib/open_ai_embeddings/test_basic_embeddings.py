@@ -40,11 +40,27 @@ Output:
 I want the script to be called basic_embeddings.py and it should have a generate_embedding(text: str) -> List[float]: function that takes an input string, and calls the openai.Embedding.create endpoint with that input string.
 """
 import asyncio
+import itertools
+import os
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch
 from typing import List
 
-from experiments.gptlib.open_ai_embeddings.basic_embeddings import generate_embedding
+import openai
+
+from experiments.gptlib.open_ai_embeddings.basic_embeddings import (
+    EmbeddingsCheckpoint,
+    EmbeddingsGenerator,
+    batch_texts,
+    generate_embedding,
+    generate_embeddings,
+    read_texts,
+)
+from experiments.gptlib.open_ai_embeddings.embedding_store import EmbeddingStore
+from experiments.helpers.fake_openai_server import FakeOpenAIServer
+from experiments.helpers.openai_session import RequestMetrics
 
 
 # Mock response for the OpenAI API call
@@ -83,5 +99,246 @@ class TestGenerateEmbedding(unittest.TestCase):
         mock_create_function.assert_called_once_with(input=text, model="text-embedding-ada-002")
 
 
+# Mock function that embeds each input as [len(input)], and returns the results in reverse order
+async def mock_batch_create(*args, **kwargs) -> dict:
+    inputs = kwargs["input"]
+    data = [{"embedding": [float(len(text))], "index": idx, "object": "embedding"} for idx, text in enumerate(inputs)]
+    return {"data": list(reversed(data)), "model": kwargs["model"], "object": "list"}
+
+
+class TestBatchedEmbeddings(unittest.TestCase):
+    """
+    A class that tests batching several texts into one embeddings request.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+
+    def test_batch_texts_by_items(self):
+        batches = list(batch_texts(["a", "b", "c", "d", "e"], max_batch_items=2, token_counter=lambda text: 1))
+        self.assertEqual([["a", "b"], ["c", "d"], ["e"]], batches)
+
+    def test_batch_texts_by_tokens(self):
+        texts = ["one", "three", "two", "four"]
+        token_counts = {"one": 1, "two": 2, "three": 3, "four": 4}
+        batches = list(batch_texts(texts, max_batch_items=10, max_batch_tokens=4, token_counter=token_counts.get))
+        self.assertEqual([["one", "three"], ["two"], ["four"]], batches)
+
+    def test_batch_texts_oversized_text(self):
+        batches = list(batch_texts(["short", "very long"], max_batch_tokens=2, token_counter=lambda text: len(text.split()) * 2))
+        self.assertEqual([["short"], ["very long"]], batches)
+
+    @patch("openai.Embedding.acreate", side_effect=mock_batch_create)
+    def test_generate_embeddings_maps_by_index(self, mock_create_function):
+        texts = ["a", "bb", "ccc"]
+        embeddings = self.loop.run_until_complete(generate_embeddings(texts))
+        self.assertEqual([[1.0], [2.0], [3.0]], embeddings)
+        mock_create_function.assert_called_once_with(input=texts, model="text-embedding-ada-002")
+
+    @patch("openai.Embedding.acreate", side_effect=mock_batch_create)
+    def test_multi_generate_embeddings_batches(self, mock_create_function):
+        words = ["a", "bb", "ccc", "dddd", "bb"]
+        generator = EmbeddingsGenerator(max_batch_items=2)
+        self.addCleanup(self.loop.run_until_complete, generator.close())
+        word_embeddings = self.loop.run_until_complete(generator.multi_generate_embeddings(words))
+
+        self.assertEqual({"a": [1.0], "bb": [2.0], "ccc": [3.0], "dddd": [4.0]}, word_embeddings)
+        self.assertEqual(2, mock_create_function.call_count)
+
+
+class TestEmbeddingsRetries(unittest.TestCase):
+    """
+    A class that tests how the EmbeddingsGenerator handles failed requests.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.calls = 0
+
+    async def flaky_create(self, *args, **kwargs) -> dict:
+        # Every other request fails, alternating between a rate limit and a server error
+        self.calls += 1
+        if self.calls % 4 == 1:
+            raise openai.error.RateLimitError("Rate limit reached", headers={"retry-after": "0.01"})
+        if self.calls % 4 == 3:
+            raise openai.error.APIError("The server had an error")
+        return await mock_batch_create(*args, **kwargs)
+
+    @patch("experiments.gptlib.open_ai_embeddings.basic_embeddings.backoff_delay", return_value=0.01)
+    def test_failed_batches_are_requeued(self, mock_backoff):
+        generator = EmbeddingsGenerator(max_batch_items=1, num_workers=2)
+        self.addCleanup(self.loop.run_until_complete, generator.close())
+        with patch("openai.Embedding.acreate", side_effect=self.flaky_create):
+            word_embeddings = self.loop.run_until_complete(generator.multi_generate_embeddings(["a", "bb", "ccc"]))
+
+        self.assertEqual({"a": [1.0], "bb": [2.0], "ccc": [3.0]}, word_embeddings)
+        self.assertEqual(3, generator.last_stats.items)
+        self.assertEqual(0, generator.last_stats.failed_items)
+        self.assertLessEqual(1, generator.last_stats.rate_limited)
+        self.assertEqual(generator.last_stats.requests - 3, generator.last_stats.retries)
+
+    @patch("openai.Embedding.acreate", side_effect=openai.error.InvalidRequestError("Too many tokens", param="input"))
+    def test_invalid_requests_are_not_retried(self, mock_create_function):
+        generator = EmbeddingsGenerator(max_batch_items=2)
+        self.addCleanup(self.loop.run_until_complete, generator.close())
+        word_embeddings = self.loop.run_until_complete(generator.multi_generate_embeddings(["a", "bb", "ccc"]))
+
+        self.assertEqual({}, word_embeddings)
+        self.assertEqual(2, mock_create_function.call_count)
+        self.assertEqual(3, generator.last_stats.failed_items)
+
+    @patch("experiments.gptlib.open_ai_embeddings.basic_embeddings.backoff_delay", return_value=0.0)
+    @patch("openai.Embedding.acreate", side_effect=openai.error.APIError("The server had an error"))
+    def test_gives_up_after_max_attempts(self, mock_create_function, mock_backoff):
+        generator = EmbeddingsGenerator(max_attempts=3)
+        self.addCleanup(self.loop.run_until_complete, generator.close())
+        word_embeddings = self.loop.run_until_complete(generator.multi_generate_embeddings(["a", "bb"]))
+
+        self.assertEqual({}, word_embeddings)
+        self.assertEqual(3, mock_create_function.call_count)
+        self.assertEqual(2, generator.last_stats.failed_items)
+
+
+class TestStreamingEmbeddings(unittest.TestCase):
+    """
+    A class that tests streaming embeddings with EmbeddingsGenerator.iter_embeddings.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.temp_dir = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.temp_dir, "checkpoint.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def collect(self, generator: EmbeddingsGenerator, texts, **kwargs) -> dict:
+        async def run():
+            return {text: embedding async for text, embedding in generator.iter_embeddings(texts, **kwargs)}
+
+        return self.loop.run_until_complete(run())
+
+    @patch("openai.Embedding.acreate", side_effect=mock_batch_create)
+    def test_reads_texts_lazily(self, mock_create_function):
+        generator = EmbeddingsGenerator(max_batch_items=2, num_workers=2)
+        self.addCleanup(self.loop.run_until_complete, generator.close())
+        endless_texts = (f"word {idx}" for idx in itertools.count())
+
+        async def take_five():
+            results = []
+            async for result in generator.iter_embeddings(endless_texts):
+                results.append(result)
+                if len(results) == 5:
+                    break
+            return results
+
+        self.assertEqual(5, len(self.loop.run_until_complete(take_five())))
+        # Only the batches allowed to read ahead were sent
+        self.assertGreaterEqual(2 + 2 * 2, mock_create_function.call_count)
+
+    @patch("openai.Embedding.acreate", side_effect=mock_batch_create)
+    def test_writes_to_store_and_skips_stored_texts(self, mock_create_function):
+        store = EmbeddingStore(self.temp_dir)
+        store.put("bb", [42.0])
+        generator = EmbeddingsGenerator(max_batch_items=10)
+        self.addCleanup(self.loop.run_until_complete, generator.close())
+        results = self.collect(generator, ["a", "bb", "ccc"], store=store)
+
+        self.assertEqual({"a": [1.0], "ccc": [3.0]}, results)
+        self.assertEqual(3, len(store))
+        self.assertEqual([3.0], store.get("ccc").tolist())
+        mock_create_function.assert_called_once_with(input=["a", "ccc"], model="text-embedding-ada-002")
+
+    def test_resumes_from_checkpoint(self):
+        store = EmbeddingStore(self.temp_dir)
+        texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+        async def fail_on_ccc(*args, **kwargs):
+            if "ccc" in kwargs["input"]:
+                raise openai.error.InvalidRequestError("Bad input", param="input")
+            return await mock_batch_create(*args, **kwargs)
+
+        generator = EmbeddingsGenerator(max_batch_items=1, num_workers=1)
+        self.addCleanup(self.loop.run_until_complete, generator.close())
+        with patch("openai.Embedding.acreate", side_effect=fail_on_ccc):
+            first_results = self.collect(generator, texts, store=store, checkpoint_path=self.checkpoint_path)
+        self.assertEqual(["a", "bb", "dddd", "eeeee"], sorted(first_results))
+        # The checkpoint stops before the failed batch
+        self.assertEqual(2, EmbeddingsCheckpoint(self.checkpoint_path).load())
+
+        with patch("openai.Embedding.acreate", side_effect=mock_batch_create) as mock_create_function:
+            second_results = self.collect(generator, texts, store=store, checkpoint_path=self.checkpoint_path)
+        self.assertEqual({"ccc": [3.0]}, second_results)
+        mock_create_function.assert_called_once_with(input=["ccc"], model="text-embedding-ada-002")
+        self.assertEqual(5, EmbeddingsCheckpoint(self.checkpoint_path).load())
+
+    def test_read_texts(self):
+        path = os.path.join(self.temp_dir, "texts.txt")
+        with open(path, "w") as f:
+            f.write("apple\n\n  banana split \r\ncherry")
+        self.assertEqual(["apple", "  banana split ", "cherry"], list(read_texts(path)))
+
+
+class TestEmbeddingsSession(unittest.TestCase):
+    """
+    A class that tests the long lived session of the EmbeddingsGenerator, against a FakeOpenAIServer.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = FakeOpenAIServer(dimensions=4, request_latency=0.01)
+        self.loop.run_until_complete(self.server.start())
+        self.previous_api_base = openai.api_base
+        openai.api_base = self.server.url
+
+    def tearDown(self):
+        openai.api_base = self.previous_api_base
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    def test_connections_are_reused_across_calls(self):
+        generator = EmbeddingsGenerator(num_workers=2, max_batch_items=1)
+
+        async def run():
+            async with generator:
+                first = await generator.multi_generate_embeddings(["a", "b", "c", "d"])
+                second = await generator.multi_generate_embeddings(["e", "f", "g", "h"])
+            return first, second
+
+        first, second = self.loop.run_until_complete(run())
+        self.assertEqual(4, len(first))
+        self.assertEqual(4, len(second))
+        self.assertEqual(8, self.server.request_count)
+        self.assertGreaterEqual(2, self.server.connection_count)
+
+    def test_concurrent_calls_share_the_session(self):
+        metrics = RequestMetrics()
+        generator = EmbeddingsGenerator(num_workers=4, max_batch_items=2)
+        generator.session.on_request = metrics
+
+        async def run():
+            async with generator:
+                return await asyncio.gather(*(generator.multi_generate_embeddings([f"{idx} {word}" for word in "abcdef"]) for idx in range(3)))
+
+        results = self.loop.run_until_complete(run())
+        self.assertEqual([6, 6, 6], [len(word_embeddings) for word_embeddings in results])
+        self.assertEqual(9, metrics.summary()["POST /v1/embeddings"]["count"])
+
+    def test_concurrent_calls_count_their_own_stats(self):
+        generator = EmbeddingsGenerator(num_workers=4, max_batch_items=1)
+
+        async def run():
+            async with generator:
+                await asyncio.gather(
+                    generator.multi_generate_embeddings(["a", "b", "c"]),
+                    generator.multi_generate_embeddings(["d", "e", "f", "g", "h"]),
+                )
+
+        self.loop.run_until_complete(run())
+        # The run that finished last, its counts are not mixed with the other's
+        self.assertIn(generator.last_stats.items, [3, 5])
+        self.assertEqual(generator.last_stats.items, generator.last_stats.requests)
+
+
 if __name__ == "__main__":
     unittest.main()
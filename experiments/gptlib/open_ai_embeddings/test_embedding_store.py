@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+A persistent store for embeddings, that keeps the vectors as one contiguous float32 matrix on disk instead of JSON lists.
+Each vector is keyed by a hash of the model name and the embedded text.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from experiments.gptlib.open_ai_embeddings.embedding_store import EmbeddingStore, make_key
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    """
+    A class that tests the EmbeddingStore.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_put_and_get(self):
+        store = EmbeddingStore(self.temp_dir)
+        self.assertIsNone(store.get("apple"))
+        store.put("apple", [0.1, 0.2, 0.3])
+
+        self.assertEqual(3, store.dimensions)
+        self.assertTrue(store.contains("apple"))
+        self.assertFalse(store.contains("apple", model="another-model"))
+        np.testing.assert_array_equal(np.array([0.1, 0.2, 0.3], dtype=np.float32), store.get("apple"))
+
+    def test_get_returns_a_view(self):
+        store = EmbeddingStore(self.temp_dir)
+        store.put_many(["apple", "banana"], [[1, 2], [3, 4]])
+        vector = store.get("banana")
+        self.assertIsInstance(vector.base, np.memmap)
+        self.assertFalse(vector.flags.writeable)
+
+    def test_put_many_and_get_many(self):
+        store = EmbeddingStore(self.temp_dir)
+        store.put_many(["apple", "banana", "apple"], np.array([[1, 2], [3, 4], [5, 6]]))
+        self.assertEqual(2, len(store))
+
+        vectors, found = store.get_many(["banana", "cherry", "apple"])
+        np.testing.assert_array_equal(np.array([[3, 4], [0, 0], [1, 2]], dtype=np.float32), vectors)
+        np.testing.assert_array_equal(np.array([True, False, True]), found)
+
+    def test_put_many_nothing(self):
+        store = EmbeddingStore(self.temp_dir)
+        store.put_many([], [])
+        self.assertEqual(0, len(store))
+        self.assertIsNone(store.dimensions)
+        store.put_many(["apple"], [[1, 2]])
+        store.put_many([], np.empty((0, 2)))
+        self.assertEqual(1, len(store))
+
+    def test_existing_keys_are_not_overwritten(self):
+        store = EmbeddingStore(self.temp_dir)
+        store.put("apple", [1, 2])
+        store.put("apple", [3, 4])
+        self.assertEqual(1, len(store))
+        np.testing.assert_array_equal(np.array([1, 2], dtype=np.float32), store.get("apple"))
+
+    def test_reopen(self):
+        store = EmbeddingStore(self.temp_dir)
+        store.put_many([f"word_{idx}" for idx in range(100)], np.arange(300).reshape(100, 3))
+
+        reopened = EmbeddingStore(self.temp_dir)
+        self.assertEqual(100, len(reopened))
+        self.assertEqual(3, reopened.dimensions)
+        np.testing.assert_array_equal(np.array([297, 298, 299], dtype=np.float32), reopened.get("word_99"))
+        np.testing.assert_array_equal(np.arange(300, dtype=np.float32).reshape(100, 3), reopened.vectors)
+
+    def test_partial_row_is_dropped(self):
+        store = EmbeddingStore(self.temp_dir)
+        store.put_many(["apple", "banana"], [[1, 2], [3, 4]])
+        # Simulate a crash after the vector of a third row was written, but before its key.
+        with open(os.path.join(self.temp_dir, "vectors.f32"), "ab") as f:
+            f.write(np.array([5, 6], dtype=np.float32).tobytes())
+
+        reopened = EmbeddingStore(self.temp_dir)
+        self.assertEqual(2, len(reopened))
+        reopened.put("cherry", [7, 8])
+        np.testing.assert_array_equal(np.array([7, 8], dtype=np.float32), reopened.get("cherry"))
+
+    def test_dimension_mismatch(self):
+        store = EmbeddingStore(self.temp_dir, dimensions=3)
+        with self.assertRaises(ValueError):
+            store.put("apple", [1, 2])
+        with self.assertRaises(ValueError):
+            EmbeddingStore(self.temp_dir, dimensions=4)
+
+    def test_keys_are_in_row_order(self):
+        store = EmbeddingStore(self.temp_dir)
+        store.put_many(["banana", "apple"], [[1, 2], [3, 4]])
+        self.assertEqual([make_key("banana"), make_key("apple")], store.keys())
+
+    def test_make_key(self):
+        self.assertEqual(16, len(make_key("apple")))
+        self.assertNotEqual(make_key("apple"), make_key("apple", model="another-model"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Benchmarks the IVFIndex against exact search with the SimilarityIndex, reporting the recall@10 and the queries
+per second for several values of nprobe. The vectors are random points scattered around random directions,
+which is closer to how real embeddings are spread than uniformly random vectors.
+
+Usage:
+    python -m experiments.gptlib.similarity_search.bench_ivf_index --count 1000000 --dimensions 256
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from experiments.gptlib.similarity_search.ivf_index import IVFIndex
+from experiments.gptlib.similarity_search.similarity_search import SimilarityIndex
+
+BUILD_BATCH_SIZE = 100_000
+
+
+def clustered_vectors(count: int, centers: np.ndarray, spread: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Make random vectors scattered around the given directions.
+    :param count: the number of vectors.
+    :param centers: the (clusters, dimensions) matrix of directions.
+    :param spread: the standard deviation of the noise added to the directions.
+    :param rng: the random generator.
+    :return: the (count, dimensions) matrix of vectors.
+    """
+    noise = rng.standard_normal((count, centers.shape[1]), dtype=np.float32) * spread
+    return centers[rng.integers(len(centers), size=count)] + noise
+
+
+def recall_at_k(exact_rows: np.ndarray, approximate_rows: np.ndarray) -> float:
+    """
+    Get the average fraction of the exact top k found by the approximate search.
+    :param exact_rows: the (queries, k) matrix of the exact results.
+    :param approximate_rows: the (queries, k) matrix of the approximate results.
+    :return: the recall, from 0 to 1.
+    """
+    k = exact_rows.shape[1]
+    return float(np.mean([len(set(exact) & set(approximate)) / k for exact, approximate in zip(exact_rows.tolist(), approximate_rows.tolist())]))
+
+
+def main():
+    """
+    The main function for the IVFIndex benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the recall and speed of the IVFIndex against exact search.")
+    parser.add_argument("--count", type=int, default=1_000_000, help="The number of indexed vectors.")
+    parser.add_argument("--dimensions", type=int, default=256, help="The number of dimensions of the vectors.")
+    parser.add_argument("--clusters", type=int, default=500, help="The number of directions the vectors are scattered around.")
+    parser.add_argument("--spread", type=float, default=1.5, help="How far the vectors are scattered from their directions.")
+    parser.add_argument("--n-lists", type=int, default=None, help="The number of IVF lists, 4 * sqrt(count) by default.")
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64], help="The values of nprobe to try.")
+    parser.add_argument("--queries", type=int, default=200, help="The number of queries.")
+    parser.add_argument("--k", type=int, default=10, help="The number of results per query.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.clusters, args.dimensions), dtype=np.float32)
+    n_lists = args.n_lists or int(4 * np.sqrt(args.count))
+    exact = SimilarityIndex(args.dimensions, initial_capacity=args.count)
+    for start in range(0, args.count, BUILD_BATCH_SIZE):
+        batch_size = min(BUILD_BATCH_SIZE, args.count - start)
+        exact.add_many(range(start, start + batch_size), clustered_vectors(batch_size, centers, args.spread, rng))
+    queries = clustered_vectors(args.queries, centers, args.spread, rng)
+
+    start = time.perf_counter()
+    index = IVFIndex(args.dimensions, n_lists=n_lists)
+    index.train(exact.vectors)
+    train_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for batch_start in range(0, args.count, BUILD_BATCH_SIZE):
+        batch_end = min(args.count, batch_start + BUILD_BATCH_SIZE)
+        index.add_many(exact.keys[batch_start:batch_end], exact.vectors[batch_start:batch_end])
+    index.merge_pending()
+    add_seconds = time.perf_counter() - start
+    print(f"{args.count} vectors of {args.dimensions} dimensions, {n_lists} lists: trained in {train_seconds:.2f} s, added in {add_seconds:.2f} s")
+
+    index_dir = tempfile.mkdtemp(prefix="bench_ivf_index_")
+    try:
+        start = time.perf_counter()
+        index.save(index_dir)
+        save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        index = IVFIndex.load(index_dir)
+        print(f"saved in {save_seconds:.2f} s, loaded (memory-mapped) in {time.perf_counter() - start:.3f} s")
+
+        start = time.perf_counter()
+        _, exact_rows = exact.search_arrays(queries, args.k)
+        exact_seconds = time.perf_counter() - start
+        print(f"{'search':>12} {'recall@' + str(args.k):>10} {'queries/s':>10}")
+        print(f"{'exact':>12} {1.0:>10.3f} {args.queries / exact_seconds:>10.1f}")
+        for nprobe in args.nprobes:
+            start = time.perf_counter()
+            _, approximate_rows = index.search_arrays(queries, args.k, nprobe=nprobe)
+            elapsed = time.perf_counter() - start
+            print(f"{'nprobe=' + str(nprobe):>12} {recall_at_k(exact_rows, approximate_rows):>10.3f} {args.queries / elapsed:>10.1f}")
+        del index
+    finally:
+        shutil.rmtree(index_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Benchmarks the exact SimilarityIndex on random vectors: one query at a time, many queries as one matrix multiply,
+and a baseline that scores with NumPy but ranks by feeding every (score, row) to a TopNList one item at a time.
+
+At 1536 dimensions, 1M vectors take 6 GB of memory, so use --dimensions to shrink them on smaller machines.
+
+Usage:
+    python -m experiments.gptlib.similarity_search.bench_similarity_search --counts 100000 1000000 --dimensions 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+from experiments.gptlib.similarity_search.similarity_search import SimilarityIndex
+from experiments.gptlib.top_n_list.top_n_list import TopNList
+
+BUILD_BATCH_SIZE = 100_000
+
+
+def build_index(count: int, dimensions: int, rng: np.random.Generator) -> SimilarityIndex:
+    """
+    Build a cosine SimilarityIndex of count random vectors, keyed by their row number.
+    :param count: the number of vectors.
+    :param dimensions: the number of dimensions of the vectors.
+    :param rng: the random generator.
+    :return: the index.
+    """
+    index = SimilarityIndex(dimensions, initial_capacity=count)
+    for start in range(0, count, BUILD_BATCH_SIZE):
+        batch_size = min(BUILD_BATCH_SIZE, count - start)
+        index.add_many(range(start, start + batch_size), rng.standard_normal((batch_size, dimensions), dtype=np.float32))
+    return index
+
+
+def bench_top_n_list(index: SimilarityIndex, queries: np.ndarray, k: int) -> None:
+    """
+    Rank every stored vector for each query through a TopNList, the way it was done before the SimilarityIndex.
+    :param index: the index holding the vectors.
+    :param queries: the query vectors.
+    :param k: the number of results per query.
+    """
+    for query in queries:
+        scores = index.vectors @ (query / np.linalg.norm(query))
+        top_n_list = TopNList(key=lambda item: item[0], max_length=k)
+        top_n_list.addItems(zip(scores.tolist(), range(len(scores))))
+        top_n_list.asSortedList()
+
+
+def main():
+    """
+    The main function for the similarity search benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark exact similarity search.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[100_000, 1_000_000], help="The numbers of stored vectors.")
+    parser.add_argument("--dimensions", type=int, default=1536, help="The number of dimensions of the vectors.")
+    parser.add_argument("--queries", type=int, default=100, help="The number of queries.")
+    parser.add_argument("--k", type=int, default=10, help="The number of results per query.")
+    parser.add_argument("--baseline-queries", type=int, default=5, help="The number of queries for the slow TopNList baseline.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for count in args.counts:
+        start = time.perf_counter()
+        index = build_index(count, args.dimensions, rng)
+        build_seconds = time.perf_counter() - start
+        queries = rng.standard_normal((args.queries, args.dimensions), dtype=np.float32)
+        print(f"{count} vectors of {args.dimensions} dimensions, built in {build_seconds:.2f} s:")
+
+        timings = {}
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, args.k)
+        timings["search"] = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        index.search_many(queries, args.k)
+        timings["search_many"] = (time.perf_counter() - start) / len(queries)
+
+        baseline_queries = queries[: args.baseline_queries]
+        start = time.perf_counter()
+        bench_top_n_list(index, baseline_queries, args.k)
+        timings["TopNList"] = (time.perf_counter() - start) / len(baseline_queries)
+
+        for mode, seconds in timings.items():
+            print(f"    {mode:>12}: {seconds * 1000:10.2f} ms/query {1 / seconds:10.1f} queries/s")
+        del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""
+Approximate nearest-neighbour search over embeddings, with an inverted file (IVF) index.
+
+The vectors are split into n_lists clusters by k-means, and each vector is filed in the list of its nearest
+centroid. A query is only compared to the vectors of the nprobe lists whose centroids are nearest to it, so it
+scans about nprobe / n_lists of the vectors. Raising nprobe trades speed for recall, up to nprobe = n_lists,
+which is an exact search.
+
+The lists are kept as one matrix sorted by list, with the offset where each list starts, so a list is a
+contiguous slice. Vectors added after that are kept in a pending matrix, scanned as well, until merge_pending
+sorts them into the lists. save writes the matrices as .npy files, and load memory-maps them.
+"""
+import os
+import pickle
+from os.path import join
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from experiments.gptlib.open_ai_embeddings.embedding_store import EmbeddingStore
+from experiments.gptlib.similarity_search.similarity_search import METRICS, VECTOR_DTYPE, normalize_rows, top_k_indices
+
+# The number of vectors assigned to the centroids at once, to bound the memory of the score matrix.
+ASSIGN_CHUNK_SIZE = 16_384
+# Pending vectors are merged into the lists once they outnumber this fraction of the listed vectors.
+MAX_PENDING_FRACTION = 0.1
+MIN_PENDING_TO_MERGE = 10_000
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Find the centroid with the highest dot product with each vector.
+    :param vectors: the (count, dimensions) matrix of vectors.
+    :param centroids: the (n_lists, dimensions) matrix of unit length centroids.
+    :return: the index of the centroid of each vector.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        assignments[start : start + ASSIGN_CHUNK_SIZE] = np.argmax(vectors[start : start + ASSIGN_CHUNK_SIZE] @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Cluster vectors by direction, with k-means on the unit sphere.
+    :param vectors: the (count, dimensions) matrix of vectors to cluster.
+    :param n_clusters: the number of clusters, at most the number of vectors.
+    :param iterations: the number of assignment and update rounds.
+    :param seed: the seed of the random initialization.
+    :return: the (n_clusters, dimensions) matrix of unit length centroids.
+    """
+    if n_clusters > len(vectors):
+        raise ValueError(f"Cannot find {n_clusters} clusters in {len(vectors)} vectors")
+    rng = np.random.default_rng(seed)
+    points = normalize_rows(np.asarray(vectors, dtype=VECTOR_DTYPE))
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)]
+    for _ in range(iterations):
+        assignments = assign_to_centroids(points, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        order = np.argsort(assignments, kind="stable")
+        starts = np.cumsum(counts) - counts
+        filled = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(points[order], starts[filled])
+        # Clusters that lost all their points start again from a random point
+        sums[~filled] = points[rng.choice(len(points), int((~filled).sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    An approximate nearest-neighbour index of vectors, each with a key, split into k-means clustered lists.
+    """
+
+    def __init__(self, dimensions: int, n_lists: int = 1024, metric: str = "cosine", nprobe: int = 8):
+        """
+        Initialize an empty, untrained IVFIndex.
+        :param dimensions: the number of dimensions of the vectors.
+        :param n_lists: the number of lists. About 4 * sqrt(number of vectors) is a good start.
+        :param metric: "cosine" to rank by cosine similarity, or "dot" to rank by dot product.
+        :param nprobe: the default number of lists scanned per query, the recall / latency knob.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        self.dimensions = dimensions
+        self.n_lists = n_lists
+        self.metric = metric
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self._keys: List[Hashable] = []
+        # The listed vectors, sorted by list, the key index of each of them, and where each list starts
+        self._list_vectors = np.empty((0, dimensions), dtype=VECTOR_DTYPE)
+        self._list_ids = np.empty(0, dtype=np.int64)
+        self._list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        # The vectors added since the lists were last sorted, in insertion order
+        self._pending_vectors = np.empty((1024, dimensions), dtype=VECTOR_DTYPE)
+        self._pending_ids = np.empty(1024, dtype=np.int64)
+        self._pending_lists = np.empty(1024, dtype=np.int32)
+        self._pending_count = 0
+
+    @classmethod
+    def from_store(cls, store: EmbeddingStore, n_lists: int = 1024, metric: str = "cosine", nprobe: int = 8) -> "IVFIndex":
+        """
+        Train an IVFIndex on the vectors of an EmbeddingStore, and add them all, keyed by their store keys.
+        :param store: the EmbeddingStore to index.
+        :param n_lists: the number of lists.
+        :param metric: "cosine" or "dot".
+        :param nprobe: the default number of lists scanned per query.
+        :return: the new IVFIndex.
+        """
+        index = cls(store.dimensions or 0, n_lists=n_lists, metric=metric, nprobe=nprobe)
+        index.train(store.vectors)
+        index.add_many(store.keys(), store.vectors)
+        index.merge_pending()
+        return index
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def is_trained(self) -> bool:
+        """
+        Whether the centroids of the lists are known, which is needed before adding vectors.
+        """
+        return self.centroids is not None
+
+    @property
+    def keys(self) -> List[Hashable]:
+        """
+        The keys of the indexed vectors, in insertion order.
+        """
+        return self._keys
+
+    def train(self, vectors, iterations: int = 10, max_training_vectors: Optional[int] = None, seed: int = 0) -> None:
+        """
+        Find the centroids of the lists, with k-means on a sample of representative vectors.
+        :param vectors: the training vectors, usually the vectors about to be added.
+        :param iterations: the number of k-means rounds.
+        :param max_training_vectors: the size of the random sample trained on, by default 32 per list.
+        :param seed: the seed of the sampling and of the k-means initialization.
+        """
+        if len(self._keys) > 0:
+            raise RuntimeError("Cannot train an IVFIndex that already holds vectors")
+        matrix = np.asarray(vectors, dtype=VECTOR_DTYPE)
+        sample_size = max_training_vectors or 32 * self.n_lists
+        if len(matrix) > sample_size:
+            matrix = matrix[np.sort(np.random.default_rng(seed).choice(len(matrix), sample_size, replace=False))]
+        self.centroids = spherical_kmeans(matrix, self.n_lists, iterations=iterations, seed=seed)
+
+    def add(self, key: Hashable, vector: Sequence[float]) -> None:
+        """
+        Add a vector to the index.
+        :param key: the key returned with the vector in search results.
+        :param vector: the vector.
+        """
+        self.add_many([key], [vector])
+
+    def add_many(self, keys: Sequence[Hashable], vectors) -> None:
+        """
+        Add many vectors to the index at once. They are searchable right away, from the pending matrix.
+        :param keys: the keys returned with the vectors in search results.
+        :param vectors: the vectors, one per key, as lists or as a matrix.
+        """
+        if not self.is_trained:
+            raise RuntimeError("Train the IVFIndex before adding vectors")
+        matrix = np.asarray(vectors, dtype=VECTOR_DTYPE)
+        if matrix.ndim != 2 or matrix.shape != (len(keys), self.dimensions):
+            raise ValueError(f"Expected a ({len(keys)}, {self.dimensions}) matrix of vectors, got shape {matrix.shape}")
+        if self.metric == "cosine":
+            matrix = normalize_rows(matrix)
+        needed = self._pending_count + len(keys)
+        if needed > len(self._pending_ids):
+            capacity = max(needed, 2 * len(self._pending_ids))
+            self._pending_vectors = self._grow(self._pending_vectors, capacity)
+            self._pending_ids = self._grow(self._pending_ids, capacity)
+            self._pending_lists = self._grow(self._pending_lists, capacity)
+        self._pending_vectors[self._pending_count : needed] = matrix
+        self._pending_ids[self._pending_count : needed] = np.arange(len(self._keys), len(self._keys) + len(keys))
+        self._pending_lists[self._pending_count : needed] = assign_to_centroids(matrix, self.centroids)
+        self._pending_count = needed
+        self._keys.extend(keys)
+        if self._pending_count > max(MIN_PENDING_TO_MERGE, MAX_PENDING_FRACTION * len(self._list_ids)):
+            self.merge_pending()
+
+    def _grow(self, array: np.ndarray, capacity: int) -> np.ndarray:
+        """
+        Copy the pending part of an array into a larger one.
+        :param array: the array to grow.
+        :param capacity: the new number of rows.
+        :return: the new array.
+        """
+        grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[: self._pending_count] = array[: self._pending_count]
+        return grown
+
+    def merge_pending(self) -> None:
+        """
+        Sort the pending vectors into the lists, so every list is one contiguous slice again.
+        """
+        if self._pending_count == 0:
+            return
+        listed_lists = np.repeat(np.arange(self.n_lists, dtype=np.int32), np.diff(self._list_offsets))
+        all_lists = np.concatenate([listed_lists, self._pending_lists[: self._pending_count]])
+        order = np.argsort(all_lists, kind="stable")
+        self._list_vectors = np.concatenate([self._list_vectors, self._pending_vectors[: self._pending_count]])[order]
+        self._list_ids = np.concatenate([self._list_ids, self._pending_ids[: self._pending_count]])[order]
+        self._list_offsets = np.concatenate([[0], np.cumsum(np.bincount(all_lists, minlength=self.n_lists))])
+        self._pending_count = 0
+
+    def search_arrays(self, queries, k: int = 10, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find approximately the k indexed vectors most similar to each query, as arrays.
+        :param queries: the query vectors, as a (queries, dimensions) matrix.
+        :param k: the number of results per query.
+        :param nprobe: the number of lists to scan per query, self.nprobe by default.
+        :return: a (queries, k) matrix of scores, and a (queries, k) matrix of the key indexes they belong to,
+            each sorted from the most to the least similar. Queries with fewer than k candidates are padded
+            with -inf scores and -1 key indexes.
+        """
+        if not self.is_trained:
+            raise RuntimeError("Train the IVFIndex before searching it")
+        query_matrix = np.asarray(queries, dtype=VECTOR_DTYPE)
+        if query_matrix.ndim != 2 or query_matrix.shape[1] != self.dimensions:
+            raise ValueError(f"Expected a matrix of {self.dimensions} dimension queries, got shape {query_matrix.shape}")
+        if self.metric == "cosine":
+            query_matrix = normalize_rows(query_matrix)
+        probed_lists = top_k_indices(normalize_rows(query_matrix) @ self.centroids.T, nprobe or self.nprobe)
+        scores = np.full((len(query_matrix), k), -np.inf, dtype=VECTOR_DTYPE)
+        ids = np.full((len(query_matrix), k), -1, dtype=np.int64)
+        pending_vectors = self._pending_vectors[: self._pending_count]
+        pending_lists = self._pending_lists[: self._pending_count]
+        for query_idx, (query, lists) in enumerate(zip(query_matrix, probed_lists)):
+            candidate_scores = []
+            candidate_ids = []
+            for list_idx in lists:
+                start, end = self._list_offsets[list_idx], self._list_offsets[list_idx + 1]
+                if end > start:
+                    candidate_scores.append(self._list_vectors[start:end] @ query)
+                    candidate_ids.append(self._list_ids[start:end])
+            if self._pending_count:
+                in_probed_lists = np.isin(pending_lists, lists)
+                candidate_scores.append(pending_vectors[in_probed_lists] @ query)
+                candidate_ids.append(self._pending_ids[: self._pending_count][in_probed_lists])
+            if not candidate_scores:
+                continue
+            query_scores = np.concatenate(candidate_scores)
+            best = top_k_indices(query_scores[np.newaxis, :], k)[0]
+            scores[query_idx, : len(best)] = query_scores[best]
+            ids[query_idx, : len(best)] = np.concatenate(candidate_ids)[best]
+        return scores, ids
+
+    def search(self, query: Sequence[float], k: int = 10, nprobe: Optional[int] = None) -> List[Tuple[float, Hashable]]:
+        """
+        Find approximately the k indexed vectors most similar to the query.
+        :param query: the query vector.
+        :param k: the number of results.
+        :param nprobe: the number of lists to scan, self.nprobe by default.
+        :return: the (score, key) pairs, from the most to the least similar.
+        """
+        return self.search_many([query], k, nprobe)[0]
+
+    def search_many(self, queries, k: int = 10, nprobe: Optional[int] = None) -> List[List[Tuple[float, Hashable]]]:
+        """
+        Find approximately the k indexed vectors most similar to each of many queries.
+        :param queries: the query vectors, as lists or as a matrix.
+        :param k: the number of results per query.
+        :param nprobe: the number of lists to scan per query, self.nprobe by default.
+        :return: for each query, the (score, key) pairs, from the most to the least similar.
+        """
+        scores, ids = self.search_arrays(queries, k, nprobe)
+        return [
+            [(float(score), self._keys[key_idx]) for score, key_idx in zip(query_scores, query_ids) if key_idx >= 0]
+            for query_scores, query_ids in zip(scores.tolist(), ids.tolist())
+        ]
+
+    def save(self, index_dir: str) -> None:
+        """
+        Save the index in a directory, merging the pending vectors first.
+        The matrices are saved as .npy files, and the keys are pickled, so any picklable key works.
+        :param index_dir: the directory to save the index in, created if needed.
+        """
+        if not self.is_trained:
+            raise RuntimeError("Train the IVFIndex before saving it")
+        self.merge_pending()
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(join(index_dir, "centroids.npy"), self.centroids)
+        np.save(join(index_dir, "vectors.npy"), self._list_vectors)
+        np.save(join(index_dir, "ids.npy"), self._list_ids)
+        np.save(join(index_dir, "offsets.npy"), self._list_offsets)
+        with open(join(index_dir, "meta.pkl"), "wb") as f:
+            pickle.dump({"metric": self.metric, "nprobe": self.nprobe, "keys": self._keys}, f)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "IVFIndex":
+        """
+        Load an index saved with save. The vectors are memory-mapped read only, so loading is fast and the
+        operating system only pages in the lists that are searched. Adding vectors still works, and merging
+        them copies the lists into memory.
+        :param index_dir: the directory the index was saved in.
+        :return: the loaded IVFIndex.
+        """
+        with open(join(index_dir, "meta.pkl"), "rb") as f:
+            meta = pickle.load(f)
+        centroids = np.load(join(index_dir, "centroids.npy"))
+        index = cls(centroids.shape[1], n_lists=len(centroids), metric=meta["metric"], nprobe=meta["nprobe"])
+        index.centroids = centroids
+        index._keys = meta["keys"]
+        index._list_vectors = np.load(join(index_dir, "vectors.npy"), mmap_mode="r")
+        index._list_ids = np.load(join(index_dir, "ids.npy"), mmap_mode="r")
+        index._list_offsets = np.load(join(index_dir, "offsets.npy"))
+        return index
+
+
+def main():
+    """
+    The main function for the IVFIndex.
+    This is called when the script is run directly.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((10_000, 64), dtype=np.float32)
+    index = IVFIndex(dimensions=64, n_lists=64, nprobe=4)
+    index.train(vectors)
+    index.add_many(range(len(vectors)), vectors)
+    print(index.search(vectors[42], k=3))
+
+
+if __name__ == "__main__":
+    main()
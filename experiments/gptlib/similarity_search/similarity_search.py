@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Exact nearest-neighbour search over embeddings, held as rows of one NumPy matrix.
+
+A batch of queries is scored against every stored vector with a single matrix multiply, and the top k of each
+row of scores is picked with argpartition, which is linear in the number of stored vectors, before only those
+k are sorted. With the cosine metric the vectors are normalized when they are added, so the scores are plain
+dot products at query time.
+"""
+from typing import Hashable, List, Sequence, Tuple
+
+import numpy as np
+
+from experiments.gptlib.open_ai_embeddings.embedding_store import EmbeddingStore
+
+METRICS = ("cosine", "dot")
+VECTOR_DTYPE = np.float32
+# The largest number of scores computed at once when searching many queries, to bound the memory used.
+MAX_SCORES_PER_CHUNK = 1 << 24
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Scale every row of the matrix to unit length. Rows of zeros are left as they are.
+    :param matrix: the 2D matrix.
+    :return: a new matrix of unit length rows.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Get the column indices of the k highest scores of every row, from the highest to the lowest.
+    :param scores: the 2D matrix of scores, one row per query.
+    :param k: the number of indices to keep per row, capped to the number of columns.
+    :return: the (rows, k) matrix of column indices.
+    """
+    column_count = scores.shape[1]
+    k = min(k, column_count)
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < column_count:
+        candidates = np.argpartition(scores, column_count - k, axis=1)[:, column_count - k :]
+    else:
+        candidates = np.broadcast_to(np.arange(column_count), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class SimilarityIndex:
+    """
+    A growable matrix of vectors, each with a key, searched exactly for the vectors most similar to a query.
+    """
+
+    def __init__(self, dimensions: int, metric: str = "cosine", initial_capacity: int = 1024):
+        """
+        Initialize an empty SimilarityIndex.
+        :param dimensions: the number of dimensions of the vectors.
+        :param metric: "cosine" to rank by cosine similarity, or "dot" to rank by dot product.
+        :param initial_capacity: the number of rows allocated up front. The matrix doubles whenever it is full.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        self.dimensions = dimensions
+        self.metric = metric
+        self._matrix = np.empty((max(initial_capacity, 1), dimensions), dtype=VECTOR_DTYPE)
+        self._keys: List[Hashable] = []
+
+    @classmethod
+    def from_store(cls, store: EmbeddingStore, metric: str = "cosine") -> "SimilarityIndex":
+        """
+        Build a SimilarityIndex of every vector in an EmbeddingStore, keyed by their store keys.
+        :param store: the EmbeddingStore to load.
+        :param metric: "cosine" or "dot".
+        :return: the new SimilarityIndex.
+        """
+        index = cls(store.dimensions or 0, metric=metric, initial_capacity=len(store))
+        index.add_many(store.keys(), store.vectors)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        The matrix of the stored vectors, normalized if the metric is cosine, one row per key.
+        """
+        return self._matrix[: len(self._keys)]
+
+    @property
+    def keys(self) -> List[Hashable]:
+        """
+        The keys of the stored vectors, in row order.
+        """
+        return self._keys
+
+    def add(self, key: Hashable, vector: Sequence[float]) -> None:
+        """
+        Add a vector to the index.
+        :param key: the key returned with the vector in search results.
+        :param vector: the vector.
+        """
+        self.add_many([key], [vector])
+
+    def add_many(self, keys: Sequence[Hashable], vectors) -> None:
+        """
+        Add many vectors to the index at once.
+        :param keys: the keys returned with the vectors in search results.
+        :param vectors: the vectors, one per key, as lists or as a matrix.
+        """
+        matrix = np.asarray(vectors, dtype=VECTOR_DTYPE)
+        if matrix.ndim != 2 or matrix.shape != (len(keys), self.dimensions):
+            raise ValueError(f"Expected a ({len(keys)}, {self.dimensions}) matrix of vectors, got shape {matrix.shape}")
+        if self.metric == "cosine":
+            matrix = normalize_rows(matrix)
+        row_count = len(self._keys)
+        needed = row_count + len(keys)
+        if needed > self._matrix.shape[0]:
+            grown = np.empty((max(needed, 2 * self._matrix.shape[0]), self.dimensions), dtype=VECTOR_DTYPE)
+            grown[:row_count] = self._matrix[:row_count]
+            self._matrix = grown
+        self._matrix[row_count:needed] = matrix
+        self._keys.extend(keys)
+
+    def search_arrays(self, queries, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k stored vectors most similar to each query, as arrays, without building Python tuples.
+        :param queries: the query vectors, as a (queries, dimensions) matrix.
+        :param k: the number of results per query, capped to the number of stored vectors.
+        :return: a (queries, k) matrix of scores, and a (queries, k) matrix of the rows they belong to,
+            each sorted from the most to the least similar.
+        """
+        query_matrix = np.asarray(queries, dtype=VECTOR_DTYPE)
+        if query_matrix.ndim != 2 or query_matrix.shape[1] != self.dimensions:
+            raise ValueError(f"Expected a matrix of {self.dimensions} dimension queries, got shape {query_matrix.shape}")
+        if self.metric == "cosine":
+            query_matrix = normalize_rows(query_matrix)
+        k = min(k, len(self))
+        scores = np.empty((len(query_matrix), k), dtype=VECTOR_DTYPE)
+        rows = np.empty((len(query_matrix), k), dtype=np.int64)
+        vectors = self.vectors
+        chunk_size = max(1, MAX_SCORES_PER_CHUNK // max(len(vectors), 1))
+        for start in range(0, len(query_matrix), chunk_size):
+            chunk_scores = query_matrix[start : start + chunk_size] @ vectors.T
+            chunk_rows = top_k_indices(chunk_scores, k)
+            rows[start : start + chunk_size] = chunk_rows
+            scores[start : start + chunk_size] = np.take_along_axis(chunk_scores, chunk_rows, axis=1)
+        return scores, rows
+
+    def search(self, query: Sequence[float], k: int = 10) -> List[Tuple[float, Hashable]]:
+        """
+        Find the k stored vectors most similar to the query.
+        :param query: the query vector.
+        :param k: the number of results.
+        :return: the (score, key) pairs, from the most to the least similar.
+        """
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries, k: int = 10) -> List[List[Tuple[float, Hashable]]]:
+        """
+        Find the k stored vectors most similar to each of many queries, with one matrix multiply.
+        :param queries: the query vectors, as lists or as a matrix.
+        :param k: the number of results per query.
+        :return: for each query, the (score, key) pairs, from the most to the least similar.
+        """
+        scores, rows = self.search_arrays(queries, k)
+        return [
+            [(float(score), self._keys[row]) for score, row in zip(query_scores, query_rows)]
+            for query_scores, query_rows in zip(scores.tolist(), rows.tolist())
+        ]
+
+
+def main():
+    """
+    The main function for the SimilarityIndex.
+    This is called when the script is run directly.
+    """
+    index = SimilarityIndex(dimensions=2)
+    index.add_many(["east", "north", "west", "north-east"], [[1, 0], [0, 1], [-1, 0], [1, 1]])
+    print(index.search([1, 0.2], k=2))
+
+
+if __name__ == "__main__":
+    main()
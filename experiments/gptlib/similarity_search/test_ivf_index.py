@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Approximate nearest-neighbour search over embeddings, with an inverted file (IVF) index.
+"""
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from experiments.gptlib.similarity_search.ivf_index import IVFIndex, spherical_kmeans
+from experiments.gptlib.similarity_search.similarity_search import SimilarityIndex
+
+
+def clustered_vectors(count: int, dimensions: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """
+    Make random vectors scattered around a few random directions, like real embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions))
+    return (centers[rng.integers(clusters, size=count)] + 0.3 * rng.standard_normal((count, dimensions))).astype(np.float32)
+
+
+class TestIVFIndex(unittest.TestCase):
+    """
+    A class that tests the IVFIndex.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.vectors = clustered_vectors(2000, 16, clusters=20)
+        self.index = IVFIndex(dimensions=16, n_lists=16, nprobe=4)
+        self.index.train(self.vectors)
+        self.index.add_many(list(range(len(self.vectors))), self.vectors)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def recall(self, index: IVFIndex, queries: np.ndarray, nprobe: int) -> float:
+        exact = SimilarityIndex(dimensions=16)
+        exact.add_many(list(range(len(self.vectors))), self.vectors)
+        _, exact_rows = exact.search_arrays(queries, k=10)
+        _, approximate_ids = index.search_arrays(queries, k=10, nprobe=nprobe)
+        return np.mean([len(set(expected) & set(found)) / 10 for expected, found in zip(exact_rows.tolist(), approximate_ids.tolist())])
+
+    def test_spherical_kmeans(self):
+        centroids = spherical_kmeans(self.vectors, 8)
+        self.assertEqual((8, 16), centroids.shape)
+        np.testing.assert_allclose(np.ones(8), np.linalg.norm(centroids, axis=1), rtol=1e-5)
+        with self.assertRaises(ValueError):
+            spherical_kmeans(self.vectors[:4], 8)
+
+    def test_finds_itself(self):
+        for idx in [0, 500, 1999]:
+            score, key = self.index.search(self.vectors[idx], k=1)[0]
+            self.assertEqual(idx, key)
+            self.assertAlmostEqual(1.0, score, places=5)
+
+    def test_nprobe_trades_recall(self):
+        queries = clustered_vectors(50, 16, clusters=20, seed=1)
+        low_recall = self.recall(self.index, queries, nprobe=1)
+        self.assertEqual(1.0, self.recall(self.index, queries, nprobe=16))
+        self.assertLessEqual(low_recall, self.recall(self.index, queries, nprobe=4))
+
+    def test_pending_and_merged_vectors_give_the_same_results(self):
+        queries = clustered_vectors(20, 16, clusters=20, seed=1)
+        index = IVFIndex(dimensions=16, n_lists=16, nprobe=4)
+        index.train(self.vectors)
+        index.add_many(list(range(1000)), self.vectors[:1000])
+        index.merge_pending()
+        index.add_many(list(range(1000, 2000)), self.vectors[1000:])
+        pending_results = index.search_many(queries, k=5)
+        index.merge_pending()
+        self.assertEqual(pending_results, index.search_many(queries, k=5))
+        self.assertEqual(self.index.search_many(queries, k=5), pending_results)
+
+    def test_save_and_load(self):
+        queries = clustered_vectors(20, 16, clusters=20, seed=1)
+        expected = self.index.search_many(queries, k=5)
+        self.index.save(self.temp_dir)
+
+        loaded = IVFIndex.load(self.temp_dir)
+        self.assertIsInstance(loaded._list_vectors, np.memmap)
+        self.assertEqual(2000, len(loaded))
+        self.assertEqual(4, loaded.nprobe)
+        self.assertEqual(expected, loaded.search_many(queries, k=5))
+
+        loaded.add("new", -self.vectors[0])
+        self.assertEqual("new", loaded.search(-self.vectors[0], k=1)[0][1])
+
+    def test_fewer_candidates_than_k(self):
+        index = IVFIndex(dimensions=16, n_lists=4, nprobe=1)
+        index.train(self.vectors)
+        index.add("only", self.vectors[0])
+        self.assertEqual(["only"], [key for _, key in index.search(self.vectors[0], k=10, nprobe=4)])
+
+    def test_requires_training(self):
+        index = IVFIndex(dimensions=16, n_lists=4)
+        with self.assertRaises(RuntimeError):
+            index.add("apple", self.vectors[0])
+        with self.assertRaises(RuntimeError):
+            self.index.train(self.vectors)
+
+
+if __name__ == "__main__":
+    unittest.main()
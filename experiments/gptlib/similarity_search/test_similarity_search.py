@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Exact nearest-neighbour search over embeddings, held as rows of one NumPy matrix.
+"""
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from experiments.gptlib.open_ai_embeddings.embedding_store import EmbeddingStore, make_key
+from experiments.gptlib.similarity_search.similarity_search import SimilarityIndex, top_k_indices
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    """
+    A class that tests the SimilarityIndex.
+    """
+
+    def setUp(self):
+        self.index = SimilarityIndex(dimensions=2, initial_capacity=2)
+        self.index.add_many(["east", "north", "west", "north-east"], [[1, 0], [0, 1], [-1, 0], [3, 3]])
+
+    def test_top_k_indices(self):
+        scores = np.array([[0.1, 0.9, 0.5, 0.7], [4.0, 3.0, 2.0, 1.0]])
+        np.testing.assert_array_equal(np.array([[1, 3], [0, 1]]), top_k_indices(scores, 2))
+        np.testing.assert_array_equal(np.array([[1, 3, 2, 0], [0, 1, 2, 3]]), top_k_indices(scores, 10))
+
+    def test_cosine_search(self):
+        results = self.index.search([1, 0.1], k=2)
+        self.assertEqual(["east", "north-east"], [key for _, key in results])
+        self.assertAlmostEqual(1 / np.linalg.norm([1, 0.1]), results[0][0], places=5)
+
+    def test_dot_search(self):
+        index = SimilarityIndex(dimensions=2, metric="dot")
+        index.add_many(["east", "north", "west", "north-east"], [[1, 0], [0, 1], [-1, 0], [3, 3]])
+        self.assertEqual([(3.0, "north-east"), (1.0, "east")], index.search([1, 0], k=2))
+
+    def test_search_many(self):
+        results = self.index.search_many(np.array([[0, 2], [-5, 0]]), k=1)
+        self.assertEqual([[(1.0, "north")], [(1.0, "west")]], results)
+
+    def test_search_many_in_chunks(self):
+        queries = np.random.default_rng(0).standard_normal((50, 2))
+        expected = self.index.search_many(queries, k=3)
+        with patch("experiments.gptlib.similarity_search.similarity_search.MAX_SCORES_PER_CHUNK", 8):
+            self.assertEqual(expected, self.index.search_many(queries, k=3))
+
+    def test_k_larger_than_index(self):
+        self.assertEqual(4, len(self.index.search([1, 0], k=10)))
+        self.assertEqual([], SimilarityIndex(dimensions=2).search([1, 0]))
+
+    def test_grows(self):
+        self.assertEqual(4, len(self.index))
+        self.index.add("south", [0, -1])
+        self.assertEqual(5, len(self.index))
+        self.assertEqual("south", self.index.search([0, -1], k=1)[0][1])
+
+    def test_invalid_vectors(self):
+        with self.assertRaises(ValueError):
+            self.index.add("up", [0, 0, 1])
+        with self.assertRaises(ValueError):
+            self.index.search([0, 0, 1])
+        with self.assertRaises(ValueError):
+            SimilarityIndex(dimensions=2, metric="euclidean")
+
+    def test_from_store(self):
+        store_dir = tempfile.mkdtemp()
+        try:
+            store = EmbeddingStore(store_dir)
+            store.put_many(["east", "north"], [[1, 0], [0, 1]])
+            index = SimilarityIndex.from_store(store)
+        finally:
+            shutil.rmtree(store_dir)
+        self.assertEqual([(1.0, make_key("north"))], index.search([0, 1], k=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Benchmarks the ways of feeding scored candidates to a TopNList: the original per-item loop, the per-item loop
+that rejects low scores before touching the heap, and the NumPy bulk path, on random float scores.
+With --workers, it also times parallel_top_n, which pays for pickling the items to the worker processes.
+
+Usage:
+    python -m experiments.gptlib.top_n_list.bench_top_n_list --count 1000000 --sizes 10 100 1000
+"""
+import argparse
+import heapq
+import time
+
+import numpy as np
+
+from experiments.gptlib.top_n_list.top_n_list import TopNList, parallel_top_n
+
+
+def original_add_items(key, max_length: int, items) -> list:
+    """
+    The TopNList.addItems loop as it was before the early rejection, kept as the baseline.
+    :param key: the key function.
+    :param max_length: the number of items to keep.
+    :param items: the items to add.
+    :return: the heap.
+    """
+    heap = []
+    for item in items:
+        item_key = key(item)
+        if len(heap) < max_length:
+            heapq.heappush(heap, (item_key, item))
+        else:
+            heapq.heappushpop(heap, (item_key, item))
+    return heap
+
+
+def main():
+    """
+    The main function for the TopNList benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the TopNList insert paths.")
+    parser.add_argument("--count", type=int, default=1_000_000, help="The number of scored candidates.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="The values of max_length to try.")
+    parser.add_argument("--workers", type=int, default=0, help="The number of processes for parallel_top_n, 0 skips it.")
+    args = parser.parse_args()
+
+    scores = np.random.default_rng(0).random(args.count)
+    score_list = scores.tolist()
+    items = list(range(args.count))
+    key = score_list.__getitem__
+    print(f"{args.count} candidates:")
+    print(f"{'max_length':>10} {'original':>10} {'addItems':>10} {'addScores':>10} {'parallel':>10}")
+    for max_length in args.sizes:
+        start = time.perf_counter()
+        original_add_items(key, max_length, items)
+        original_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        TopNList(key, max_length).addItems(items)
+        add_items_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        TopNList(key, max_length).addScores(scores)
+        add_scores_seconds = time.perf_counter() - start
+        parallel_column = "-"
+        if args.workers:
+            start = time.perf_counter()
+            # The scores are their own keys, and float is a picklable key function
+            parallel_top_n(score_list, float, max_length, workers=args.workers)
+            parallel_column = f"{time.perf_counter() - start:.3f}s"
+        print(f"{max_length:>10} {original_seconds:>9.3f}s {add_items_seconds:>9.3f}s {add_scores_seconds:>9.3f}s {parallel_column:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,13 @@
 extracts the concept of a top_n item list from the code below. I want it to be based on a given lambda function named "key", and a max_length integer n. The class should be called "TopNList" and should have an "addItem" function that takes in a new item to possibly add to the list, if the item happens to be in the top "n" based on the "key" function. The code I have currently works, but I want to make it generic. I also want an "addItems" and "asSortedList" function. Here is my current code:
 
 """
+import pickle
+import random
 import unittest
 
-from experiments.gptlib.top_n_list.top_n_list import TopNList
+import numpy as np
+
+from experiments.gptlib.top_n_list.top_n_list import TopNList, parallel_top_n
 
 
 class TestTopNList(unittest.TestCase):
@@ -65,6 +69,98 @@ class TestTopNList(unittest.TestCase):
         result = top_n_list.asSortedList()
         self.assertEqual(result, [])
 
+    def test_addScores_matches_addItems(self):
+        rng = random.Random(0)
+        for _ in range(20):
+            # Few distinct scores, so there are many ties around the cutoff
+            items = [rng.randint(0, 1000) for _ in range(500)]
+            key = lambda x: x % 17
+            expected_list = TopNList(key, 10)
+            expected_list.addItems(items[:200])
+            expected_list.addItems(items[200:])
+
+            top_n_list = TopNList(key, 10)
+            top_n_list.addScores(np.array([key(item) for item in items[:200]]), items[:200])
+            top_n_list.addScores(np.array([key(item) for item in items[200:]]), items[200:])
+            # Ties may be listed in another order, but the same items are kept
+            self.assertEqual(sorted(expected_list.asSortedList()), sorted(top_n_list.asSortedList()))
+
+    def test_nan_scores_are_never_kept(self):
+        scores = [1.0, float("nan"), 3.0, 2.0, 5.0]
+        expected = [(5.0, 4), (3.0, 2), (2.0, 3)]
+        one_at_a_time = TopNList(lambda x: scores[x], 3)
+        for position in range(len(scores)):
+            one_at_a_time.addItem(position)
+        self.assertEqual(expected, one_at_a_time.asSortedList())
+        all_at_once = TopNList(lambda x: scores[x], 3)
+        all_at_once.addItems(range(len(scores)))
+        self.assertEqual(expected, all_at_once.asSortedList())
+        vectorized = TopNList(lambda x: scores[x], 3)
+        vectorized.addScores(np.array(scores))
+        self.assertEqual(expected, vectorized.asSortedList())
+
+    def test_addScores_defaults_to_positions(self):
+        top_n_list = TopNList(lambda x: x, 2)
+        top_n_list.addScores(np.array([0.5, 0.9, 0.1, 0.7]))
+        self.assertEqual([(0.9, 1), (0.7, 3)], top_n_list.asSortedList())
+
+    def test_addScores_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            TopNList(lambda x: x, 2).addScores(np.array([1, 2]), ["a"])
+
+    def test_addItemsVectorized(self):
+        top_n_list = TopNList(len, 2)
+        words = np.array(["a", "abcd", "ab", "abc"])
+        top_n_list.addItemsVectorized(words, np.char.str_len)
+        self.assertEqual([(4, "abcd"), (3, "abc")], top_n_list.asSortedList())
+
+    def test_low_scores_do_not_touch_the_heap(self):
+        top_n_list = TopNList(lambda x: x, 2)
+        top_n_list.addItems([5, 6])
+        heap_before = list(top_n_list._heap)
+        top_n_list.addItems([1, 2, 3])
+        top_n_list.addScores(np.array([1, 2, 3]))
+        self.assertEqual(heap_before, top_n_list._heap)
+
+    def test_ties_do_not_compare_items(self):
+        top_n_list = TopNList(lambda item: item["score"], 2)
+        top_n_list.addItems([{"score": 1, "name": "a"}, {"score": 1, "name": "b"}, {"score": 1, "name": "c"}])
+        # The most recently added items win the ties
+        self.assertEqual([(1, {"score": 1, "name": "c"}), (1, {"score": 1, "name": "b"})], top_n_list.asSortedList())
+
+    def test_merge_matches_adding_in_order(self):
+        items = [random.Random(1).randint(-20, 20) for _ in range(300)]
+        expected = TopNList(abs, 7)
+        expected.addItems(items)
+
+        first = TopNList(abs, 7)
+        first.addItems(items[:100])
+        second = TopNList(abs, 7)
+        second.addItems(items[100:])
+        first_before = first.asSortedList()
+        combined = first | second
+        self.assertEqual(expected.asSortedList(), combined.asSortedList())
+        # The operands are left unchanged
+        self.assertEqual(first_before, first.asSortedList())
+
+        self.assertEqual(expected.asSortedList(), first.merge(second).asSortedList())
+
+    def test_pickle_without_key(self):
+        top_n_list = TopNList(lambda x: -x, 3)
+        top_n_list.addItems([5, 1, 4, 2])
+        unpickled = pickle.loads(pickle.dumps(top_n_list))
+        self.assertIsNone(unpickled.key)
+        self.assertEqual([(-1, 1), (-2, 2), (-4, 4)], unpickled.asSortedList())
+        self.assertIsNotNone(top_n_list.key)
+
+    def test_parallel_top_n(self):
+        items = list(range(-500, 500))
+        expected = TopNList(abs, 9)
+        expected.addItems(items)
+        result = parallel_top_n(items, abs, 9, workers=2, chunk_size=37)
+        self.assertEqual(expected.asSortedList(), result.asSortedList())
+        self.assertIs(abs, result.key)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,15 +3,24 @@
 extracts the concept of a top_n item list from the code below. I want it to be based on a given lambda function named "key", and a max_length integer n. The class should be called "TopNList" and should have an "addItem" function that takes in a new item to possibly add to the list, if the item happens to be in the top "n" based on the "key" function. The code I have currently works, but I want to make it generic. I also want an "addItems" and "asSortedList" function. Here is my current code:
 """
 import heapq
-from typing import Callable, Iterable, List, Tuple
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
 from typing import TypeVar, Generic
 
+import numpy as np
+
 T = TypeVar("T")
 
 
 class TopNList(Generic[T]):
     """
     A class that maintains a list of the top N items based on a given key function.
+    The heap holds (key, counter, item) entries, where the counter numbers the items in the order they were added,
+    so items with the same key are never compared to each other: the most recently added one ranks higher.
+    An item whose key is NaN cannot be ranked, so it is never kept.
     """
 
     def __init__(self, key: Callable[[T], float], max_length: int):
@@ -23,33 +32,193 @@ class TopNList(Generic[T]):
         self.key = key
         self.max_length = max_length
         self._heap = []
+        self._counter = 0
 
     def addItem(self, item: T) -> None:
         """
         Add an item to the top N list if it is in the top N based on the key function.
+        Items that score below the current minimum of a full list are rejected without touching the heap.
         :param item: The item to potentially add to the top list.
         """
-        item_key = self.key(item)
-        if len(self._heap) < self.max_length:
-            heapq.heappush(self._heap, (item_key, item))
+        self._push(self.key(item), item)
+
+    def _push(self, item_key: float, item: T) -> None:
+        """
+        Push an already scored item onto the heap, if it can be in the top N.
+        :param item_key: The score of the item.
+        :param item: The item.
+        """
+        heap = self._heap
+        if item_key != item_key:
+            # NaN
+            return
+        if len(heap) < self.max_length:
+            heapq.heappush(heap, (item_key, self._counter, item))
+        elif self.max_length > 0 and item_key >= heap[0][0]:
+            heapq.heappushpop(heap, (item_key, self._counter, item))
         else:
-            heapq.heappushpop(self._heap, (item_key, item))
+            return
+        self._counter += 1
 
     def addItems(self, items: Iterable[T]) -> None:
         """
         Add multiple items to the top N list.
         :param items: An iterable of items to potentially add to the top list.
         """
-        for item in items:
-            self.addItem(item)
+        key = self.key
+        heap = self._heap
+        max_length = self.max_length
+        if max_length <= 0:
+            return
+        iterator = iter(items)
+        counter = self._counter
+        try:
+            if len(heap) < max_length:
+                for item in iterator:
+                    item_key = key(item)
+                    if item_key != item_key:
+                        # NaN
+                        continue
+                    heapq.heappush(heap, (item_key, counter, item))
+                    counter += 1
+                    if len(heap) >= max_length:
+                        break
+                else:
+                    return
+            # The list is full: only items reaching the minimum touch the heap, and the minimum only changes when they do.
+            # A NaN key never reaches it.
+            minimum = heap[0][0]
+            for item in iterator:
+                item_key = key(item)
+                if item_key >= minimum:
+                    heapq.heappushpop(heap, (item_key, counter, item))
+                    counter += 1
+                    minimum = heap[0][0]
+        finally:
+            self._counter = counter
+
+    def addScores(self, scores: np.ndarray, items: Optional[Sequence[T]] = None) -> None:
+        """
+        Add a batch of items that are already scored, such as the output of a vectorized key function.
+        The candidates are narrowed down with NumPy before any of them touches the heap: only the scores that
+        reach the current minimum, and among those only the best max_length and their ties, are pushed.
+        The same items are kept as when adding the items one at a time, and NaN scores are left out the same way.
+        :param scores: A 1D array of the scores of the items.
+        :param items: The items, in the same order as the scores. By default, the items are the positions of the scores.
+        """
+        scores = np.asarray(scores)
+        if self.max_length <= 0 or len(scores) == 0:
+            return
+        if items is not None and len(items) != len(scores):
+            raise ValueError(f"Got {len(scores)} scores for {len(items)} items")
+        if len(self._heap) >= self.max_length:
+            # A NaN score never reaches the minimum
+            candidates = np.flatnonzero(scores >= self._heap[0][0])
+        elif np.issubdtype(scores.dtype, np.floating):
+            # Left out before the partition, which would sort them above every score
+            candidates = np.flatnonzero(~np.isnan(scores))
+        else:
+            candidates = np.arange(len(scores))
+        if len(candidates) > self.max_length:
+            candidate_scores = scores[candidates]
+            kth = len(candidates) - self.max_length
+            cutoff = np.partition(candidate_scores, kth)[kth]
+            # Keep every tie of the cutoff, and let the counter break the ties like it does for one at a time adds
+            candidates = candidates[candidate_scores >= cutoff]
+        push = self._push
+        for position, item_key in zip(candidates.tolist(), scores[candidates].tolist()):
+            push(item_key, position if items is None else items[position])
+
+    def addItemsVectorized(self, items: Sequence[T], vectorized_key: Callable[[Sequence[T]], np.ndarray]) -> None:
+        """
+        Add a batch of items, scored all at once by a vectorized key function, instead of one key call per item.
+        :param items: The items to potentially add to the top list.
+        :param vectorized_key: A function that takes the batch of items, and returns the array of their scores.
+        """
+        self.addScores(vectorized_key(items), items)
 
     def asSortedList(self) -> List[Tuple[float, T]]:
         """
         Return the top N list as a sorted list.
         :return: The sorted list representation of the top N items.
         """
-        sorted_list = sorted(self._heap, key=lambda x: -x[0])
-        return [(key, item) for key, item in sorted_list]
+        sorted_list = sorted(self._heap, key=lambda x: (x[0], x[1]), reverse=True)
+        return [(key, item) for key, _, item in sorted_list]
+
+    def merge(self, other: "TopNList[T]") -> "TopNList[T]":
+        """
+        Add the items of another TopNList to this one, as if they were added after the items of this one.
+        The other list is left unchanged, and its key function is not needed.
+        :param other: The TopNList to merge into this one.
+        :return: This TopNList.
+        """
+        for item_key, _, item in sorted(other._heap, key=lambda x: x[1]):
+            self._push(item_key, item)
+        return self
+
+    def __or__(self, other: "TopNList[T]") -> "TopNList[T]":
+        """
+        Combine two TopNLists into a new one, keeping the max_length of this one.
+        :param other: The TopNList whose items rank as added after the items of this one.
+        :return: The new TopNList.
+        """
+        combined = TopNList(self.key, self.max_length)
+        combined._heap = list(self._heap)
+        combined._counter = self._counter
+        return combined.merge(other)
+
+    def __getstate__(self) -> dict:
+        """
+        Get the state to pickle, without the key function, which is often a lambda that cannot be pickled.
+        An unpickled TopNList can be merged and listed, but its key must be set again before adding items.
+        :return: The picklable state.
+        """
+        state = self.__dict__.copy()
+        state["key"] = None
+        return state
+
+
+def _top_n_of_chunk(key: Callable[[T], float], n: int, chunk: List[T]) -> TopNList[T]:
+    """
+    Find the top N items of one chunk, in a worker process.
+    :param key: The key function.
+    :param n: The number of items to keep.
+    :param chunk: The items of the chunk.
+    :return: The TopNList of the chunk, pickled back to the parent without its key.
+    """
+    top_n_list = TopNList(key, n)
+    top_n_list.addItems(chunk)
+    return top_n_list
+
+
+def parallel_top_n(
+    iterable: Iterable[T], key: Callable[[T], float], n: int, workers: Optional[int] = None, chunk_size: int = 100_000
+) -> TopNList[T]:
+    """
+    Find the top N items of a large iterable with a pool of processes. The iterable is split into chunks,
+    each worker keeps a TopNList of its chunks, and the partial lists are merged in input order, so the result
+    is the same as adding every item to one TopNList, ties included.
+    The key function and the items are sent to the workers, so they must be picklable: use a module level
+    function rather than a lambda.
+    :param iterable: The items to rank. It is read lazily, a few chunks ahead of the workers.
+    :param key: The key function.
+    :param n: The number of items to keep.
+    :param workers: The number of worker processes, the number of CPUs by default.
+    :param chunk_size: The number of items sent to a worker at once.
+    :return: The TopNList of the top N items.
+    """
+    workers = workers or os.cpu_count() or 1
+    result = TopNList(key, n)
+    iterator = iter(iterable)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in iter(lambda: list(itertools.islice(iterator, chunk_size)), []):
+            pending.append(executor.submit(_top_n_of_chunk, key, n, chunk))
+            if len(pending) >= 2 * workers:
+                result.merge(pending.popleft().result())
+        while pending:
+            result.merge(pending.popleft().result())
+    return result
 
 
 def main():
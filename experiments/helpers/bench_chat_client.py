@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Load tests the ChatClient against a local FakeOpenAIServer, so it costs nothing: it streams a number of chat
+completions, like concurrent script writer jobs, at several concurrency limits, and compares them with sending
+them one after the other with the blocking backoff_completion. Use --rate-limit-every to have the server answer
+some requests with 429s, and see how the retries affect throughput.
+
+Usage:
+    python -m experiments.helpers.bench_chat_client --jobs 200 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import openai
+
+from experiments.helpers.chat_client import ChatClient
+from experiments.helpers.fake_openai_server import FakeOpenAIServer
+from experiments.helpers.openai_api_helpers import backoff_completion
+
+PROMPT = "Write a Python function that returns the nth fibonacci number, with memoization and type hints."
+
+
+def job_messages(index: int) -> list:
+    """
+    Build the messages of a job.
+    :param index: the number of the job.
+    :return: the messages.
+    """
+    return [{"role": "user", "content": f"{PROMPT} Job {index}."}]
+
+
+async def bench_client(jobs: int, max_concurrency: int) -> dict:
+    """
+    Stream the completions of every job with a ChatClient.
+    :param jobs: the number of jobs.
+    :param max_concurrency: the number of requests in flight at once.
+    :return: the elapsed seconds, the jobs per second, the retries, and the mean seconds to the first chunk.
+    """
+    first_chunk_seconds = []
+
+    async with ChatClient(max_concurrency=max_concurrency, requests_per_minute=1e6, tokens_per_minute=1e9) as client:
+
+        async def run_job(index: int) -> None:
+            start = time.perf_counter()
+            chunks = client.astream(job_messages(index))
+            await chunks.__anext__()
+            first_chunk_seconds.append(time.perf_counter() - start)
+            async for _ in chunks:
+                pass
+
+        start = time.perf_counter()
+        await asyncio.gather(*[run_job(index) for index in range(jobs)])
+        elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "jobs_per_second": jobs / elapsed,
+        "retries": client.stats.retries,
+        "first_chunk_seconds": sum(first_chunk_seconds) / len(first_chunk_seconds),
+    }
+
+
+def bench_blocking(jobs: int) -> dict:
+    """
+    Stream the completions of every job with backoff_completion, one after the other.
+    :param jobs: the number of jobs.
+    :return: the elapsed seconds and the jobs per second.
+    """
+    start = time.perf_counter()
+    for index in range(jobs):
+        for _ in backoff_completion(messages=job_messages(index)):
+            pass
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "jobs_per_second": jobs / elapsed}
+
+
+async def run(args: argparse.Namespace) -> None:
+    """
+    Run every mode against the same fake server, and print a table of the results.
+    :param args: the parsed command line arguments.
+    """
+    server = FakeOpenAIServer(
+        request_latency=args.latency,
+        first_chunk_latency=args.first_chunk_latency,
+        chunk_latency=args.chunk_latency,
+        rate_limit_every=args.rate_limit_every,
+    )
+    async with server:
+        openai.api_base = server.url
+        print(f"{'mode':>16} {'seconds':>10} {'jobs/s':>10} {'retries':>10} {'first chunk':>12} {'max in flight':>14}")
+        for max_concurrency in args.concurrency:
+            server.max_chat_in_flight = 0
+            result = await bench_client(args.jobs, max_concurrency)
+            print(
+                f"{f'client x{max_concurrency}':>16} {result['seconds']:>10.2f} {result['jobs_per_second']:>10.1f} "
+                f"{result['retries']:>10} {result['first_chunk_seconds'] * 1000:>10.0f}ms {server.max_chat_in_flight:>14}"
+            )
+        if args.blocking_jobs:
+            # The blocking client needs the event loop of the server to keep running, so it runs in a thread
+            result = await asyncio.get_running_loop().run_in_executor(None, bench_blocking, args.blocking_jobs)
+            print(f"{'blocking':>16} {result['seconds']:>10.2f} {result['jobs_per_second']:>10.1f}")
+
+
+def main():
+    """
+    The main function for the chat client load test.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Load test the ChatClient against a fake server.")
+    parser.add_argument("--jobs", type=int, default=200, help="The number of chat completions to stream.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="The concurrency limits to try.")
+    parser.add_argument("--blocking-jobs", type=int, default=20, help="The number of jobs for the blocking client, 0 skips it.")
+    parser.add_argument("--latency", type=float, default=0.05, help="The simulated seconds before a response starts.")
+    parser.add_argument("--first-chunk-latency", type=float, default=0.2, help="The simulated seconds before the first chunk.")
+    parser.add_argument("--chunk-latency", type=float, default=0.01, help="The simulated seconds between chunks.")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Have the server answer every Nth request with a 429.")
+    args = parser.parse_args()
+    openai.api_key = "sk-fake"
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Benchmarks the retrieval of the ChatMemory on a long chat: the time ContextWindow.pack takes per turn, with the
+embeddings of the new messages added to the index and the most similar older messages searched for, against the
+word overlap ranking it replaces. The embeddings are random 1536 dimension vectors, made ahead of time, so the
+timings leave out the embedding request, which the prompt needs anyway.
+
+Usage:
+    python -m experiments.helpers.bench_chat_memory --messages 10000 --turns 100
+"""
+import argparse
+import statistics
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from experiments.helpers.chat_memory import ChatMemory
+from experiments.helpers.context_window import ContextWindow, WordOverlapRetriever
+
+WORDS = ["fibonacci", "weather", "python", "music", "memoization", "recursion", "jazz", "rain", "numpy", "tempo"]
+
+
+class WordCounter:
+    """
+    Counts a token per word, and 3 tokens around each message, so the timings leave out the tokenizer.
+    """
+
+    def count_message_list(self, messages, model):
+        return [len(message["content"].split()) + 3 for message in messages]
+
+
+def make_texts(count: int, rng: np.random.Generator) -> List[str]:
+    """
+    Make up the texts of messages, each of 20 random words and a unique number.
+    :param count: the number of texts.
+    :param rng: the random generator.
+    :return: the texts.
+    """
+    return [" ".join(rng.choice(WORDS, 20).tolist()) + f" {index}" for index in range(count)]
+
+
+def make_embedder(texts: List[str], dimensions: int, rng: np.random.Generator):
+    """
+    Make an embed function that looks up random vectors made ahead of time.
+    :param texts: the texts it can embed.
+    :param dimensions: the number of dimensions of the vectors.
+    :param rng: the random generator.
+    :return: the embed function.
+    """
+    vectors = rng.standard_normal((len(texts), dimensions)).astype(np.float32)
+    rows: Dict[str, int] = {text: row for row, text in enumerate(texts)}
+    return lambda batch: vectors[[rows[text] for text in batch]]
+
+
+def bench(window: ContextWindow, history: List[str], prompts: List[str], replies: List[str]) -> List[float]:
+    """
+    Replay a chat: load its history, then time pack for each turn, adding the prompt and the reply after it.
+    :param window: the ContextWindow.
+    :param history: the texts of the messages already in the chat.
+    :param prompts: the prompt of each timed turn.
+    :param replies: the reply of each timed turn.
+    :return: the seconds pack took on each turn.
+    """
+    window.extend([{"role": "user", "content": text} for text in history])
+    timings = []
+    for prompt, reply in zip(prompts, replies):
+        start = time.perf_counter()
+        window.pack(prompt)
+        timings.append(time.perf_counter() - start)
+        window.extend([{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}])
+    return timings
+
+
+def main():
+    """
+    The main function for the chat memory benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the retrieval of the ChatMemory.")
+    parser.add_argument("--messages", type=int, default=10_000, help="The number of messages already in the chat.")
+    parser.add_argument("--turns", type=int, default=100, help="The number of turns to time.")
+    parser.add_argument("--dimensions", type=int, default=1536, help="The number of dimensions of the embeddings.")
+    parser.add_argument("--budget", type=int, default=7192, help="The token budget of each prompt.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    texts = make_texts(args.messages + 2 * args.turns + 1, rng)
+    history = texts[: args.messages]
+    prompts = texts[args.messages :: 2][: args.turns]
+    replies = texts[args.messages + 1 :: 2][: args.turns]
+    embed = make_embedder(texts, args.dimensions, rng)
+
+    print(f"{args.turns} turns of a chat of {args.messages} messages, in ms per turn")
+    print(f"{'retriever':>14} {'median':>10} {'p95':>10} {'first':>10}")
+    for name, retriever in [("embeddings", ChatMemory(embed=embed)), ("word overlap", WordOverlapRetriever())]:
+        window = ContextWindow(budget=args.budget, token_counter=WordCounter(), retriever=retriever)
+        timings = bench(window, history, prompts, replies)
+        # The first turn of the ChatMemory indexes the whole history, like resuming a saved chat
+        steady = sorted(timings[1:])
+        print(
+            f"{name:>14} {statistics.median(steady) * 1000:>10.2f} {steady[int(len(steady) * 0.95)] * 1000:>10.2f} "
+            f"{timings[0] * 1000:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Benchmarks saving and resuming a long chat: rewriting the whole chat as messages.json on every turn, as eternal_chat
+did, against appending the turn to a ChatTranscript. Each turn saves a prompt and a reply, and resuming loads the chat
+and reads the last messages, the way eternal_chat prints them and packs the next prompt.
+
+Usage:
+    python -m experiments.helpers.bench_chat_transcript --turns 5000
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import List, Tuple
+
+from experiments.helpers.chat_transcript import ChatTranscript
+
+# The number of last messages read when the chat is resumed
+TAIL_COUNT = 10
+
+
+def make_turn(index: int, words: int) -> List[dict]:
+    """
+    Make up a turn of the chat.
+    :param index: the index of the turn.
+    :param words: the number of words of each message.
+    :return: the prompt and the reply.
+    """
+    content = " ".join(f"word{(index + position) % 1000}" for position in range(words))
+    return [{"role": "user", "content": f"prompt {index} {content}"}, {"role": "assistant", "content": content}]
+
+
+def bench_rewrite(path: str, turns: int, words: int) -> Tuple[List[float], int]:
+    """
+    Save each turn by rewriting the whole chat as one JSON file.
+    :param path: the path of the JSON file.
+    :param turns: the number of turns.
+    :param words: the number of words of each message.
+    :return: the seconds each save took, and the bytes written in all.
+    """
+    messages = []
+    timings = []
+    written = 0
+    for index in range(turns):
+        messages += make_turn(index, words)
+        start = time.perf_counter()
+        with open(path, "w") as f:
+            json.dump(messages, f, indent=2)
+        timings.append(time.perf_counter() - start)
+        written += os.path.getsize(path)
+    return timings, written
+
+
+def bench_append(path: str, turns: int, words: int, fsync: bool) -> Tuple[List[float], int]:
+    """
+    Save each turn by appending it to a ChatTranscript.
+    :param path: the path of the transcript.
+    :param turns: the number of turns.
+    :param words: the number of words of each message.
+    :param fsync: whether the transcript fsyncs after every append.
+    :return: the seconds each save took, and the bytes written in all.
+    """
+    timings = []
+    with ChatTranscript(path, fsync=fsync) as transcript:
+        for index in range(turns):
+            turn = make_turn(index, words)
+            start = time.perf_counter()
+            transcript.extend(turn)
+            timings.append(time.perf_counter() - start)
+    return timings, os.path.getsize(path)
+
+
+def time_resume(load) -> float:
+    """
+    Time the best of a few resumes.
+    :param load: the function that loads the chat and returns its last messages.
+    :return: the seconds the fastest resume took.
+    """
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        load()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def resume_json(path: str) -> List[dict]:
+    with open(path) as f:
+        return json.load(f)[-TAIL_COUNT:]
+
+
+def resume_transcript(path: str) -> List[dict]:
+    with ChatTranscript(path) as transcript:
+        return transcript[-TAIL_COUNT:]
+
+
+def main():
+    """
+    The main function for the chat transcript benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark saving and resuming a chat.")
+    parser.add_argument("--turns", type=int, default=5000, help="The number of turns of the chat.")
+    parser.add_argument("--words", type=int, default=100, help="The number of words of each message.")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(temp_dir, "messages.json")
+        print(f"{args.turns} turns of {args.words} words per message")
+        print(f"{'save':>14} {'median ms':>10} {'last ms':>10} {'total s':>10} {'MB written':>12}")
+        results = [("rewrite", bench_rewrite(json_path, args.turns, args.words))]
+        for fsync in [False, True]:
+            jsonl_path = os.path.join(temp_dir, f"messages_{fsync}.jsonl")
+            name = "append+fsync" if fsync else "append"
+            results.append((name, bench_append(jsonl_path, args.turns, args.words, fsync)))
+        for name, (timings, written) in results:
+            print(
+                f"{name:>14} {statistics.median(timings) * 1000:>10.3f} {timings[-1] * 1000:>10.3f} "
+                f"{sum(timings):>10.2f} {written / 1e6:>12.1f}"
+            )
+
+        jsonl_path = os.path.join(temp_dir, "messages_False.jsonl")
+        print(f"\nresume, in ms: load the chat and read the last {TAIL_COUNT} messages")
+        print(f"{'messages.json':>14} {time_resume(lambda: resume_json(json_path)) * 1000:>10.2f}")
+        print(f"{'transcript':>14} {time_resume(lambda: resume_transcript(jsonl_path)) * 1000:>10.2f}")
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Benchmarks merge_completion_stream by replaying a recorded completion stream through it, and through the previous
+implementation, which grew the merged content with += and printed every token on its own. The printed text goes
+to a sink that counts the writes, so the terminal does not skew the timings.
+
+The stream is a list of chunks in a JSON file, like the ones the API streams. Without --recording, an 8k-token
+answer is made up, with one word per chunk.
+
+Usage:
+    python -m experiments.helpers.bench_merge_completion_stream --tokens 8000 --runs 5
+    python -m experiments.helpers.bench_merge_completion_stream --recording stream.json
+"""
+import argparse
+import io
+import json
+import statistics
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Callable, List
+
+from experiments.helpers.openai_api_helpers import StreamPrinter, merge_completion_stream
+from experiments.helpers.terminal_color_helper import BG_DEFAULT_COLOR, FG_DEFAULT_COLOR, fg
+
+WORDS = ["def", " fibonacci", "(", "n", ":", " int", ")", " ->", " int", ":\n", "    return", " n", "\n"]
+
+
+class CountingSink(io.TextIOBase):
+    """
+    A text stream that throws away what is written to it, but counts the writes and the characters.
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.chars = 0
+
+    def write(self, text: str) -> int:
+        self.writes += 1
+        self.chars += len(text)
+        return len(text)
+
+
+def merge_completion_stream_per_token(completion):
+    """
+    The previous merge_completion_stream, kept to compare against.
+    :param completion: an iterable stream of completion chunks.
+    :return: a tuple of the merged chunks and the text.
+    """
+    full_completion = []
+    full_text_chunks = []
+    for chunk in completion:
+        delta = chunk["choices"][0]["delta"]
+        if "content" in delta:
+            text_content = delta["content"]
+            full_text_chunks.append(text_content)
+            msg = fg(0, 1, 1) + text_content + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR
+            print(msg, end="")
+            if len(full_completion) > 0:
+                last_chunk = full_completion[-1]
+                last_delta = last_chunk["choices"][0]["delta"]
+                if "content" in last_delta:
+                    last_delta["content"] += text_content
+                    chunk = None
+        if chunk is not None:
+            full_completion.append(chunk)
+    full_text = "".join(full_text_chunks)
+
+    return full_completion, full_text
+
+
+def make_stream(tokens: int) -> List[dict]:
+    """
+    Make up a completion stream, with a role chunk, one chunk per token, and a finish chunk.
+    :param tokens: the number of content chunks.
+    :return: the chunks.
+    """
+
+    def make_chunk(delta: dict, finish_reason=None) -> dict:
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1690000000,
+            "model": "gpt-4-0613",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    chunks = [make_chunk({"role": "assistant"})]
+    chunks += [make_chunk({"content": WORDS[index % len(WORDS)]}) for index in range(tokens)]
+    chunks.append(make_chunk({}, "stop"))
+    return chunks
+
+
+def bench(stream: List[dict], merge: Callable, runs: int) -> dict:
+    """
+    Replay the stream through a merge function.
+    :param stream: the chunks of the stream.
+    :param merge: the merge function, which takes the chunks and a sink to print to.
+    :param runs: the number of runs, the median time is kept.
+    :return: the median seconds, the writes to the sink, and the peak memory allocated while merging.
+    """
+    timings = []
+    for _ in range(runs):
+        # The previous implementation modifies the chunks, so every run gets fresh ones
+        chunks = json.loads(json.dumps(stream))
+        sink = CountingSink()
+        start = time.perf_counter()
+        merge(chunks, sink)
+        timings.append(time.perf_counter() - start)
+    chunks = json.loads(json.dumps(stream))
+    tracemalloc.start()
+    merge(chunks, CountingSink())
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": statistics.median(timings), "writes": sink.writes, "peak_bytes": peak_bytes}
+
+
+def merge_per_token(chunks: List[dict], sink: CountingSink) -> None:
+    with redirect_stdout(sink):
+        merge_completion_stream_per_token(chunks)
+
+
+def merge_batched(chunks: List[dict], sink: CountingSink) -> None:
+    merge_completion_stream(chunks, printer=StreamPrinter(out=sink))
+
+
+def main():
+    """
+    The main function for the merge_completion_stream benchmark.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark merging a completion stream.")
+    parser.add_argument("--recording", help="A JSON file with the chunks of a recorded stream.")
+    parser.add_argument("--tokens", type=int, default=8000, help="The number of tokens of the made up stream.")
+    parser.add_argument("--runs", type=int, default=5, help="The number of runs per implementation.")
+    args = parser.parse_args()
+
+    if args.recording:
+        with open(args.recording) as f:
+            stream = json.load(f)
+    else:
+        stream = make_stream(args.tokens)
+    print(f"Replaying a stream of {len(stream)} chunks")
+    print(f"{'merge':>10} {'ms':>10} {'writes':>10} {'peak KiB':>10}")
+    for name, merge in [("per token", merge_per_token), ("batched", merge_batched)]:
+        result = bench(stream, merge, args.runs)
+        print(f"{name:>10} {result['seconds'] * 1000:>10.2f} {result['writes']:>10} {result['peak_bytes'] / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+An asyncio client for the chat completions API, to run many completions concurrently from one process.
+
+The ChatClient caps the number of requests in flight, paces them with a RateLimiter, and retries a request that
+fails before its first chunk with a jittered exponential backoff. A completion is streamed as an async iterator of
+chunks, and cancelling the task that reads it closes the request. The chunks are the same as the ones of the
+blocking openai.ChatCompletion.create, so merge_completion_stream works on them.
+
+```python
+async with ChatClient(max_concurrency=4) as client:
+    async for chunk in client.astream([{"role": "user", "content": "Hello"}]):
+        print(chunk["choices"][0]["delta"].get("content", ""), end="")
+```
+
+Code that is not async can use the blocking stream and complete methods, which run the client on an event loop of
+its own, in a background thread. A client is bound to the event loop that first uses it, so do not mix the two.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+from typing import AsyncIterator, Iterator, List, Optional
+
+import openai
+
+from experiments.constants import MODEL_NAME
+from experiments.helpers.openai_session import OpenAISession
+from experiments.helpers.rate_limiter import RateLimiter, ThroughputStats, backoff_delay, get_retry_after, is_retryable
+from experiments.helpers.token_helpers import TokenCounter, get_token_counter
+
+# The default rate limits of a pay-as-you-go account for gpt-4.
+DEFAULT_REQUESTS_PER_MINUTE = 200
+DEFAULT_TOKENS_PER_MINUTE = 40_000
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_ATTEMPTS = 6
+# The whole request, including reading the stream, is abandoned after this many seconds.
+DEFAULT_REQUEST_TIMEOUT = 600
+# A stream that goes this many seconds without a chunk, including the first one, is abandoned.
+DEFAULT_CHUNK_TIMEOUT = 60
+
+
+class ChatClient:
+    """
+    Sends chat completion requests concurrently, with a concurrency limit, rate limiting, retries and timeouts.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        chunk_timeout: float = DEFAULT_CHUNK_TIMEOUT,
+        session: Optional[OpenAISession] = None,
+        token_counter: Optional[TokenCounter] = None,
+    ):
+        """
+        Initialize the ChatClient.
+        :param max_concurrency: the number of requests in flight at once, the others wait for their turn.
+        :param requests_per_minute: the rate limit of the account, in requests per minute.
+        :param tokens_per_minute: the rate limit of the account, in prompt tokens per minute.
+        :param max_attempts: the number of times a request is sent before giving up.
+        :param request_timeout: the seconds after which a request, with its whole stream, is abandoned.
+        :param chunk_timeout: the seconds to wait for each chunk of a stream, including the first one.
+        :param session: the OpenAISession to send the requests with. By default the client owns one, with a
+            connection per concurrent request, that stays open until close is called.
+        :param token_counter: the TokenCounter of the prompts, for the rate limiter, the shared one of the model of
+            each request by default.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.request_timeout = request_timeout
+        self.chunk_timeout = chunk_timeout
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.session = session or OpenAISession(limit=max_concurrency, limit_per_host=max_concurrency)
+        self.token_counter = token_counter
+        self.stats = ThroughputStats()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+
+    async def close(self) -> None:
+        """
+        Close the session, and its pooled connections.
+        """
+        await self.session.close()
+
+    async def __aenter__(self) -> "ChatClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def _create(self, messages: List[dict], model: str, stream: bool, **kwargs):
+        """
+        Send the request, retrying it with a jittered exponential backoff while it fails with a retryable error.
+        :param messages: the messages of the conversation.
+        :param model: the name of the model.
+        :param stream: whether to stream the completion.
+        :param kwargs: the other parameters of the request, like the temperature.
+        :return: the response, an async iterator of chunks when streaming.
+        """
+        token_counter = self.token_counter if self.token_counter is not None else get_token_counter(model)
+        tokens = token_counter.count_messages(messages, model)
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.rate_limiter.acquire(tokens)
+            self.stats.requests += 1
+            try:
+                await self.session.open()
+                with self.session.activate():
+                    request = openai.ChatCompletion.acreate(
+                        model=model,
+                        messages=messages,
+                        stream=stream,
+                        request_timeout=self.request_timeout,
+                        **kwargs,
+                    )
+                    # A stream sends its headers as soon as the completion starts, a whole completion takes longer
+                    async with asyncio.timeout(self.chunk_timeout if stream else self.request_timeout):
+                        response = await request
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_attempts:
+                    raise
+                self.stats.retries += 1
+                if isinstance(e, openai.error.RateLimitError):
+                    self.stats.rate_limited += 1
+                    delay = self.rate_limiter.on_rate_limited(get_retry_after(e), attempt)
+                    logging.info(f"Rate limited, pausing requests for {delay:.2f}s: {e}")
+                else:
+                    delay = backoff_delay(attempt)
+                    logging.info(f"Chat completion failed, retrying in {delay:.2f}s: {e}")
+                    await asyncio.sleep(delay)
+                continue
+            self.rate_limiter.on_success()
+            self.stats.tokens += tokens
+            return response
+
+    async def _next_chunk(self, response: AsyncIterator[dict]) -> dict:
+        """
+        Wait for the next chunk of a stream, for at most chunk_timeout seconds. Unlike asyncio.wait_for, which drops
+        a cancellation that arrives as the chunk does, asyncio.timeout always lets the cancellation through.
+        :param response: the stream.
+        :return: the chunk.
+        """
+        async with asyncio.timeout(self.chunk_timeout):
+            return await response.__anext__()
+
+    async def astream(self, messages: List[dict], model: str = MODEL_NAME, **kwargs) -> AsyncIterator[dict]:
+        """
+        Stream a chat completion. The request is only retried until its first chunk arrives, a stream that fails
+        after that raises, since its chunks have already been handed out.
+        :param messages: the messages of the conversation.
+        :param model: the name of the model.
+        :param kwargs: the other parameters of the request, like the temperature.
+        :return: an async iterator over the chunks of the completion.
+        """
+        async with self._semaphore:
+            attempt = 0
+            while True:
+                attempt += 1
+                response = await self._create(messages, model, stream=True, **kwargs)
+                try:
+                    first_chunk = await self._next_chunk(response)
+                except StopAsyncIteration:
+                    return
+                except Exception as e:
+                    # Timing out waiting for the first chunk is retried like any other failed request
+                    await response.aclose()
+                    if not is_retryable(e) or attempt >= self.max_attempts:
+                        raise
+                    self.stats.retries += 1
+                    delay = backoff_delay(attempt)
+                    logging.info(f"Chat completion stream failed before its first chunk, retrying in {delay:.2f}s: {e!r}")
+                    await asyncio.sleep(delay)
+                    continue
+                except BaseException:
+                    await response.aclose()
+                    raise
+                break
+            try:
+                yield first_chunk
+                while True:
+                    try:
+                        chunk = await self._next_chunk(response)
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+                self.stats.items += 1
+            finally:
+                await response.aclose()
+
+    async def acomplete(self, messages: List[dict], model: str = MODEL_NAME, **kwargs) -> dict:
+        """
+        Get a whole chat completion, without streaming it.
+        :param messages: the messages of the conversation.
+        :param model: the name of the model.
+        :param kwargs: the other parameters of the request, like the temperature.
+        :return: the response.
+        """
+        async with self._semaphore:
+            response = await self._create(messages, model, stream=False, **kwargs)
+            self.stats.items += 1
+            return response
+
+    def _run(self, coroutine):
+        """
+        Run a coroutine on the background event loop of this client, starting it if needed, and wait for it.
+        :param coroutine: the coroutine.
+        :return: the result of the coroutine.
+        """
+        # Several threads can share the client, like a chat and the summary it writes in the background
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="ChatClient", daemon=True)
+                self._loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def stream(self, messages: List[dict], model: str = MODEL_NAME, **kwargs) -> Iterator[dict]:
+        """
+        Stream a chat completion, blocking the calling thread while it waits for each chunk.
+        :param messages: the messages of the conversation.
+        :param model: the name of the model.
+        :param kwargs: the other parameters of the request, like the temperature.
+        :return: an iterator over the chunks of the completion.
+        """
+        chunks = self.astream(messages, model, **kwargs)
+        try:
+            while True:
+                try:
+                    yield self._run(chunks.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self._run(chunks.aclose())
+
+    def complete(self, messages: List[dict], model: str = MODEL_NAME, **kwargs) -> dict:
+        """
+        Get a whole chat completion, without streaming it, blocking the calling thread.
+        :param messages: the messages of the conversation.
+        :param model: the name of the model.
+        :param kwargs: the other parameters of the request, like the temperature.
+        :return: the response.
+        """
+        return self._run(self.acomplete(messages, model, **kwargs))
+
+    def shutdown(self) -> None:
+        """
+        Close the session, and stop the background event loop of the blocking methods, if it was started.
+        """
+        if self._loop is None:
+            return
+        self._run(self.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+        self._loop = None
+        self._loop_thread = None
+
+
+_chat_client: Optional[ChatClient] = None
+_chat_client_lock = threading.Lock()
+
+
+def get_chat_client() -> ChatClient:
+    """
+    Get the ChatClient shared by the blocking helpers, like get_completion.
+    :return: the ChatClient.
+    """
+    global _chat_client
+    with _chat_client_lock:
+        if _chat_client is None:
+            _chat_client = ChatClient()
+            # Closes the pooled connections, and stops the background event loop of the blocking methods
+            atexit.register(_chat_client.shutdown)
+        return _chat_client
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+A long term memory for a chat: every message is embedded, and the messages whose embeddings are the most similar to
+the prompt's are retrieved, so a long chat keeps its recall without sending, or summarizing, the whole history.
+
+The ChatMemory is a Retriever for the ContextWindow. The messages added since the last prompt are embedded with the
+prompt, in a single request, when the prompt is ranked, and the messages of a resumed chat with its first prompt.
+Their vectors are kept in a SimilarityIndex, searched with one matrix multiply, and saved in an EmbeddingStore, so
+resuming a chat does not embed its messages again.
+
+The requests go through the EmbeddingsGenerator, so they are rate limited and retried. When the embeddings still
+cannot be had, the messages are ranked by the words they share with the prompt for that turn, instead of stopping
+the chat, and the messages left out of the index are embedded with the next prompt.
+"""
+import asyncio
+import logging
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from experiments.constants import EMBEDDING_MODEL_NAME
+from experiments.gptlib.open_ai_embeddings.embedding_store import VECTOR_DTYPE, EmbeddingStore
+from experiments.gptlib.similarity_search.similarity_search import SimilarityIndex
+from experiments.helpers.context_window import WordOverlapRetriever
+
+DEFAULT_TOP_K = 20
+
+# (the texts) -> their embeddings
+Embedder = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+def embed_texts(texts: List[str], model: str = EMBEDDING_MODEL_NAME) -> List[List[float]]:
+    """
+    Embed texts with the OpenAI API, in as few requests as the batch limits allow, rate limited and retried by an
+    EmbeddingsGenerator.
+    :param texts: the texts.
+    :param model: the name of the embedding model.
+    :return: the embeddings, in the same order as the texts.
+    :raises RuntimeError: if some texts could not be embedded, even after retrying.
+    """
+    # Imported on first use, so importing this module does not set up the OpenAI client
+    from experiments.gptlib.open_ai_embeddings.basic_embeddings import EmbeddingsGenerator
+
+    async def generate() -> dict:
+        async with EmbeddingsGenerator(model=model) as generator:
+            return await generator.multi_generate_embeddings(texts)
+
+    embeddings = asyncio.run(generate())
+    missing_count = sum(1 for text in texts if text not in embeddings)
+    if missing_count > 0:
+        raise RuntimeError(f"Failed to embed {missing_count} of {len(texts)} texts")
+    return [embeddings[text] for text in texts]
+
+
+class ChatMemory:
+    """
+    Ranks the messages of a chat by the cosine similarity of their embeddings with the prompt's.
+    """
+
+    def __init__(
+        self,
+        store_dir: Optional[str] = None,
+        embed: Optional[Embedder] = None,
+        model: str = EMBEDDING_MODEL_NAME,
+        top_k: int = DEFAULT_TOP_K,
+    ):
+        """
+        Initialize an empty ChatMemory.
+        :param store_dir: the directory of the EmbeddingStore the embeddings are saved in, if any.
+        :param embed: the function that embeds texts, embed_texts by default.
+        :param model: the name of the embedding model.
+        :param top_k: the number of messages rank returns.
+        """
+        self.embed = embed if embed is not None else lambda texts: embed_texts(texts, model)
+        self.model = model
+        self.top_k = top_k
+        self.store = EmbeddingStore(store_dir) if store_dir is not None else None
+        self.index: Optional[SimilarityIndex] = None
+        # Ranks the messages when they cannot be embedded
+        self.fallback = WordOverlapRetriever()
+        # The number of first messages of the chat in the index
+        self._count = 0
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Get the embeddings of texts, from the store if they are in it, and from the embed function otherwise.
+        :param texts: the texts, which must not be empty strings.
+        :return: the (len(texts), dimensions) matrix of embeddings.
+        """
+        if self.store is not None and self.store.dimensions is not None:
+            vectors, found = self.store.get_many(texts, self.model)
+        else:
+            vectors, found = None, np.zeros(len(texts), dtype=bool)
+        missing = np.flatnonzero(~found)
+        if len(missing) > 0:
+            missing_texts = [texts[row] for row in missing]
+            new_vectors = np.asarray(self.embed(missing_texts), dtype=VECTOR_DTYPE)
+            if self.store is not None:
+                self.store.put_many(missing_texts, new_vectors, self.model)
+            if vectors is None:
+                vectors = np.empty((len(texts), new_vectors.shape[1]), dtype=VECTOR_DTYPE)
+            vectors[missing] = new_vectors
+        return vectors
+
+    def rank(self, prompt: str, messages: Sequence[dict], limit: int) -> List[int]:
+        """
+        Rank the first messages of a chat by the similarity of their embeddings with the prompt's. The messages added
+        since the last call are embedded with the prompt. If they cannot be, the messages are ranked by the words they
+        share with the prompt instead.
+        :param prompt: the prompt.
+        :param messages: the messages of the chat.
+        :param limit: the number of first messages to rank.
+        :return: the indexes of the top_k most similar messages, from the most to the least similar.
+        """
+        new_messages = messages[self._count :]
+        # The API does not embed empty strings
+        texts = [message["content"] or " " for message in new_messages] + [prompt or " "]
+        try:
+            vectors = self._embed(texts)
+        except Exception as e:
+            logging.warning(f"Failed to embed the prompt, ranking the messages by their words instead: {e!r}")
+            return self.fallback.rank(prompt, messages, limit)[: self.top_k]
+        if new_messages:
+            if self.index is None:
+                self.index = SimilarityIndex(vectors.shape[1])
+            self.index.add_many(list(range(self._count, self._count + len(new_messages))), vectors[:-1])
+            self._count += len(new_messages)
+        if self.index is None or limit == 0:
+            return []
+        # The messages after the limit can take some of the top places, so as many more are searched for
+        _, rows = self.index.search_arrays(vectors[-1:], self.top_k + len(self.index) - limit)
+        keys = self.index.keys
+        return [keys[row] for row in rows[0].tolist() if keys[row] < limit][: self.top_k]
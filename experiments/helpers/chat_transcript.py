@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+The transcript of a chat, as an append-only JSON lines file, one message per line, so saving a turn writes the new
+messages only, instead of the whole chat.
+
+Opening a transcript does not parse it, nor read it whole: the offset of each line is loaded from an index saved
+next to the file, as <transcript>.idx, when the transcript is closed or snapshotted, and only the lines appended
+after the index was saved, by a process that crashed for instance, are scanned for. A message is only parsed when it
+is read, so resuming a long chat costs as much as the messages the next prompt needs.
+
+A compact snapshot of the whole chat, as one JSON list like the messages.json of older chats, can be written every
+so many messages. It is built from the raw lines, without parsing them.
+"""
+import json
+import os
+import pickle
+import threading
+from array import array
+from collections.abc import Sequence
+from typing import Iterable, List, Optional, Union
+
+# A snapshot is written every this many messages, when the transcript has a snapshot path
+DEFAULT_SNAPSHOT_EVERY = 200
+# The lines not covered by the index are scanned for in chunks of this many bytes
+SCAN_CHUNK_SIZE = 1 << 20
+
+
+class ChatTranscript(Sequence):
+    """
+    A sequence of chat messages, persisted as a JSON lines file that is only ever appended to.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        fsync: bool = False,
+        snapshot_path: Optional[str] = None,
+        snapshot_every: int = DEFAULT_SNAPSHOT_EVERY,
+    ):
+        """
+        Open the transcript at the given path, creating it if needed.
+        :param file_path: the path of the JSON lines file.
+        :param fsync: whether to fsync after every append, to survive a power loss and not only a crash.
+        :param snapshot_path: the path of the JSON snapshot of the whole chat, no snapshots are written without one.
+        :param snapshot_every: the number of messages between snapshots.
+        """
+        self.file_path = file_path
+        self.fsync = fsync
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        os.makedirs(os.path.dirname(os.path.realpath(file_path)), exist_ok=True)
+        # The offset of the start of each line, and of the end of the last one
+        self._offsets = array("q", [0])
+        self._scan()
+        self._log = open(file_path, "ab")
+        self._reader = open(file_path, "rb")
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self) -> str:
+        """
+        The path of the index file.
+        """
+        return f"{self.file_path}.idx"
+
+    def _load_index(self) -> None:
+        """
+        Load the saved line offsets, if they exist and still describe the file.
+        """
+        try:
+            with open(self.index_path, "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return
+        file_stat = os.stat(self.file_path)
+        # A replaced file has another inode, and a truncated one is shorter than the index says
+        if saved.get("inode") != file_stat.st_ino or saved["offsets"][-1] > file_stat.st_size:
+            return
+        self._offsets = saved["offsets"]
+
+    def _scan(self) -> None:
+        """
+        Find the offset of every line the saved index does not cover, without parsing them, reading the file in
+        chunks. A last line cut short by a crash is truncated away.
+        """
+        if not os.path.exists(self.file_path):
+            return
+        self._load_index()
+        position = self._offsets[-1]
+        with open(self.file_path, "rb") as f:
+            f.seek(position)
+            for chunk in iter(lambda: f.read(SCAN_CHUNK_SIZE), b""):
+                end = chunk.find(b"\n")
+                while end != -1:
+                    self._offsets.append(position + end + 1)
+                    end = chunk.find(b"\n", end + 1)
+                position += len(chunk)
+        if self._offsets[-1] != position:
+            os.truncate(self.file_path, self._offsets[-1])
+
+    def save_index(self) -> None:
+        """
+        Save the line offsets next to the file, so the next open does not need to scan it.
+        """
+        with self._lock:
+            saved = {"inode": os.stat(self.file_path).st_ino, "offsets": array("q", self._offsets)}
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(saved, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.index_path)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _read_lines(self, start: int, stop: int) -> bytes:
+        """
+        Read the raw lines of a range of messages.
+        :param start: the index of the first message.
+        :param stop: the index after the last message.
+        :return: the lines, with their newlines.
+        """
+        with self._lock:
+            self._reader.seek(self._offsets[start])
+            return self._reader.read(self._offsets[stop] - self._offsets[start])
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[dict, List[dict]]:
+        """
+        Read a message, or a range of messages, parsing only the lines asked for.
+        :param index: the index of the message, or a slice of indexes.
+        :return: the message, or the list of messages.
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[position] for position in range(start, stop, step)]
+            if start >= stop:
+                return []
+            return [json.loads(line) for line in self._read_lines(start, stop).splitlines()]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transcript index out of range")
+        return json.loads(self._read_lines(index, index + 1))
+
+    def append(self, message: dict) -> None:
+        """
+        Append a message to the transcript.
+        :param message: the message, it must be JSON serializable.
+        """
+        self.extend([message])
+
+    def extend(self, messages: Iterable[dict]) -> None:
+        """
+        Append messages to the transcript, with a single write, and write a snapshot if one is due.
+        :param messages: the messages, they must be JSON serializable.
+        """
+        lines = [(json.dumps(message) + "\n").encode("utf-8") for message in messages]
+        if not lines:
+            return
+        with self._lock:
+            self._log.write(b"".join(lines))
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            for line in lines:
+                self._offsets.append(self._offsets[-1] + len(line))
+        crossed = len(self) // self.snapshot_every > (len(self) - len(lines)) // self.snapshot_every
+        if self.snapshot_path is not None and crossed:
+            self.snapshot()
+
+    def snapshot(self) -> None:
+        """
+        Write the whole chat to the snapshot path, as one JSON list, and atomically replace the previous snapshot.
+        """
+        lines = self._read_lines(0, len(self)).splitlines()
+        temp_path = f"{self.snapshot_path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(b"[" + b",".join(lines) + b"]")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        self.save_index()
+
+    def close(self) -> None:
+        """
+        Save the index, and close the transcript file.
+        """
+        if self._log.closed:
+            return
+        self.save_index()
+        self._log.close()
+        self._reader.close()
+
+    def __enter__(self) -> "ChatTranscript":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
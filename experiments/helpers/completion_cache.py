@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+The format of the completions cached by the script writer, and a tool to migrate the caches written before it.
+
+A cached completion used to be the list of chunks streamed by the API, merged by merge_completion_stream, and a
+cache hit streamed them through merge_completion_stream again. It is now a single record:
+
+    {"text": ..., "finish_reason": "stop", "model": "gpt-4-0613", "id": ..., "created": ...,
+     "usage": {"prompt_tokens": ..., "completion_tokens": ..., "total_tokens": ...}}
+
+A cache hit prints the text at once, or, with simulate_stream, a word at a time like a live completion.
+The legacy chunk lists are still read, and the migration rewrites them as records:
+
+Usage:
+    python -m experiments.helpers.completion_cache
+    python -m experiments.helpers.completion_cache --log data/script_writer/all_completions.jsonl --model gpt-4
+"""
+import argparse
+import re
+from time import sleep
+from typing import List, Optional
+
+from experiments.constants import ALL_COMPLETIONS_LOG_PATH, ALL_COMPLETIONS_PATH, MODEL_NAME
+from experiments.gptlib.dictdict.key_hashers import HashedKey
+from experiments.gptlib.dictdict.lazy_dictdict import LazyDictDict
+from experiments.gptlib.dictdict.log_dictdict import LogDictDict, open_migrated
+from experiments.helpers.openai_api_helpers import CompletionStreamMerger, StreamPrinter
+from experiments.helpers.token_helpers import get_token_counter
+
+# The simulated stream prints a word, with the whitespace after it, at a time
+WORD_REGEX = re.compile(r"\s*\S+\s*|\s+")
+DEFAULT_WORDS_PER_SECOND = 40
+
+
+def build_completion_record(merged_chunks: List[dict], text: str, messages: List[dict], model: str = MODEL_NAME) -> dict:
+    """
+    Build the cache record of a streamed completion.
+    :param merged_chunks: the chunks of the completion, as merged by merge_completion_stream.
+    :param text: the text of the completion.
+    :param messages: the messages the completion answers, to count the prompt tokens.
+    :param model: the name of the model the completion was requested from, to count the tokens.
+    :return: the record.
+    """
+    token_counter = get_token_counter(model)
+    prompt_tokens = token_counter.count_messages(messages, model)
+    completion_tokens = token_counter.count(text)
+    record = {
+        "text": text,
+        "finish_reason": None,
+        "model": model,
+        "id": None,
+        "created": None,
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+    for chunk in merged_chunks:
+        # The API names the snapshot that answered, like gpt-4-0613
+        for field in ["model", "id", "created"]:
+            if chunk.get(field) is not None:
+                record[field] = chunk[field]
+        finish_reason = chunk["choices"][0].get("finish_reason")
+        if finish_reason is not None:
+            record["finish_reason"] = finish_reason
+    return record
+
+
+def is_legacy_completion(completion) -> bool:
+    """
+    Check whether a cached completion is a legacy list of chunks, rather than a record.
+    :param completion: the cached completion.
+    :return: True for a list of chunks.
+    """
+    return isinstance(completion, list)
+
+
+def upgrade_cached_completion(cached: dict, model: str = MODEL_NAME) -> dict:
+    """
+    Convert a cache entry with a legacy list of chunks to one with a record. Entries with a record are returned as
+    they are.
+    :param cached: the cache entry, with the prompt, the initial messages and the completion.
+    :param model: the name of the model the completion was requested from, to count the tokens.
+    :return: the cache entry with a record.
+    """
+    if not is_legacy_completion(cached["completion"]):
+        return cached
+    merger = CompletionStreamMerger()
+    for chunk in cached["completion"]:
+        merger.add(chunk)
+    messages = cached["initial_messages"] + [{"role": "user", "content": cached["prompt"]}]
+    record = build_completion_record(cached["completion"], merger.text, messages, model)
+    return dict(cached, completion=record)
+
+
+def replay_completion(
+    record: dict,
+    simulate_stream: bool = False,
+    words_per_second: float = DEFAULT_WORDS_PER_SECOND,
+    printer: Optional[StreamPrinter] = None,
+) -> str:
+    """
+    Print the text of a cached completion.
+    :param record: the cached completion record.
+    :param simulate_stream: whether to print the text a word at a time, like a live completion, instead of at once.
+    :param words_per_second: the speed of the simulated stream.
+    :param printer: the StreamPrinter to print the text with (default: a new one that prints to sys.stdout).
+    :return: the text of the completion.
+    """
+    if printer is None:
+        printer = StreamPrinter()
+    text = record["text"]
+    try:
+        if simulate_stream:
+            for match in WORD_REGEX.finditer(text):
+                printer.write(match.group())
+                sleep(1 / words_per_second)
+        else:
+            printer.write(text)
+    finally:
+        printer.flush()
+    return text
+
+
+def migrate_completions(store: LogDictDict, model: str = MODEL_NAME) -> int:
+    """
+    Rewrite every legacy completion of a script writer cache as a record, then compact the log, so the chunk lists
+    no longer take space in it. A cache without legacy completions is left as it is.
+    :param store: the cache.
+    :param model: the name of the model the completions were requested from, to count the tokens.
+    :return: the number of completions migrated.
+    """
+    migrated = 0
+    for hashed_key in list(store.data):
+        # The keys of the log are already hashed, so they are used as they are
+        key = HashedKey(hashed_key)
+        cached = store[key]
+        if is_legacy_completion(cached["completion"]):
+            store[key] = upgrade_cached_completion(cached, model)
+            migrated += 1
+    if migrated > 0:
+        store.compact()
+    return migrated
+
+
+def main():
+    """
+    The main function for the completion cache migration.
+    This is called when the script is run directly.
+    """
+    parser = argparse.ArgumentParser(description="Migrate the script writer completion cache to completion records.")
+    parser.add_argument("--log", default=ALL_COMPLETIONS_LOG_PATH, help="The path of the JSON lines completion log.")
+    parser.add_argument(
+        "--legacy-json",
+        default=ALL_COMPLETIONS_PATH,
+        help="The path of the completions saved by DictDict.save, imported if the log does not exist yet.",
+    )
+    parser.add_argument("--model", default=MODEL_NAME, help="The model the completions were requested from.")
+    args = parser.parse_args()
+
+    store = open_migrated(args.log, args.legacy_json, store_class=LazyDictDict)
+    with store:
+        migrated = migrate_completions(store, args.model)
+        print(f"Migrated {migrated} of {len(store)} completions in {args.log}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+Fits a chat history that grows without limit into the context window of a model.
+
+The ContextWindow counts each message once, the first time it is considered, so choosing what to send costs about
+the same per turn whatever the length of the chat. The messages can be a ChatTranscript, that only reads the
+messages asked for, so a long chat is resumed without reading all of it. Every turn, the prompt is sent with the most
+recent messages, a summary of the chat so far, and as many of the older messages as fit in the budget, the most
+relevant first. The budget is the context window minus the room reserved for the reply.
+
+The relevance of the older messages is up to a retriever. The WordOverlapRetriever ranks them by the words they
+share with the prompt, the ChatMemory of chat_memory.py by the similarity of their embeddings.
+
+The summary is written by a summarizer function, in a background thread, as soon as the messages it does not cover
+grow past a fraction of the budget. The chat goes on while it runs, so nobody waits for it.
+"""
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Protocol, Sequence, Set, Tuple
+
+from experiments.constants import MODEL_NAME
+from experiments.helpers.model_registry import get_model_info
+from experiments.helpers.token_helpers import TokenCounter, get_token_counter
+
+DEFAULT_REPLY_TOKENS = 1000
+DEFAULT_KEEP_RECENT = 4
+# A summary is started once the messages it does not cover take this fraction of the budget
+DEFAULT_SUMMARIZE_AT = 0.5
+SUMMARY_PREFIX = "A summary of the conversation so far: "
+WORD_REGEX = re.compile(r"\w{3,}")
+
+# (the messages to summarize, the previous summary or None) -> the new summary
+Summarizer = Callable[[List[dict], Optional[str]], str]
+
+
+def get_words(text: str) -> Set[str]:
+    """
+    Get the words of a text that count towards its relevance, ignoring case and very short words.
+    :param text: the text.
+    :return: the set of words.
+    """
+    return set(WORD_REGEX.findall(text.lower()))
+
+
+class Retriever(Protocol):
+    """
+    Ranks the messages of a chat by their relevance to a prompt.
+    """
+
+    def rank(self, prompt: str, messages: Sequence[dict], limit: int) -> List[int]:
+        """
+        Rank the first messages of a chat by their relevance to a prompt. The chat only grows between calls, so
+        what was learned of its messages can be kept.
+        :param prompt: the prompt.
+        :param messages: the messages of the chat.
+        :param limit: the number of first messages to rank.
+        :return: the indexes of the messages, from the most to the least relevant. Some can be left out.
+        """
+
+
+class WordOverlapRetriever:
+    """
+    Ranks messages by the share of their words they have in common with the prompt, the most recent first when
+    they are equally relevant.
+    """
+
+    def __init__(self):
+        # The words of the first messages of the chat
+        self._words: List[Set[str]] = []
+
+    def rank(self, prompt: str, messages: Sequence[dict], limit: int) -> List[int]:
+        """
+        Rank the first messages of a chat by the words they share with a prompt.
+        :param prompt: the prompt.
+        :param messages: the messages of the chat.
+        :param limit: the number of first messages to rank.
+        :return: the indexes of the messages, from the most to the least relevant.
+        """
+        if limit > len(self._words):
+            self._words += [get_words(message["content"]) for message in messages[len(self._words) : limit]]
+        prompt_words = get_words(prompt)
+
+        def relevance(index: int) -> Tuple[float, int]:
+            words = self._words[index]
+            return len(words & prompt_words) / (len(words | prompt_words) or 1), index
+
+        return sorted(range(limit), key=relevance, reverse=True)
+
+
+class ContextWindow:
+    """
+    A chat history, and the choice of which of its messages to send with each prompt.
+    """
+
+    def __init__(
+        self,
+        model: str = MODEL_NAME,
+        reply_tokens: int = DEFAULT_REPLY_TOKENS,
+        budget: Optional[int] = None,
+        keep_recent: int = DEFAULT_KEEP_RECENT,
+        summarize_at: float = DEFAULT_SUMMARIZE_AT,
+        summarizer: Optional[Summarizer] = None,
+        token_counter: Optional[TokenCounter] = None,
+        retriever: Optional[Retriever] = None,
+        messages: Optional[Sequence[dict]] = None,
+    ):
+        """
+        Initialize a ContextWindow.
+        :param model: the name of the model the messages are sent to.
+        :param reply_tokens: the tokens reserved for the reply.
+        :param budget: the most prompt tokens to send, the context window of the model minus reply_tokens by default.
+        :param keep_recent: the number of most recent messages that are always sent, if they fit.
+        :param summarize_at: the fraction of the budget the messages not covered by the summary can take before a
+            new summary is started.
+        :param summarizer: the function that writes the summaries, no summaries are written without one.
+        :param token_counter: the TokenCounter of the messages, the shared one of the model by default.
+        :param retriever: the Retriever that ranks the older messages, a WordOverlapRetriever by default.
+        :param messages: the messages of the chat so far, and where the new ones are added, a new list by default.
+            A ChatTranscript reads the messages lazily, and saves the new ones.
+        """
+        self.model = model
+        self.model_info = get_model_info(model)
+        self.budget = budget if budget is not None else self.model_info.context_window - reply_tokens
+        self.keep_recent = keep_recent
+        self.summarize_at = summarize_at
+        self.summarizer = summarizer
+        self.token_counter = token_counter if token_counter is not None else get_token_counter(model)
+        self.retriever = retriever if retriever is not None else WordOverlapRetriever()
+        self.messages = messages if messages is not None else []
+        # The number of tokens of each message counted so far, by index
+        self._counts: Dict[int, int] = {}
+        # totals[i] is the number of tokens of the first i messages, extended as far as it was needed
+        self.totals = [0]
+        self.summary: Optional[str] = None
+        # The number of first messages the summary covers
+        self.summary_covers = 0
+        self._summary_tokens = 0
+        self._lock = threading.Lock()
+        self._summary_thread: Optional[threading.Thread] = None
+
+    def count(self, message: dict) -> int:
+        """
+        Count the tokens of a message, with the tokens the chat format adds around it.
+        :param message: the message.
+        :return: the number of tokens.
+        """
+        return self.token_counter.count_message_list([message], self.model)[0]
+
+    def tokens(self, index: int) -> int:
+        """
+        Get the number of tokens of a message of the chat, counting it the first time.
+        :param index: the index of the message.
+        :return: the number of tokens.
+        """
+        if index not in self._counts:
+            self._counts[index] = self.count(self.messages[index])
+        return self._counts[index]
+
+    def tokens_before(self, upto: int) -> int:
+        """
+        Get the number of tokens of the first messages of the chat, keeping the running totals.
+        :param upto: the number of first messages.
+        :return: the number of tokens.
+        """
+        while len(self.totals) <= upto:
+            self.totals.append(self.totals[-1] + self.tokens(len(self.totals) - 1))
+        return self.totals[upto]
+
+    def append(self, message: dict) -> None:
+        """
+        Add a message at the end of the chat.
+        :param message: the message.
+        """
+        self.extend([message])
+
+    def extend(self, messages: List[dict]) -> None:
+        """
+        Add messages at the end of the chat.
+        :param messages: the messages.
+        """
+        with self._lock:
+            self.messages.extend(messages)
+
+    @property
+    def total_tokens(self) -> int:
+        """
+        The number of tokens of the whole chat.
+        """
+        return self.tokens_before(len(self.messages))
+
+    def set_summary(self, summary: str, covers: int) -> None:
+        """
+        Set the summary of the chat.
+        :param summary: the text of the summary.
+        :param covers: the number of first messages of the chat the summary covers.
+        """
+        tokens = self.count({"role": "system", "content": SUMMARY_PREFIX + summary})
+        with self._lock:
+            self.summary = summary
+            self.summary_covers = covers
+            self._summary_tokens = tokens
+
+    def summary_record(self) -> Optional[dict]:
+        """
+        Get the summary and the number of messages it covers, to save them.
+        :return: {"summary": the text, "covers": the number of messages}, or None without a summary.
+        """
+        with self._lock:
+            if self.summary is None:
+                return None
+            return {"summary": self.summary, "covers": self.summary_covers}
+
+    def pack(self, prompt: str) -> Tuple[List[dict], int]:
+        """
+        Choose the messages to send with a prompt: the summary, the most recent messages, then the older messages
+        the retriever finds the most relevant, as long as they fit in the budget. The chosen messages keep their
+        order in the chat. The most recent message is always sent, even if it alone goes over the budget.
+        :param prompt: the prompt.
+        :return: the messages to send before the prompt, and the number of tokens of the messages with the prompt.
+        """
+        prompt_tokens = self.count({"role": "user", "content": prompt}) + self.model_info.tokens_per_reply
+        with self._lock:
+            summary = self.summary
+            used = prompt_tokens + self._summary_tokens
+        chosen = set()
+        count = len(self.messages)
+        # The most recent messages, newest first
+        for index in range(count - 1, max(count - self.keep_recent, 0) - 1, -1):
+            tokens = self.tokens(index)
+            if chosen and used + tokens > self.budget:
+                break
+            chosen.add(index)
+            used += tokens
+        # Then the older messages, the most relevant first
+        older_count = min(chosen, default=count)
+        for index in self.retriever.rank(prompt, self.messages, older_count) if older_count > 0 else []:
+            tokens = self.tokens(index)
+            if used + tokens <= self.budget:
+                chosen.add(index)
+                used += tokens
+        messages = [self.messages[index] for index in sorted(chosen)]
+        if summary is not None:
+            messages.insert(0, {"role": "system", "content": SUMMARY_PREFIX + summary})
+        return messages, used
+
+    def needs_summary(self) -> bool:
+        """
+        Check whether the messages older than the most recent ones, that the summary does not cover yet, have grown
+        past the summarize_at fraction of the budget.
+        :return: True if a new summary is due.
+        """
+        upto = max(len(self.messages) - self.keep_recent, 0)
+        if upto <= self.summary_covers:
+            return False
+        return self.tokens_before(upto) - self.tokens_before(self.summary_covers) > self.budget * self.summarize_at
+
+    def summarize_in_background(self) -> bool:
+        """
+        Start writing a new summary in a background thread, if one is due and none is being written.
+        The summary covers every message but the most recent ones, and is set once it is written.
+        :return: True if a summary was started.
+        """
+        if self.summarizer is None or self.is_summarizing or not self.needs_summary():
+            return False
+        upto = len(self.messages) - self.keep_recent
+        messages = list(self.messages[self.summary_covers : upto])
+        previous_summary = self.summary
+
+        def summarize():
+            self.set_summary(self.summarizer(messages, previous_summary), upto)
+
+        self._summary_thread = threading.Thread(target=summarize, name="ContextWindowSummary", daemon=True)
+        self._summary_thread.start()
+        return True
+
+    @property
+    def is_summarizing(self) -> bool:
+        """
+        Whether a summary is being written in the background.
+        """
+        return self._summary_thread is not None and self._summary_thread.is_alive()
+
+    def wait_for_summary(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for the summary being written in the background, if any.
+        :param timeout: the most seconds to wait, forever by default.
+        """
+        if self._summary_thread is not None:
+            self._summary_thread.join(timeout)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+A local stand-in for the OpenAI API, for benchmarks and load tests that should not spend money or hit rate limits.
+It serves the embeddings endpoint with deterministic fake vectors, and the chat completions endpoint with a
+streamed echo of the last message, after a configurable simulated latency, and counts the requests and inputs
+it has received. It can also answer some requests with a 429 rate limit error.
+
+Point the openai library at it with `openai.api_base = server.url`.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import socket
+from typing import Optional
+
+import numpy as np
+from aiohttp import web
+
+
+def fake_embedding(text: str, dimensions: int) -> np.ndarray:
+    """
+    Build a deterministic, unit length fake embedding for the given text.
+    :param text: the embedded text.
+    :param dimensions: the number of dimensions of the embedding.
+    :return: the embedding as a float32 array.
+    """
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeOpenAIServer:
+    """
+    An aiohttp server that imitates the OpenAI embeddings and chat completions endpoints.
+    Use it as an async context manager, it listens on a free local port while the context is open.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = 1536,
+        request_latency: float = 0.05,
+        per_input_latency: float = 0.0005,
+        rate_limit_every: int = 0,
+        retry_after: float = 0.1,
+        first_chunk_latency: float = 0.0,
+        chunk_latency: float = 0.0,
+    ):
+        """
+        Initialize the FakeOpenAIServer.
+        :param dimensions: the number of dimensions of the fake embeddings.
+        :param request_latency: the simulated seconds taken by every request.
+        :param per_input_latency: the simulated extra seconds taken by every input of a request.
+        :param rate_limit_every: answer every Nth request with a 429 rate limit error, 0 never does.
+        :param retry_after: the Retry-After seconds sent with the rate limit errors.
+        :param first_chunk_latency: the simulated seconds before the first chunk of a chat completion.
+        :param chunk_latency: the simulated seconds between the chunks of a streamed chat completion.
+        """
+        self.dimensions = dimensions
+        self.request_latency = request_latency
+        self.per_input_latency = per_input_latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.first_chunk_latency = first_chunk_latency
+        self.chunk_latency = chunk_latency
+        self.request_count = 0
+        self.input_count = 0
+        self.rate_limited_count = 0
+        self.client_addresses = set()
+        self.chat_in_flight = 0
+        self.max_chat_in_flight = 0
+        self.port = None
+        self._runner = None
+
+    @property
+    def connection_count(self) -> int:
+        """
+        The number of distinct client connections that sent requests.
+        """
+        return len(self.client_addresses)
+
+    @property
+    def url(self) -> str:
+        """
+        The base URL of the fake API, to use as openai.api_base.
+        """
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self) -> None:
+        """
+        Start listening on a free local port.
+        """
+        app = web.Application()
+        app.router.add_post("/v1/embeddings", self._handle_embeddings)
+        app.router.add_post("/v1/chat/completions", self._handle_chat_completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listening_socket.bind(("127.0.0.1", 0))
+        self.port = listening_socket.getsockname()[1]
+        await web.SockSite(self._runner, listening_socket).start()
+
+    async def stop(self) -> None:
+        """
+        Stop the server.
+        """
+        await self._runner.cleanup()
+
+    async def __aenter__(self) -> "FakeOpenAIServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.stop()
+
+    def _count_request(self, request: web.Request) -> Optional[web.Response]:
+        """
+        Count a request, and decide whether to answer it with a rate limit error.
+        :param request: the HTTP request.
+        :return: the rate limit error response, or None to answer the request.
+        """
+        self.request_count += 1
+        self.client_addresses.add(request.transport.get_extra_info("peername"))
+        if not self.rate_limit_every or self.request_count % self.rate_limit_every != 0:
+            return None
+        self.rate_limited_count += 1
+        error = {"error": {"message": "Rate limit reached", "type": "requests", "param": None, "code": None}}
+        return web.Response(status=429, text=json.dumps(error), content_type="application/json", headers={"Retry-After": str(self.retry_after)})
+
+    async def _handle_embeddings(self, request: web.Request) -> web.Response:
+        """
+        Answer an embeddings request, the same way the OpenAI API does.
+        :param request: the HTTP request.
+        :return: the HTTP response.
+        """
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        rate_limited_response = self._count_request(request)
+        if rate_limited_response is not None:
+            return rate_limited_response
+        self.input_count += len(inputs)
+        await asyncio.sleep(self.request_latency + self.per_input_latency * len(inputs))
+
+        use_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for idx, text in enumerate(inputs):
+            vector = fake_embedding(text, self.dimensions)
+            embedding = base64.b64encode(vector.tobytes()).decode("ascii") if use_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": idx, "embedding": embedding})
+        token_count = sum(len(text.split()) for text in inputs)
+        response = {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": token_count, "total_tokens": token_count},
+        }
+        return web.Response(text=json.dumps(response), content_type="application/json")
+
+    async def _handle_chat_completions(self, request: web.Request) -> web.StreamResponse:
+        """
+        Answer a chat completion request with an echo of the last message, a word per chunk when streaming, the
+        same way the OpenAI API does.
+        :param request: the HTTP request.
+        :return: the HTTP response.
+        """
+        body = await request.json()
+        rate_limited_response = self._count_request(request)
+        if rate_limited_response is not None:
+            return rate_limited_response
+        self.input_count += len(body["messages"])
+        words = f"Echo: {body['messages'][-1]['content']}".split(" ")
+        self.chat_in_flight += 1
+        self.max_chat_in_flight = max(self.max_chat_in_flight, self.chat_in_flight)
+        try:
+            await asyncio.sleep(self.request_latency)
+            if not body.get("stream"):
+                await asyncio.sleep(self.first_chunk_latency)
+                message = {"role": "assistant", "content": " ".join(words)}
+                response = {
+                    "object": "chat.completion",
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                }
+                return web.Response(text=json.dumps(response), content_type="application/json")
+
+            stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            # The headers are sent right away, like the API does, then the chunks as they are generated
+            await stream.prepare(request)
+            await asyncio.sleep(self.first_chunk_latency)
+            deltas = [{"role": "assistant"}] + [{"content": word if idx == 0 else " " + word} for idx, word in enumerate(words)] + [{}]
+            for idx, delta in enumerate(deltas):
+                if idx > 1:
+                    await asyncio.sleep(self.chunk_latency)
+                finish_reason = "stop" if idx == len(deltas) - 1 else None
+                chunk = {
+                    "object": "chat.completion.chunk",
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                await stream.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await stream.write(b"data: [DONE]\n\n")
+            await stream.write_eof()
+            return stream
+        finally:
+            self.chat_in_flight -= 1
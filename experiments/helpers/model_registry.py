@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+What we need to know about each OpenAI model to budget a request: the tiktoken encoding it counts tokens with, its
+context window, its prompt and completion prices, and the tokens the chat format adds around each message.
+
+See: https://openai.com/pricing and https://github.com/openai/openai-cookbook, "How to count tokens with tiktoken"
+"""
+from typing import Dict, NamedTuple
+
+
+class ModelInfo(NamedTuple):
+    """
+    The token budget and prices of a model. Prices are in USD per 1000 tokens.
+    """
+
+    name: str
+    encoding_name: str
+    context_window: int
+    prompt_price_usd: float
+    completion_price_usd: float
+    # Every chat message is wrapped as <|start|>{role/name}\n{content}<|end|>\n
+    tokens_per_message: int = 3
+    # A message with a name has its role replaced by the name, which costs this many more tokens
+    tokens_per_name: int = 1
+    # Every reply is primed with <|start|>assistant<|message|>
+    tokens_per_reply: int = 3
+
+
+MODELS: Dict[str, ModelInfo] = {}
+
+
+def register_model(info: ModelInfo) -> None:
+    """
+    Add a model to the registry, or replace the one with the same name.
+    :param info: The model's information.
+    """
+    MODELS[info.name] = info
+
+
+def get_model_info(model: str) -> ModelInfo:
+    """
+    Get the information of a model. A dated snapshot, like gpt-4-0613, gets the information of the longest
+    registered name it starts with.
+    :param model: The name of the model.
+    :return: The model's information.
+    """
+    if model in MODELS:
+        return MODELS[model]
+    prefixes = [name for name in MODELS if model.startswith(name + "-")]
+    if not prefixes:
+        raise KeyError(f"Unknown model {model!r}, add it with register_model")
+    return MODELS[max(prefixes, key=len)]
+
+
+def estimate_cost_usd(model: str, prompt_tokens: int, completion_tokens: int = 0) -> float:
+    """
+    Estimate what a request costs.
+    :param model: The name of the model.
+    :param prompt_tokens: The number of tokens sent.
+    :param completion_tokens: The number of tokens generated.
+    :return: The cost in USD.
+    """
+    info = get_model_info(model)
+    return (prompt_tokens * info.prompt_price_usd + completion_tokens * info.completion_price_usd) / 1000
+
+
+register_model(ModelInfo("gpt-4", "cl100k_base", 8192, 0.03, 0.06))
+register_model(ModelInfo("gpt-4-32k", "cl100k_base", 32768, 0.06, 0.12))
+register_model(ModelInfo("gpt-3.5-turbo", "cl100k_base", 4096, 0.0015, 0.002))
+register_model(ModelInfo("gpt-3.5-turbo-16k", "cl100k_base", 16384, 0.003, 0.004))
+register_model(ModelInfo("text-embedding-ada-002", "cl100k_base", 8191, 0.0001, 0.0, 0, 0, 0))
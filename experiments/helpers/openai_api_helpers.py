@@ -1,23 +1,29 @@
 #!/usr/bin/env python
-from time import sleep
+import sys
+from time import monotonic, sleep
+from typing import Optional, TextIO
 
 import openai
 
-from experiments.helpers.token_helpers import count_tokens
+from experiments.helpers.token_helpers import MessagesTokenCounter
 
 from experiments.constants import (
     MODEL_NAME,
 )
 from experiments.config import OPEN_AI_KEY
 
+from experiments.helpers.rate_limiter import backoff_delay, get_retry_after
 from experiments.helpers.terminal_color_helper import fg, BG_DEFAULT_COLOR, FG_DEFAULT_COLOR
 
 openai.api_key = OPEN_AI_KEY
+# model name -> the MessagesTokenCounter of the chat history sent to that model
+MESSAGES_TOKEN_COUNTERS = {}
 
 
 def backoff_completion(model=MODEL_NAME, messages=None, stream=True, retry_count=5, temperature=1):
     """
     Send a completion request to the OpenAI API with exponential backoff for rate limit errors.
+    This blocks the calling thread, the ChatClient of chat_client.py runs many completions concurrently instead.
 
     :param model: The name of the model to use for the completion.
     :param messages: A list of messages to process (optional).
@@ -28,61 +34,157 @@ def backoff_completion(model=MODEL_NAME, messages=None, stream=True, retry_count
     """
     if messages is None:
         messages = []
-    try:
-        print(fg(1, 0, 1) + "Sending completion request..." + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
-        completion = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            stream=stream,
-            temperature=temperature,
-        )
-        return completion
-    except openai.error.RateLimitError:
-        if retry_count == 0:
-            raise Exception("Rate limit error, giving up.")
-        else:
-            sleep(5 - retry_count)
-            print("Rate limit error, retrying...")
-            return backoff_completion(model=model, messages=messages, stream=stream, retry_count=retry_count - 1, temperature=temperature)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            print(fg(1, 0, 1) + "Sending completion request..." + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
+            return openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                stream=stream,
+                temperature=temperature,
+            )
+        except openai.error.RateLimitError as e:
+            if attempt > retry_count:
+                raise Exception("Rate limit error, giving up.")
+            delay = get_retry_after(e) or backoff_delay(attempt)
+            print(f"Rate limit error, retrying in {delay:.1f}s...")
+            sleep(delay)
 
 
-def count_messages_tokens(messages):
+def count_messages_tokens(messages, model=MODEL_NAME):
     """
-    Count the number of tokens in a list of messages.
+    Count the number of prompt tokens the API bills for a list of messages, including the tokens the chat format
+    adds around each message.
+    Only the messages that were not in the list counted last time are counted, so counting a chat history that grows
+    by one turn at a time costs about the same whatever its length.
 
     :param messages: A list of messages.
+    :param model: The name of the model the messages are sent to.
     :return: The total number of tokens in the messages.
     """
-    token_count = 0
-    for message in messages:
-        token_count += count_tokens(message["content"])
-    return token_count
+    if model not in MESSAGES_TOKEN_COUNTERS:
+        MESSAGES_TOKEN_COUNTERS[model] = MessagesTokenCounter(model=model)
+    return MESSAGES_TOKEN_COUNTERS[model].count(messages)
+
+
+class StreamPrinter:
+    """
+    Prints the text of a completion stream to the terminal in color, a batch at a time rather than a token at a time.
+    The buffered text is written once it reaches flush_chars characters, or flush_interval seconds after the last
+    write, so the answer still shows up as it is generated.
+    """
+
+    def __init__(self, out: Optional[TextIO] = None, flush_interval: float = 0.05, flush_chars: int = 256):
+        """
+        :param out: The stream to print to (default: sys.stdout at the time of each write).
+        :param flush_interval: The seconds after which buffered text is written.
+        :param flush_chars: The number of buffered characters after which they are written.
+        """
+        self.out = out
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.buffer = []
+        self.buffered_chars = 0
+        self.last_flush = monotonic()
+
+    def write(self, text: str) -> None:
+        """
+        Buffer some text, and print the buffer if it is due.
+
+        :param text: The text to print.
+        """
+        self.buffer.append(text)
+        self.buffered_chars += len(text)
+        if self.buffered_chars >= self.flush_chars or monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Print the buffered text, wrapped in a single color escape sequence.
+        """
+        self.last_flush = monotonic()
+        if not self.buffer:
+            return
+        out = self.out or sys.stdout
+        out.write(fg(0, 1, 1) + "".join(self.buffer) + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
+        out.flush()
+        self.buffer = []
+        self.buffered_chars = 0
+
+
+class CompletionStreamMerger:
+    """
+    Accumulates a stream of completion chunks into a compact record: every run of consecutive content chunks becomes
+    a single chunk holding their joined content, and the other chunks, like the role and the finish reason, are kept
+    as they are. The record replays through merge_completion_stream like the original stream.
+    The content is collected in lists and joined once at the end, so merging is linear in the length of the answer.
+    """
+
+    def __init__(self):
+        # Each entry is a chunk, or for a run of content chunks, the first chunk of the run and its contents
+        self.entries = []
+
+    def add(self, chunk) -> Optional[str]:
+        """
+        Add a chunk of the stream.
+
+        :param chunk: The chunk.
+        :return: The content of the chunk, or None if it has none.
+        """
+        delta = chunk["choices"][0]["delta"]
+        if "content" not in delta:
+            self.entries.append(chunk)
+            return None
+        text_content = delta["content"]
+        if self.entries and isinstance(self.entries[-1], tuple):
+            self.entries[-1][1].append(text_content)
+        else:
+            self.entries.append((chunk, [text_content]))
+        return text_content
+
+    @property
+    def text(self) -> str:
+        """
+        :return: The text of the chunks added so far.
+        """
+        return "".join(content for entry in self.entries if isinstance(entry, tuple) for content in entry[1])
+
+    def merged(self) -> list:
+        """
+        Build the compact record of the chunks added so far. The chunks that were added are not modified.
 
+        :return: The list of merged chunks.
+        """
+        merged = []
+        for entry in self.entries:
+            if isinstance(entry, tuple):
+                first_chunk, contents = entry
+                choice = first_chunk["choices"][0]
+                delta = dict(choice["delta"], content="".join(contents))
+                entry = dict(first_chunk, choices=[dict(choice, delta=delta)] + list(first_chunk["choices"][1:]))
+            merged.append(entry)
+        return merged
 
-def merge_completion_stream(completion):
+
+def merge_completion_stream(completion, printer: Optional[StreamPrinter] = None):
     """
-    Merge a stream of completion chunks into a list of full completions and a concatenated text.
+    Merge a stream of completion chunks into a list of full completions and a concatenated text, printing the text
+    as it arrives.
 
     :param completion: An iterable stream of completion chunks.
+    :param printer: The StreamPrinter to print the text with (default: a new one that prints to sys.stdout).
     :return: A tuple containing a list of full completions and the concatenated text from the chunks.
     """
-    full_completion = []
-    full_text_chunks = []
-    for chunk in completion:
-        delta = chunk["choices"][0]["delta"]
-        if "content" in delta:
-            text_content = delta["content"]
-            full_text_chunks.append(text_content)
-            msg = fg(0, 1, 1) + text_content + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR
-            print(msg, end="")
-            if len(full_completion) > 0:
-                last_chunk = full_completion[-1]
-                last_delta = last_chunk["choices"][0]["delta"]
-                if "content" in last_delta:
-                    last_delta["content"] += text_content
-                    chunk = None
-        if chunk is not None:
-            full_completion.append(chunk)
-    full_text = "".join(full_text_chunks)
-
-    return full_completion, full_text
+    if printer is None:
+        printer = StreamPrinter()
+    merger = CompletionStreamMerger()
+    try:
+        for chunk in completion:
+            text_content = merger.add(chunk)
+            if text_content:
+                printer.write(text_content)
+    finally:
+        printer.flush()
+    return merger.merged(), merger.text
@@ -1,12 +1,13 @@
 from experiments.constants import MODEL_NAME
-from experiments.helpers.openai_api_helpers import backoff_completion, merge_completion_stream
+from experiments.helpers.chat_client import get_chat_client
+from experiments.helpers.openai_api_helpers import merge_completion_stream
 
 
 def get_completion(prompt, initial_messages=None, temperature=1.0):
     if initial_messages is None:
         initial_messages = []
     messages = initial_messages + [{"role": "user", "content": prompt}]
-    completion = backoff_completion(model=MODEL_NAME, messages=messages, stream=True, temperature=temperature)
+    completion = get_chat_client().stream(messages, model=MODEL_NAME, temperature=temperature)
     full_completion, full_text = merge_completion_stream(completion)
 
     messages.append({"role": "assistant", "content": full_text})
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+A long lived aiohttp session for the async calls of the openai library, so requests reuse pooled keep-alive
+connections instead of paying for a new TCP and TLS handshake each time.
+
+The openai library reads its session from the openai.aiosession context variable. Activate an OpenAISession
+while starting the tasks that call the API, and they keep using it:
+
+```python
+async with OpenAISession(on_request=RequestMetrics()) as session:
+    with session.activate():
+        tasks = [asyncio.create_task(openai.Embedding.acreate(input=text, model=model)) for text in texts]
+    await asyncio.gather(*tasks)
+```
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+import openai
+from aiohttp import ClientSession, TCPConnector, TraceConfig
+
+# Called after every request with its name ("POST /v1/embeddings"), its latency in seconds, and whether it succeeded.
+RequestHook = Callable[[str, float, bool], None]
+
+
+class RequestMetrics:
+    """
+    A metrics hook for OpenAISession, that keeps the latencies of the requests by name.
+    """
+
+    def __init__(self):
+        """
+        Initialize empty metrics.
+        """
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def __call__(self, name: str, latency: float, ok: bool) -> None:
+        """
+        Record a request.
+        :param name: the method and path of the request.
+        :param latency: the seconds between sending the request and receiving the response headers.
+        :param ok: whether the request got a successful response.
+        """
+        self.latencies.setdefault(name, []).append(latency)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Get the number of requests, errors and the latency percentiles, by request name.
+        :return: the summary of each request name.
+        """
+        summaries = {}
+        for name, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            summaries[name] = {
+                "count": len(ordered),
+                "errors": self.errors.get(name, 0),
+                "p50_seconds": ordered[len(ordered) // 2],
+                "p95_seconds": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max_seconds": ordered[-1],
+            }
+        return summaries
+
+
+class OpenAISession:
+    """
+    Owns an aiohttp ClientSession with a tuned connection pool, for the async calls of the openai library.
+    Use it as an async context manager, or call open and close.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 50,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        on_request: Optional[RequestHook] = None,
+    ):
+        """
+        Initialize the OpenAISession. The connections are only opened once it is used.
+        :param limit: the maximum number of open connections.
+        :param limit_per_host: the maximum number of open connections to the same host.
+        :param keepalive_timeout: the seconds an idle connection is kept open for reuse.
+        :param dns_cache_ttl: the seconds a DNS resolution is cached for.
+        :param on_request: the metrics hook called after every request, if any.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.on_request = on_request
+        self._session: Optional[ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        The open aiohttp ClientSession.
+        """
+        if self._session is None or self._session.closed:
+            raise RuntimeError("The OpenAISession is not open")
+        return self._session
+
+    async def open(self) -> "OpenAISession":
+        """
+        Open the session, unless it is already open in the running event loop.
+        A session left open by an event loop that is not running anymore is replaced.
+        :return: this OpenAISession.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is loop:
+            return self
+        connector = TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        trace_configs = [self._make_trace_config()] if self.on_request else []
+        self._session = ClientSession(connector=connector, trace_configs=trace_configs)
+        self._loop = loop
+        return self
+
+    async def close(self) -> None:
+        """
+        Close the session and its pooled connections.
+        """
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def __aenter__(self) -> "OpenAISession":
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    @contextmanager
+    def activate(self) -> Iterator[ClientSession]:
+        """
+        Make the openai library use this session in the current context, and in the tasks created in it.
+        :return: a context manager that restores the previous session on exit.
+        """
+        token = openai.aiosession.set(self.session)
+        try:
+            yield self.session
+        finally:
+            openai.aiosession.reset(token)
+
+    def _make_trace_config(self) -> TraceConfig:
+        """
+        Build the aiohttp TraceConfig that times every request, and reports it to the on_request hook.
+        :return: the TraceConfig.
+        """
+
+        async def on_request_start(session, context, params):
+            context.started_at = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            name = f"{params.method.upper()} {params.url.path}"
+            self.on_request(name, time.perf_counter() - context.started_at, params.response.status < 400)
+
+        async def on_request_exception(session, context, params):
+            name = f"{params.method.upper()} {params.url.path}"
+            self.on_request(name, time.perf_counter() - context.started_at, False)
+
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Client side rate limiting for the OpenAI API. The API limits both the requests and the tokens sent per minute,
+so the RateLimiter holds a token bucket for each, and backs off when the API answers with a rate limit error anyway.
+"""
+import asyncio
+import random
+import time
+from typing import Optional
+
+
+def backoff_delay(attempt: int, base_seconds: float = 1.0, max_seconds: float = 60.0) -> float:
+    """
+    Get how long to wait before retrying, using exponential backoff with full jitter.
+    The jitter spreads out the retries of concurrent callers that failed at the same time.
+    :param attempt: the number of attempts that have failed so far, starting at 1.
+    :param base_seconds: the upper bound of the delay after the first failure.
+    :param max_seconds: the cap on the upper bound of the delay.
+    :return: the delay in seconds.
+    """
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** (attempt - 1)))
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Get the delay the API asked for in the Retry-After header of an error response, if any.
+    :param error: the error raised by the openai library.
+    :return: the delay in seconds, or None if the error does not carry one.
+    """
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(retry_after) if retry_after is not None else None
+    except ValueError:
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Check whether a failed request is worth sending again. Errors caused by the request itself will fail again.
+    :param error: the error raised by the request.
+    :return: True if the request should be retried.
+    """
+    import openai
+
+    return not isinstance(error, (openai.error.InvalidRequestError, openai.error.AuthenticationError, openai.error.PermissionError))
+
+
+class TokenBucket:
+    """
+    A bucket that holds up to a minute's worth of capacity, and refills continuously.
+    """
+
+    def __init__(self, per_minute: float):
+        """
+        Initialize a full TokenBucket.
+        :param per_minute: the capacity of the bucket, and how much it refills per minute.
+        """
+        self.per_minute = per_minute
+        self.available = per_minute
+        self._refilled_at = time.monotonic()
+
+    def _refill(self, now: float, rate_factor: float) -> None:
+        """
+        Add the capacity regained since the last refill.
+        :param now: the current monotonic time.
+        :param rate_factor: the fraction of the nominal refill rate to use.
+        """
+        self.available = min(self.per_minute, self.available + (now - self._refilled_at) * self.per_minute * rate_factor / 60)
+        self._refilled_at = now
+
+    def wait_time(self, amount: float, now: float, rate_factor: float = 1.0) -> float:
+        """
+        Get how long until the bucket holds the given amount.
+        :param amount: the amount needed, capped to the bucket capacity.
+        :param now: the current monotonic time.
+        :param rate_factor: the fraction of the nominal refill rate to use.
+        :return: the wait in seconds, 0 if the amount is available now.
+        """
+        self._refill(now, rate_factor)
+        missing = min(amount, self.per_minute) - self.available
+        if missing <= 0:
+            return 0.0
+        return missing * 60 / (self.per_minute * rate_factor)
+
+    def consume(self, amount: float) -> None:
+        """
+        Take the given amount out of the bucket. Call wait_time first to make sure it is available.
+        :param amount: the amount to take, capped to the bucket capacity.
+        """
+        self.available -= min(amount, self.per_minute)
+
+
+class RateLimiter:
+    """
+    Limits the requests and tokens per minute sent by the coroutines sharing it.
+    Each rate limit error halves the refill rate, and each success wins back a little of it, so the limiter
+    settles just under the limit the API actually enforces. A Retry-After from the API pauses every caller.
+    """
+
+    MIN_RATE_FACTOR = 0.05
+    RATE_FACTOR_RECOVERY = 0.02
+
+    def __init__(self, requests_per_minute: float = 3000, tokens_per_minute: float = 1_000_000):
+        """
+        Initialize the RateLimiter.
+        :param requests_per_minute: the nominal number of requests allowed per minute.
+        :param tokens_per_minute: the nominal number of tokens allowed per minute.
+        """
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.rate_factor = 1.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        """
+        Wait until a request of the given number of tokens can be sent. Callers are served in order.
+        :param tokens: the number of tokens the request will use.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self._paused_until - now,
+                    self.request_bucket.wait_time(1, now, self.rate_factor),
+                    self.token_bucket.wait_time(tokens, now, self.rate_factor),
+                )
+                if wait <= 0:
+                    self.request_bucket.consume(1)
+                    self.token_bucket.consume(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def on_success(self) -> None:
+        """
+        Record a successful request, slowly raising the rate back towards the nominal one.
+        """
+        self.rate_factor = min(1.0, self.rate_factor + self.RATE_FACTOR_RECOVERY)
+
+    def on_rate_limited(self, retry_after: Optional[float], attempt: int) -> float:
+        """
+        Record a rate limit error: halve the rate, and pause every caller.
+        :param retry_after: the delay asked for by the API, or None to use a jittered exponential backoff.
+        :param attempt: the number of attempts of the failed request so far, starting at 1.
+        :return: the pause in seconds.
+        """
+        self.rate_factor = max(self.MIN_RATE_FACTOR, self.rate_factor / 2)
+        pause = retry_after + random.uniform(0, 0.1 * retry_after) if retry_after is not None else backoff_delay(attempt)
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        return pause
+
+
+class ThroughputStats:
+    """
+    Counts what a run of requests achieved, to help tune the concurrency and the rate limits.
+    """
+
+    def __init__(self):
+        """
+        Initialize the counters, and start the clock.
+        """
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.requests = 0
+        self.items = 0
+        self.tokens = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failed_items = 0
+
+    def finish(self) -> None:
+        """
+        Stop the clock.
+        """
+        self.finished_at = time.monotonic()
+
+    @property
+    def elapsed_seconds(self) -> float:
+        """
+        The seconds between the start of the run and its end, or now if it has not finished.
+        """
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def as_dict(self) -> dict:
+        """
+        Get the counters and the achieved rates as a dictionary, handy for logging.
+        :return: the values by name.
+        """
+        elapsed = max(self.elapsed_seconds, 1e-9)
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "requests": self.requests,
+            "items": self.items,
+            "tokens": self.tokens,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failed_items": self.failed_items,
+            "requests_per_minute": round(self.requests * 60 / elapsed, 1),
+            "tokens_per_minute": round(self.tokens * 60 / elapsed, 1),
+            "items_per_second": round(self.items / elapsed, 1),
+        }
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+import asyncio
+import threading
+import unittest
+
+import openai
+
+from experiments.helpers.chat_client import ChatClient
+from experiments.helpers.fake_openai_server import FakeOpenAIServer
+from experiments.helpers.openai_api_helpers import merge_completion_stream
+from experiments.helpers.test.test_context_window import WordCounter
+
+MESSAGES = [{"role": "user", "content": "hello there world"}]
+
+
+def make_client(**kwargs) -> ChatClient:
+    return ChatClient(token_counter=WordCounter(), **kwargs)
+
+
+def point_openai_at(test: unittest.TestCase, server: FakeOpenAIServer) -> None:
+    """
+    Point the openai library at the server for the duration of the test.
+    """
+    previous_api_base, previous_api_key = openai.api_base, openai.api_key
+    openai.api_base = server.url
+    openai.api_key = "sk-test"
+
+    def restore():
+        openai.api_base, openai.api_key = previous_api_base, previous_api_key
+
+    test.addCleanup(restore)
+
+
+class TestChatClient(unittest.TestCase):
+    """
+    A class that tests the ChatClient against a FakeOpenAIServer.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = FakeOpenAIServer(request_latency=0.0)
+        self.loop.run_until_complete(self.server.start())
+        point_openai_at(self, self.server)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    async def collect_async(self, client: ChatClient) -> list:
+        return [chunk async for chunk in client.astream(MESSAGES)]
+
+    def collect(self, client: ChatClient) -> list:
+        return self.loop.run_until_complete(self.collect_async(client))
+
+    def test_astream(self):
+        client = make_client()
+        chunks = self.collect(client)
+        self.loop.run_until_complete(client.close())
+        _, full_text = merge_completion_stream(chunks)
+        self.assertEqual("Echo: hello there world", full_text)
+        self.assertEqual(1, self.server.request_count)
+        self.assertEqual(1, client.stats.items)
+
+    def test_acomplete(self):
+        async def run():
+            async with make_client() as client:
+                return await client.acomplete(MESSAGES)
+
+        response = self.loop.run_until_complete(run())
+        self.assertEqual("Echo: hello there world", response["choices"][0]["message"]["content"])
+
+    def test_concurrency_is_limited(self):
+        self.server.chunk_latency = 0.01
+
+        async def run():
+            async with make_client(max_concurrency=2) as client:
+
+                async def read(index):
+                    return [chunk async for chunk in client.astream([{"role": "user", "content": f"job {index}"}])]
+
+                return await asyncio.gather(*[read(index) for index in range(6)])
+
+        results = self.loop.run_until_complete(run())
+        self.assertEqual([f"Echo: job {index}" for index in range(6)], [merge_completion_stream(chunks)[1] for chunks in results])
+        self.assertEqual(2, self.server.max_chat_in_flight)
+
+    def test_rate_limited_request_is_retried(self):
+        # The second request is rate limited, and sent again as the third
+        self.server.rate_limit_every = 2
+        self.server.retry_after = 0.01
+        client = make_client()
+        self.collect(client)
+        chunks = self.collect(client)
+        self.loop.run_until_complete(client.close())
+        self.assertEqual("Echo: hello there world", merge_completion_stream(chunks)[1])
+        self.assertEqual(3, self.server.request_count)
+        self.assertEqual(1, client.stats.rate_limited)
+
+    def test_first_chunk_timeout_is_retried_then_raised(self):
+        self.server.first_chunk_latency = 0.5
+
+        async def run():
+            async with make_client(chunk_timeout=0.05, max_attempts=2) as client:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await self.collect_async(client)
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(2, self.server.request_count)
+
+    def test_cancelling_a_stream_releases_its_slot(self):
+        self.server.chunk_latency = 0.5
+
+        async def run():
+            async with make_client(max_concurrency=1) as client:
+                first_chunk = asyncio.Event()
+
+                async def read():
+                    async for _ in client.astream(MESSAGES):
+                        first_chunk.set()
+
+                task = asyncio.create_task(read())
+                await first_chunk.wait()
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                self.server.chunk_latency = 0.0
+                return await asyncio.wait_for(self.collect_async(client), 1)
+
+        chunks = self.loop.run_until_complete(run())
+        self.assertEqual("Echo: hello there world", merge_completion_stream(chunks)[1])
+
+
+class TestBlockingChatClient(unittest.TestCase):
+    """
+    A class that tests the blocking methods of the ChatClient. They block the calling thread, so the
+    FakeOpenAIServer runs on an event loop of its own, in a background thread.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        self.server = FakeOpenAIServer(request_latency=0.0)
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result()
+        point_openai_at(self, self.server)
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+
+    def test_blocking_stream(self):
+        client = make_client(chunk_timeout=5)
+        try:
+            chunks = list(client.stream(MESSAGES))
+            response = client.complete(MESSAGES)
+        finally:
+            client.shutdown()
+        self.assertEqual("Echo: hello there world", merge_completion_stream(chunks)[1])
+        self.assertEqual("Echo: hello there world", response["choices"][0]["message"]["content"])
+        self.assertEqual(2, self.server.request_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
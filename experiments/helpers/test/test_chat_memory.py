@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import openai
+
+from experiments.helpers.chat_memory import ChatMemory, embed_texts
+from experiments.helpers.context_window import ContextWindow
+from experiments.helpers.test.test_context_window import WordCounter
+
+TOPICS = ["fibonacci", "weather", "python", "music"]
+
+
+def embed_topics(texts):
+    """
+    Embed each text as the count of each topic it mentions, plus a small constant, so no vector is zero.
+    """
+    return [[text.lower().count(topic) + 0.01 for topic in TOPICS] for text in texts]
+
+
+class TestChatMemory(unittest.TestCase):
+    """
+    A class that tests the ChatMemory.
+    """
+
+    def setUp(self):
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.append(list(texts))
+        return embed_topics(texts)
+
+    def test_rank_by_similarity(self):
+        """
+        Test that the messages are ranked by the similarity of their embeddings with the prompt's.
+        """
+        memory = ChatMemory(embed=self.embed, top_k=2)
+        texts = ["the weather is nice", "fibonacci numbers", "python code", "more fibonacci, in python"]
+        messages = [{"role": "user", "content": text} for text in texts]
+        self.assertEqual([1, 3], memory.rank("tell me about fibonacci", messages, 4))
+        # Messages past the limit are left out
+        ranked = memory.rank("fibonacci", messages, 3)
+        self.assertEqual(1, ranked[0])
+        self.assertNotIn(3, ranked)
+
+    def test_new_messages_are_embedded_with_the_prompt(self):
+        """
+        Test that the messages added since the last prompt are embedded with it, in a single call.
+        """
+        memory = ChatMemory(embed=self.embed)
+        messages = [{"role": "user", "content": "music"}, {"role": "assistant", "content": ""}]
+        memory.rank("weather", messages, 2)
+        memory.rank("python", messages, 2)
+        messages.append({"role": "user", "content": "jazz"})
+        memory.rank("rain", messages, 3)
+        self.assertEqual([["music", " ", "weather"], ["python"], ["jazz", "rain"]], self.embedded)
+
+    def test_store_saves_embeddings(self):
+        """
+        Test that a chat reloaded from the same store does not embed its messages again.
+        """
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        for _ in range(2):
+            memory = ChatMemory(store_dir=store_dir, embed=self.embed)
+            self.assertEqual([0], memory.rank("weather", [{"role": "user", "content": "music"}], 1))
+        self.assertEqual([["music", "weather"]], self.embedded)
+
+    def test_context_window_retrieves_relevant_messages(self):
+        """
+        Test that a ContextWindow with a ChatMemory sends the recent messages and the most similar older ones.
+        """
+        window = ContextWindow("gpt-4", budget=24, keep_recent=2, token_counter=WordCounter(), retriever=ChatMemory(embed=self.embed))
+        window.extend(
+            [
+                {"role": "user", "content": "what is the weather"},
+                {"role": "assistant", "content": "the fibonacci sequence"},
+                {"role": "user", "content": "some music"},
+                {"role": "user", "content": "hello"},
+                {"role": "assistant", "content": "hi"},
+            ]
+        )
+        # 9 for the prompt, 8 for the recent messages, and the budget fits only one older message
+        packed, tokens = window.pack("more fibonacci please")
+        self.assertEqual(23, tokens)
+        self.assertEqual(["the fibonacci sequence", "hello", "hi"], [message["content"] for message in packed])
+
+    def test_failed_embeddings_fall_back_to_word_overlap(self):
+        """
+        Test that the messages are ranked by their words when they cannot be embedded, and embedded with the next
+        prompt instead.
+        """
+        failures = [openai.error.APIError("The server had an error")]
+
+        def flaky_embed(texts):
+            if failures:
+                raise failures.pop()
+            return self.embed(texts)
+
+        memory = ChatMemory(embed=flaky_embed, top_k=1)
+        messages = [{"role": "user", "content": "the weather is nice"}, {"role": "user", "content": "fibonacci numbers"}]
+        self.assertEqual([1], memory.rank("fibonacci numbers please", messages, 2))
+        self.assertEqual([0], memory.rank("the weather", messages, 2))
+        self.assertEqual([["the weather is nice", "fibonacci numbers", "the weather"]], self.embedded)
+
+    @patch("experiments.gptlib.open_ai_embeddings.basic_embeddings.backoff_delay", return_value=0.0)
+    def test_embed_texts_retries_failed_requests(self, mock_backoff):
+        """
+        Test that embed_texts retries a rate limited request, and raises when the texts cannot be embedded.
+        """
+        calls = []
+
+        async def rate_limited_once(input, model):
+            calls.append(input)
+            if len(calls) == 1:
+                raise openai.error.RateLimitError("Rate limit reached", headers={"retry-after": "0.01"})
+            return {"data": [{"embedding": embed_topics([text])[0], "index": index} for index, text in enumerate(input)]}
+
+        with patch("openai.Embedding.acreate", side_effect=rate_limited_once):
+            self.assertEqual(embed_topics(["music", "weather"]), embed_texts(["music", "weather"]))
+        self.assertEqual(2, len(calls))
+
+        with patch("openai.Embedding.acreate", side_effect=openai.error.InvalidRequestError("Too many tokens", "input")):
+            with self.assertRaises(RuntimeError):
+                embed_texts(["music"])
+
+
+if __name__ == "__main__":
+    unittest.main()
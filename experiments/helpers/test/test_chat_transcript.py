@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from experiments.helpers import chat_transcript
+from experiments.helpers.chat_transcript import ChatTranscript
+from experiments.helpers.context_window import ContextWindow
+from experiments.helpers.test.test_context_window import WordCounter
+
+
+class RecentOnlyRetriever:
+    """
+    Finds no older message relevant, so only the most recent ones are sent.
+    """
+
+    def rank(self, prompt, messages, limit):
+        return []
+
+
+def message(index: int) -> dict:
+    return {"role": "user" if index % 2 == 0 else "assistant", "content": f"message {index}\nwith a new line"}
+
+
+class TestChatTranscript(unittest.TestCase):
+    """
+    A class that tests the ChatTranscript.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.path = os.path.join(self.temp_dir, "messages.jsonl")
+
+    def open_transcript(self, **kwargs) -> ChatTranscript:
+        transcript = ChatTranscript(self.path, **kwargs)
+        self.addCleanup(transcript.close)
+        return transcript
+
+    def test_append_and_read(self):
+        """
+        Test that messages are read back by index and by slice, and after reopening the transcript.
+        """
+        transcript = self.open_transcript()
+        transcript.append(message(0))
+        transcript.extend([message(1), message(2)])
+        self.assertEqual(3, len(transcript))
+        self.assertEqual(message(1), transcript[1])
+        self.assertEqual(message(2), transcript[-1])
+        self.assertEqual([message(1), message(2)], transcript[1:])
+        self.assertEqual([message(0), message(2)], transcript[::2])
+        self.assertEqual([], transcript[3:])
+        with self.assertRaises(IndexError):
+            transcript[3]
+        transcript.close()
+
+        reopened = self.open_transcript(fsync=True)
+        self.assertEqual([message(0), message(1), message(2)], list(reopened))
+        reopened.append(message(3))
+        self.assertEqual(4, len(reopened))
+        with open(self.path) as f:
+            self.assertEqual(4, len(f.readlines()))
+
+    def test_truncated_line_is_dropped(self):
+        """
+        Test that a last line cut short by a crash is truncated away.
+        """
+        transcript = self.open_transcript()
+        transcript.extend([message(0), message(1)])
+        transcript.close()
+        with open(self.path, "a") as f:
+            f.write('{"role": "user", "cont')
+
+        reopened = self.open_transcript()
+        self.assertEqual(2, len(reopened))
+        reopened.append(message(2))
+        self.assertEqual([message(0), message(1), message(2)], list(reopened))
+
+    def test_index_is_saved_and_caught_up(self):
+        """
+        Test that the offsets are loaded from the index saved on close, and the lines appended after it are scanned.
+        """
+        transcript = self.open_transcript()
+        transcript.extend([message(0), message(1)])
+        transcript.close()
+        self.assertTrue(os.path.exists(self.path + ".idx"))
+        # Appended by a process that crashed before saving the index
+        with open(self.path, "a") as f:
+            f.write(json.dumps(message(2)) + "\n")
+
+        with mock.patch.object(chat_transcript, "SCAN_CHUNK_SIZE", 7):
+            reopened = self.open_transcript()
+        self.assertEqual([message(0), message(1), message(2)], list(reopened))
+
+    def test_stale_index_is_ignored(self):
+        """
+        Test that an index saved for another file is not used.
+        """
+        transcript = self.open_transcript()
+        transcript.extend([message(0), message(1), message(2)])
+        transcript.close()
+        os.remove(self.path)
+        with open(self.path, "w") as f:
+            f.write(json.dumps(message(5)) + "\n")
+
+        self.assertEqual([message(5)], list(self.open_transcript()))
+
+    def test_snapshots(self):
+        """
+        Test that a snapshot of the whole chat is written every snapshot_every messages.
+        """
+        snapshot_path = os.path.join(self.temp_dir, "messages.json")
+        transcript = self.open_transcript(snapshot_path=snapshot_path, snapshot_every=4)
+        transcript.extend([message(index) for index in range(3)])
+        self.assertFalse(os.path.exists(snapshot_path))
+        transcript.extend([message(3), message(4)])
+        with open(snapshot_path) as f:
+            self.assertEqual([message(index) for index in range(5)], json.load(f))
+        transcript.append(message(5))
+        transcript.snapshot()
+        with open(snapshot_path) as f:
+            self.assertEqual([message(index) for index in range(6)], json.load(f))
+
+    def test_context_window_reads_only_what_it_sends(self):
+        """
+        Test that a ContextWindow over a transcript only counts the messages it considers, and saves the new ones.
+        """
+        transcript = self.open_transcript()
+        transcript.extend([message(index) for index in range(1000)])
+        window = ContextWindow(
+            "gpt-4", budget=100, token_counter=WordCounter(), retriever=RecentOnlyRetriever(), messages=transcript
+        )
+        packed, _ = window.pack("Hello")
+        self.assertEqual([message(index) for index in range(996, 1000)], packed)
+        # The prompt and the 4 most recent messages
+        self.assertEqual(5, window.token_counter.counted)
+
+        window.extend([message(1000), message(1001)])
+        transcript.close()
+        self.assertEqual(1002, len(self.open_transcript()))
+
+
+if __name__ == "__main__":
+    unittest.main()
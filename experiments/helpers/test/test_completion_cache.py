@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from experiments.gptlib.dictdict.lazy_dictdict import LazyDictDict
+from experiments.helpers.completion_cache import (
+    build_completion_record,
+    is_legacy_completion,
+    migrate_completions,
+    replay_completion,
+    upgrade_cached_completion,
+)
+from experiments.helpers.openai_api_helpers import StreamPrinter
+
+LEGACY_COMPLETION = [
+    {"id": "chatcmpl-1", "model": "gpt-4-0613", "created": 1690000000, "choices": [{"delta": {"role": "assistant"}, "finish_reason": None}]},
+    {"id": "chatcmpl-1", "model": "gpt-4-0613", "created": 1690000000, "choices": [{"delta": {"content": "Hello there"}, "finish_reason": None}]},
+    {"id": "chatcmpl-1", "model": "gpt-4-0613", "created": 1690000000, "choices": [{"delta": {}, "finish_reason": "stop"}]},
+]
+
+
+class TestCompletionCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def test_build_completion_record(self):
+        messages = [{"role": "user", "content": "Hello"}]
+        record = build_completion_record(LEGACY_COMPLETION, "Hello there", messages, "gpt-4")
+        self.assertEqual("Hello there", record["text"])
+        self.assertEqual("stop", record["finish_reason"])
+        self.assertEqual("gpt-4-0613", record["model"])
+        self.assertEqual("chatcmpl-1", record["id"])
+        self.assertEqual(1690000000, record["created"])
+        # 2 tokens for the role and content, 3 around the message, and 3 to prime the reply
+        self.assertEqual({"prompt_tokens": 8, "completion_tokens": 2, "total_tokens": 10}, record["usage"])
+
+    def test_upgrade_cached_completion(self):
+        cached = {"prompt": "Hello", "initial_messages": [], "completion": LEGACY_COMPLETION}
+        upgraded = upgrade_cached_completion(cached)
+        self.assertTrue(is_legacy_completion(cached["completion"]))
+        self.assertFalse(is_legacy_completion(upgraded["completion"]))
+        self.assertEqual("Hello there", upgraded["completion"]["text"])
+        self.assertEqual("Hello", upgraded["prompt"])
+        self.assertIs(upgraded, upgrade_cached_completion(upgraded))
+
+    def test_replay_completion(self):
+        for simulate_stream in [False, True]:
+            out = io.StringIO()
+            text = replay_completion({"text": "Hello there, world"}, simulate_stream, 1000, StreamPrinter(out=out))
+            self.assertEqual("Hello there, world", text)
+            self.assertIn("Hello there, world", out.getvalue())
+
+    def test_migrate_completions(self):
+        log_path = os.path.join(self.temp_dir, "all_completions.jsonl")
+        store = LazyDictDict(log_path)
+        legacy_key = {"prompt": "Hello", "initial_messages": []}
+        store[legacy_key] = {"prompt": "Hello", "initial_messages": [], "completion": LEGACY_COMPLETION}
+        record_key = {"prompt": "Bye", "initial_messages": []}
+        store[record_key] = {"prompt": "Bye", "initial_messages": [], "completion": {"text": "Bye"}}
+        legacy_size = os.path.getsize(log_path)
+
+        self.assertEqual(1, migrate_completions(store))
+        self.assertEqual("Hello there", store[legacy_key]["completion"]["text"])
+        self.assertEqual({"text": "Bye"}, store[record_key]["completion"])
+        self.assertEqual(0, store.dead_record_count)
+        self.assertEqual(0, migrate_completions(store))
+        store.close()
+
+        self.assertLess(os.path.getsize(log_path), legacy_size)
+        with LazyDictDict(log_path) as reopened:
+            self.assertEqual("Hello there", reopened[legacy_key]["completion"]["text"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import threading
+import unittest
+
+from experiments.helpers.context_window import SUMMARY_PREFIX, ContextWindow
+
+
+class WordCounter:
+    """
+    Counts a token per word, and 3 tokens around each message, so the tests do not depend on an encoding.
+    """
+
+    def __init__(self):
+        self.counted = 0
+
+    def count_message_list(self, messages, model):
+        self.counted += len(messages)
+        return [len(message["content"].split()) + 3 for message in messages]
+
+    def count_messages(self, messages, model):
+        return sum(self.count_message_list(messages, model))
+
+
+def message(role: str, words: int, topic: str = "filler") -> dict:
+    return {"role": role, "content": " ".join([topic] * words)}
+
+
+class TestContextWindow(unittest.TestCase):
+    """
+    A class that tests the ContextWindow.
+    """
+
+    def make_window(self, **kwargs) -> ContextWindow:
+        kwargs.setdefault("token_counter", WordCounter())
+        return ContextWindow("gpt-4", **kwargs)
+
+    def test_counts_each_message_once(self):
+        """
+        Test that the running total grows as messages are added, and that messages are not counted again by pack.
+        """
+        window = self.make_window()
+        window.extend([message("user", 7), message("assistant", 17)])
+        self.assertEqual(30, window.total_tokens)
+        self.assertEqual(2, window.token_counter.counted)
+        window.pack("Hello")
+        window.pack("Hello again")
+        self.assertEqual(4, window.token_counter.counted)
+
+    def test_default_budget_reserves_the_reply(self):
+        """
+        Test that the default budget leaves room for the reply in the context window.
+        """
+        self.assertEqual(8192 - 1000, self.make_window().budget)
+        self.assertEqual(8192 - 2000, self.make_window(reply_tokens=2000).budget)
+        self.assertEqual(500, self.make_window(budget=500).budget)
+
+    def test_pack_fits_in_budget(self):
+        """
+        Test that pack sends everything that fits, in order, and counts the prompt and the reply priming.
+        """
+        window = self.make_window(budget=1000)
+        messages = [message("user", 7), message("assistant", 17)]
+        window.extend(messages)
+        packed, tokens = window.pack("Hello")
+        self.assertEqual(messages, packed)
+        # 30 for the messages, 4 for the prompt, 3 to prime the reply
+        self.assertEqual(37, tokens)
+
+    def test_pack_keeps_recent_and_relevant_messages(self):
+        """
+        Test that pack keeps the most recent messages, then the older ones that share words with the prompt.
+        """
+        window = self.make_window(budget=75, keep_recent=2)
+        relevant = message("user", 17, "fibonacci")
+        window.extend([message("user", 17), relevant, message("assistant", 17)])
+        window.extend([message("user", 17), message("assistant", 17)])
+        recent = window.messages[-2:]
+        packed, tokens = window.pack("Tell me about fibonacci")
+        self.assertEqual([relevant] + recent, packed)
+        # 10 for the prompt, 20 for each message, the budget fits only one older message
+        self.assertEqual(70, tokens)
+
+    def test_pack_always_sends_the_last_message(self):
+        """
+        Test that the last message is sent even when it alone goes over the budget.
+        """
+        window = self.make_window(budget=10)
+        window.extend([message("user", 5), message("assistant", 50)])
+        packed, tokens = window.pack("Hello")
+        self.assertEqual(window.messages[-1:], packed)
+        self.assertGreater(tokens, 10)
+
+    def test_summary_is_sent_first(self):
+        """
+        Test that the summary is sent before the messages, and counted.
+        """
+        window = self.make_window(budget=1000)
+        window.extend([message("user", 7), message("assistant", 7)])
+        window.set_summary("We said hello", 1)
+        packed, tokens = window.pack("Hello")
+        self.assertEqual({"role": "system", "content": SUMMARY_PREFIX + "We said hello"}, packed[0])
+        self.assertEqual({"summary": "We said hello", "covers": 1}, window.summary_record())
+        self.assertEqual(20 + (len(SUMMARY_PREFIX.split()) + 3 + 3) + 4 + 3, tokens)
+
+    def test_summarize_in_background(self):
+        """
+        Test that a summary is started once the unsummarized messages grow past the threshold, and only then.
+        """
+        summarizer_calls = []
+        release_summarizer = threading.Event()
+
+        def summarizer(messages, previous_summary):
+            summarizer_calls.append((list(messages), previous_summary))
+            release_summarizer.wait(timeout=5)
+            return "summary"
+
+        window = self.make_window(budget=100, keep_recent=2, summarize_at=0.5, summarizer=summarizer)
+        window.extend([message("user", 17), message("assistant", 17)])
+        self.assertFalse(window.summarize_in_background())
+        window.extend([message("user", 17), message("assistant", 17)])
+        # The 2 oldest messages take 40 tokens, under half the budget
+        self.assertFalse(window.summarize_in_background())
+        window.extend([message("user", 17)])
+        self.assertTrue(window.summarize_in_background())
+        self.assertTrue(window.is_summarizing)
+        self.assertFalse(window.summarize_in_background())
+        # The chat goes on while the summary is written
+        window.pack("Hello")
+        release_summarizer.set()
+        window.wait_for_summary(timeout=5)
+
+        self.assertEqual([(window.messages[:3], None)], summarizer_calls)
+        self.assertEqual({"summary": "summary", "covers": 3}, window.summary_record())
+        self.assertFalse(window.needs_summary())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+import unittest
+
+from experiments.helpers.model_registry import MODELS, ModelInfo, estimate_cost_usd, get_model_info, register_model
+
+
+class TestModelRegistry(unittest.TestCase):
+    """
+    A class that tests the model_registry module functions.
+    """
+
+    def tearDown(self):
+        MODELS.pop("test-model", None)
+
+    def test_get_model_info(self):
+        """
+        Test that models are found by name, and dated snapshots by the longest name they start with.
+        """
+        self.assertEqual(8192, get_model_info("gpt-4").context_window)
+        self.assertEqual(8192, get_model_info("gpt-4-0613").context_window)
+        self.assertEqual(32768, get_model_info("gpt-4-32k-0613").context_window)
+        self.assertEqual("cl100k_base", get_model_info("text-embedding-ada-002").encoding_name)
+        with self.assertRaises(KeyError):
+            get_model_info("gpt-4o")
+
+    def test_register_model(self):
+        """
+        Test that a registered model can be looked up.
+        """
+        register_model(ModelInfo("test-model", "p50k_base", 2048, 0.02, 0.02, tokens_per_message=4))
+        self.assertEqual(4, get_model_info("test-model-001").tokens_per_message)
+
+    def test_estimate_cost_usd(self):
+        """
+        Test that prompt and completion tokens are priced separately.
+        """
+        self.assertAlmostEqual(0.03, estimate_cost_usd("gpt-4", 1000))
+        self.assertAlmostEqual(0.03 + 0.06, estimate_cost_usd("gpt-4", 1000, 1000))
+        self.assertAlmostEqual(0.12, estimate_cost_usd("gpt-4-32k", 0, 1000))
+
+
+if __name__ == "__main__":
+    unittest.main()
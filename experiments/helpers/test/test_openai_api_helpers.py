@@ -4,16 +4,31 @@ Auto-comment-and-document
 """
 # test_openai_api_helpers.py
 
+import copy
+import io
 import unittest
 from unittest.mock import patch
 
-from experiments.helpers.openai_api_helpers import count_messages_tokens, merge_completion_stream, backoff_completion
+from experiments.helpers.openai_api_helpers import (
+    StreamPrinter,
+    backoff_completion,
+    count_messages_tokens,
+    merge_completion_stream,
+)
 
 
 class TestOpenaiApiHelpers(unittest.TestCase):
     def test_count_messages_tokens(self):
         messages = [{"content": "Hello, how are you?"}, {"content": "I'm fine, thank you!"}]
-        expected_token_count = 13
+        # 13 tokens of content, 3 around each message, and 3 to prime the reply
+        expected_token_count = 22
+        actual_token_count = count_messages_tokens(messages)
+        self.assertEqual(expected_token_count, actual_token_count)
+
+    def test_count_messages_tokens_roles_and_names(self):
+        messages = [{"role": "system", "content": "Hello"}, {"role": "user", "name": "bob", "content": "Hello"}]
+        # Each role, name and content is one token, plus 3 around each message, 1 for the name, and 3 for the reply
+        expected_token_count = 2 + 3 + 3 + 3 + 1 + 3
         actual_token_count = count_messages_tokens(messages)
         self.assertEqual(expected_token_count, actual_token_count)
 
@@ -46,6 +61,39 @@ class TestOpenaiApiHelpers(unittest.TestCase):
         self.assertEqual(expected_merged_completion, actual_merged_completion)
         self.assertEqual(expected_full_text, actual_full_text)
 
+    def test_merge_completion_stream_keeps_other_chunks(self):
+        completion = [
+            {"id": "1", "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]},
+            {"id": "1", "choices": [{"index": 0, "delta": {"content": "Hello"}, "finish_reason": None}]},
+            {"id": "1", "choices": [{"index": 0, "delta": {"content": " there"}, "finish_reason": None}]},
+            {"id": "1", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+        ]
+        original_completion = copy.deepcopy(completion)
+
+        expected_merged_completion = [
+            {"id": "1", "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]},
+            {"id": "1", "choices": [{"index": 0, "delta": {"content": "Hello there"}, "finish_reason": None}]},
+            {"id": "1", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+        ]
+        actual_merged_completion, actual_full_text = merge_completion_stream(completion)
+        self.assertEqual(expected_merged_completion, actual_merged_completion)
+        self.assertEqual("Hello there", actual_full_text)
+        # The chunks of the stream are left as they were
+        self.assertEqual(original_completion, completion)
+        # The merged record replays into the same text
+        self.assertEqual(expected_merged_completion, merge_completion_stream(actual_merged_completion)[0])
+
+    def test_stream_printer_batches_writes(self):
+        writes = []
+        out = io.StringIO()
+        out.write = writes.append
+        printer = StreamPrinter(out=out, flush_interval=3600, flush_chars=10)
+        merge_completion_stream([{"choices": [{"delta": {"content": "abcd"}}]}] * 5, printer=printer)
+        # The first 12 characters go over the 10 character threshold, the last 8 are printed at the end of the stream
+        self.assertEqual(2, len(writes))
+        self.assertIn("abcd" * 3, writes[0])
+        self.assertIn("abcd" * 2, writes[1])
+
     @patch("openai.ChatCompletion.create")
     def test_backoff_completion(self, mocked_completion_create):
         completion_response = "Completion response"
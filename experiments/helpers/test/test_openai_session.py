@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+import asyncio
+import unittest
+
+import openai
+
+from experiments.helpers.fake_openai_server import FakeOpenAIServer
+from experiments.helpers.openai_session import OpenAISession, RequestMetrics
+
+
+class TestOpenAISession(unittest.TestCase):
+    """
+    A class that tests the OpenAISession against a FakeOpenAIServer.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = FakeOpenAIServer(dimensions=4, request_latency=0.0)
+        self.loop.run_until_complete(self.server.start())
+        self.previous_api_base = openai.api_base
+        openai.api_base = self.server.url
+
+    def tearDown(self):
+        openai.api_base = self.previous_api_base
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    def test_requests_reuse_connections_and_report_metrics(self):
+        metrics = RequestMetrics()
+
+        async def run():
+            async with OpenAISession(limit=2, on_request=metrics) as session:
+                with session.activate():
+                    for text in ["apple", "banana", "cherry", "date"]:
+                        await openai.Embedding.acreate(input=text, model="text-embedding-ada-002", api_key="sk-test")
+                return session.session
+
+        session = self.loop.run_until_complete(run())
+        self.assertTrue(session.closed)
+        self.assertEqual(4, self.server.request_count)
+        self.assertEqual(1, self.server.connection_count)
+        summary = metrics.summary()["POST /v1/embeddings"]
+        self.assertEqual(4, summary["count"])
+        self.assertEqual(0, summary["errors"])
+
+    def test_errors_are_reported(self):
+        self.server.rate_limit_every = 1
+        metrics = RequestMetrics()
+
+        async def run():
+            async with OpenAISession(on_request=metrics) as session:
+                with session.activate():
+                    with self.assertRaises(openai.error.RateLimitError):
+                        await openai.Embedding.acreate(input="apple", model="text-embedding-ada-002", api_key="sk-test")
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(1, metrics.summary()["POST /v1/embeddings"]["errors"])
+
+    def test_activate_restores_previous_session(self):
+        async def run():
+            async with OpenAISession() as session:
+                with session.activate():
+                    self.assertIs(session.session, openai.aiosession.get())
+                self.assertIsNone(openai.aiosession.get(None))
+
+        self.loop.run_until_complete(run())
+
+    def test_session_must_be_open(self):
+        with self.assertRaises(RuntimeError):
+            OpenAISession().session
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from experiments.helpers.rate_limiter import RateLimiter, ThroughputStats, TokenBucket, backoff_delay, get_retry_after
+
+
+class TestRateLimiter(unittest.TestCase):
+    """
+    A class that tests the rate_limiter module.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_backoff_delay_grows_and_is_capped(self):
+        with patch("random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual(1.0, backoff_delay(1))
+            self.assertEqual(8.0, backoff_delay(4))
+            self.assertEqual(60.0, backoff_delay(20))
+
+    def test_get_retry_after(self):
+        class FakeError(Exception):
+            headers = {"retry-after": "2.5"}
+
+        self.assertEqual(2.5, get_retry_after(FakeError()))
+        self.assertIsNone(get_retry_after(ValueError()))
+
+    def test_token_bucket_wait_time(self):
+        bucket = TokenBucket(per_minute=60)
+        now = time.monotonic()
+        self.assertEqual(0.0, bucket.wait_time(60, now))
+        bucket.consume(60)
+        self.assertAlmostEqual(10.0, bucket.wait_time(10, now), places=1)
+        # Half the rate takes twice as long, and requests larger than the bucket wait for a full bucket
+        self.assertAlmostEqual(20.0, bucket.wait_time(10, now, rate_factor=0.5), places=1)
+        self.assertAlmostEqual(60.0, bucket.wait_time(1000, now), places=1)
+
+    def test_acquire_limits_tokens_per_minute(self):
+        limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=600)
+        start = time.monotonic()
+        self.loop.run_until_complete(limiter.acquire(600))
+        self.assertLess(time.monotonic() - start, 0.05)
+        # 600 tokens per minute refill 10 tokens per second
+        self.loop.run_until_complete(limiter.acquire(2))
+        self.assertGreater(time.monotonic() - start, 0.15)
+
+    def test_rate_limited_pauses_and_recovers(self):
+        limiter = RateLimiter()
+        pause = limiter.on_rate_limited(retry_after=0.2, attempt=1)
+        self.assertGreaterEqual(pause, 0.2)
+        self.assertEqual(0.5, limiter.rate_factor)
+
+        start = time.monotonic()
+        self.loop.run_until_complete(limiter.acquire(1))
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+        for _ in range(100):
+            limiter.on_success()
+        self.assertEqual(1.0, limiter.rate_factor)
+
+    def test_throughput_stats(self):
+        stats = ThroughputStats()
+        stats.requests = 2
+        stats.items = 10
+        stats.finish()
+        summary = stats.as_dict()
+        self.assertEqual(10, summary["items"])
+        self.assertGreater(summary["requests_per_minute"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
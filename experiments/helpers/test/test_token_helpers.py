@@ -1,10 +1,20 @@
 #!/usr/bin/env python
+import subprocess
 import sys
 import unittest
 from io import StringIO
 from unittest.mock import patch
 
-from experiments.helpers.token_helpers import count_tokens, tokenize, print_pricing_message
+from experiments.helpers.token_helpers import (
+    MessagesTokenCounter,
+    TokenCounter,
+    count_tokens,
+    count_tokens_many,
+    get_tokenizer,
+    print_pricing_message,
+    tokenize,
+    tokenize_many,
+)
 
 
 class TestTokenHelpers(unittest.TestCase):
@@ -40,6 +50,23 @@ class TestTokenHelpers(unittest.TestCase):
         # Test string with multiple tokens
         self.assertEqual([9906, 11, 4435, 0], tokenize("Hello, World!"))
 
+    def test_tokenize_many(self):
+        """
+        Test that the batch functions agree with the one text functions.
+        """
+        texts = ["", "Hello", "Hello, World!", "Hello"]
+        self.assertEqual([tokenize(text) for text in texts], tokenize_many(texts))
+        self.assertEqual([0, 1, 4, 1], count_tokens_many(texts))
+
+    def test_tokenizer_is_loaded_on_first_use(self):
+        """
+        Test that importing the module does not load tiktoken, and that the tokenizer is only loaded once.
+        """
+        code = "import sys, experiments.helpers.token_helpers; print('tiktoken' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual("False", result.stdout.strip())
+        self.assertIs(get_tokenizer(), get_tokenizer())
+
     @patch("builtins.print")
     def test_print_pricing_message(self, mock_print):
         """
@@ -53,6 +80,70 @@ class TestTokenHelpers(unittest.TestCase):
         # Ensure that the output is correct
         mock_print.assert_called_once_with("\x1b[38;2;255;255;0mToken count: 1000, price at this context: $0.03 USD\x1b[49m\x1b[39m")
 
+        # Test that the price is the one of the model
+        mock_print.reset_mock()
+        print_pricing_message(test_token_count, "gpt-4-32k")
+        mock_print.assert_called_once_with("\x1b[38;2;255;255;0mToken count: 1000, price at this context: $0.06 USD\x1b[49m\x1b[39m")
+
+
+class CountingEncoding:
+    """
+    Wraps the tokenizer, recording the texts it encodes.
+    """
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text):
+        self.encoded.append(text)
+        return get_tokenizer().encode(text)
+
+    def encode_batch(self, texts, num_threads=1):
+        self.encoded.extend(texts)
+        return get_tokenizer().encode_batch(texts, num_threads=num_threads)
+
+
+class TestTokenCounter(unittest.TestCase):
+    """
+    A class that tests the cached TokenCounter, and the incremental MessagesTokenCounter.
+    """
+
+    def setUp(self):
+        self.encoding = CountingEncoding()
+        self.counter = TokenCounter(self.encoding, max_entries=3)
+
+    def test_counts_are_cached(self):
+        self.assertEqual([4, 1, 4], self.counter.count_many(["Hello, World!", "Hello", "Hello, World!"]))
+        self.assertEqual(4, self.counter.count("Hello, World!"))
+        self.assertEqual(["Hello, World!", "Hello"], self.encoding.encoded)
+        self.assertEqual(2, self.counter.hits)
+        self.assertEqual(2, self.counter.misses)
+
+    def test_cache_is_bounded(self):
+        self.counter.count_many(["a", "b", "c"])
+        self.counter.count("a")
+        self.counter.count("d")
+        self.counter.count_many(["a", "c", "d"])
+        self.assertEqual(["a", "b", "c", "d"], self.encoding.encoded)
+        self.counter.count("b")
+        self.assertEqual(["a", "b", "c", "d", "b"], self.encoding.encoded)
+
+    def test_messages_are_counted_once(self):
+        messages_counter = MessagesTokenCounter(self.counter)
+        messages = [{"content": "Hello, how are you?"}, {"content": "I'm fine, thank you!"}]
+        # 13 tokens of content, 3 around each message, and 3 to prime the reply
+        self.assertEqual(22, messages_counter.count(messages))
+        self.assertEqual(22, self.counter.count_messages(messages))
+        messages = messages + [{"content": "Hello"}]
+        self.assertEqual(26, messages_counter.count(messages))
+        self.assertEqual(3, len(self.encoding.encoded))
+
+        # Truncating the history, or editing a message in place, is counted correctly
+        self.assertEqual(7, messages_counter.count(messages[2:]))
+        messages[2]["content"] = "Hello, World!"
+        self.assertEqual(10, messages_counter.count(messages[2:]))
+        self.assertEqual(0, messages_counter.count([]))
+
 
 if __name__ == "__main__":
     unittest.main()
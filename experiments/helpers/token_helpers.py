@@ -1,41 +1,291 @@
 #!/usr/bin/env python
-from typing import List
-
-import tiktoken
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Sequence
 
 from experiments.constants import MODEL_NAME
+from experiments.helpers.model_registry import estimate_cost_usd, get_model_info
 from experiments.helpers.terminal_color_helper import BG_DEFAULT_COLOR, FG_DEFAULT_COLOR, fg
 
-# Initialize the tokenizer using the specified model name.
-TOKENIZER = tiktoken.encoding_for_model(MODEL_NAME)
-# Define the per-token prices in USD for each model.
-PRICES_USD = {
-    "gpt-4": 0.03,
-}
+if TYPE_CHECKING:
+    import tiktoken
+
+# The number of token counts to remember, a count costs about 100 bytes.
+DEFAULT_MAX_CACHED_COUNTS = 100_000
+# The number of threads tiktoken encodes a batch of texts with.
+DEFAULT_NUM_THREADS = 8
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str) -> "tiktoken.Encoding":
+    """
+    Get a tiktoken encoding, loading it once. It is loaded on first use rather than on import, since loading it
+    reads, and the first time downloads, its BPE ranks.
+    :param encoding_name: The name of the encoding, like cl100k_base.
+    :return: The tiktoken encoding.
+    """
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def get_tokenizer(model: str = MODEL_NAME) -> "tiktoken.Encoding":
+    """
+    Get the tokenizer of a model, models that share an encoding share their tokenizer.
+    :param model: The name of the model.
+    :return: The tiktoken encoding.
+    """
+    return get_encoding(get_model_info(model).encoding_name)
+
+
+def __getattr__(name: str):
+    """
+    Keep TOKENIZER importable from this module, without loading it on import.
+    """
+    if name == "TOKENIZER":
+        return get_tokenizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class TokenCounter:
+    """
+    Counts tokens, remembering the count of each text by the hash of its content, in a bounded LRU cache.
+    Lists of texts that are not cached yet are encoded in one batch, on several threads.
+    """
+
+    def __init__(
+        self,
+        encoding: Optional["tiktoken.Encoding"] = None,
+        max_entries: int = DEFAULT_MAX_CACHED_COUNTS,
+        num_threads: int = DEFAULT_NUM_THREADS,
+        encoding_name: Optional[str] = None,
+    ):
+        """
+        Initialize the TokenCounter.
+        :param encoding: The tiktoken encoding to count with, by default the one named encoding_name.
+        :param max_entries: The number of token counts to remember.
+        :param num_threads: The number of threads to encode a batch of texts with.
+        :param encoding_name: The name of the encoding to load on first use, the one of MODEL_NAME by default.
+        """
+        self._encoding = encoding
+        self.encoding_name = encoding_name if encoding_name is not None else get_model_info(MODEL_NAME).encoding_name
+        self.max_entries = max_entries
+        self.num_threads = num_threads
+        self.hits = 0
+        self.misses = 0
+        # content hash -> token count, the least recently used first
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self) -> "tiktoken.Encoding":
+        """
+        The tiktoken encoding, loaded on first use.
+        """
+        if self._encoding is None:
+            self._encoding = get_encoding(self.encoding_name)
+        return self._encoding
+
+    @staticmethod
+    def _content_hash(text: str) -> bytes:
+        """
+        Hash the text, so the cache does not keep the texts themselves alive.
+        :param text: The text.
+        :return: The digest of the text.
+        """
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def count(self, text: str) -> int:
+        """
+        Count the number of tokens in the given text.
+        :param text: The input text to tokenize.
+        :return: The number of tokens in the text.
+        """
+        return self.count_many([text])[0]
+
+    def count_many(self, texts: Sequence[str]) -> List[int]:
+        """
+        Count the number of tokens in each of the given texts, encoding the ones not cached yet in one batch.
+        :param texts: The input texts to tokenize.
+        :return: The number of tokens in each text.
+        """
+        hashes = [self._content_hash(text) for text in texts]
+        counts = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for index, content_hash in enumerate(hashes):
+                count = self._counts.get(content_hash)
+                if count is None:
+                    missing.setdefault(content_hash, []).append(index)
+                else:
+                    self._counts.move_to_end(content_hash)
+                    counts[index] = count
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        if not missing:
+            return counts
+        missing_texts = [texts[indexes[0]] for indexes in missing.values()]
+        if len(missing_texts) == 1:
+            encoded = [self.encoding.encode(missing_texts[0])]
+        else:
+            encoded = self.encoding.encode_batch(missing_texts, num_threads=self.num_threads)
+        with self._lock:
+            for (content_hash, indexes), tokens in zip(missing.items(), encoded):
+                for index in indexes:
+                    counts[index] = len(tokens)
+                self._counts[content_hash] = len(tokens)
+                self._counts.move_to_end(content_hash)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return counts
+
+    def count_message_list(self, messages: Sequence[dict], model: str = MODEL_NAME) -> List[int]:
+        """
+        Count the number of tokens each chat message is billed for, including the tokens the chat format wraps it in.
+        :param messages: A list of messages, with a role, a content, and optionally a name.
+        :param model: The name of the model, for its per-message overhead.
+        :return: The number of tokens of each message.
+        """
+        info = get_model_info(model)
+        values = [value for message in messages for value in message.values()]
+        value_counts = iter(self.count_many(values))
+        counts = []
+        for message in messages:
+            count = info.tokens_per_message + sum(next(value_counts) for _ in message)
+            if "name" in message:
+                count += info.tokens_per_name
+            counts.append(count)
+        return counts
 
+    def count_messages(self, messages: Sequence[dict], model: str = MODEL_NAME) -> int:
+        """
+        Count the number of prompt tokens a list of chat messages is billed for.
+        :param messages: A list of messages, with a role, a content, and optionally a name.
+        :param model: The name of the model, for its per-message overhead.
+        :return: The total number of tokens, 0 for no messages.
+        """
+        if not messages:
+            return 0
+        return sum(self.count_message_list(messages, model)) + get_model_info(model).tokens_per_reply
 
-def count_tokens(text: str) -> int:
+
+class MessagesTokenCounter:
+    """
+    Counts the tokens of a conversation that grows by a few messages at a time, like the history of a chat.
+    The running total of the messages counted last time is kept, so only the messages after the longest common
+    prefix with the previous call are counted, the rest of the conversation is compared by identity.
+    The count includes the tokens the chat format adds around each message, like TokenCounter.count_messages.
+    """
+
+    def __init__(self, token_counter: Optional[TokenCounter] = None, model: str = MODEL_NAME):
+        """
+        Initialize the MessagesTokenCounter.
+        :param token_counter: The TokenCounter that counts the new messages, the shared one of the model by default.
+        :param model: The name of the model.
+        """
+        self.model = model
+        self.token_counter = token_counter if token_counter is not None else get_token_counter(model)
+        # (message, its items) of the messages counted last time, and the running total after each of them
+        self._messages = []
+        self._totals = []
+        self._lock = threading.Lock()
+
+    def count(self, messages: Sequence[dict]) -> int:
+        """
+        Count the number of prompt tokens a list of chat messages is billed for.
+        :param messages: A list of messages.
+        :return: The total number of tokens, 0 for no messages.
+        """
+        with self._lock:
+            common = 0
+            for (seen_message, seen_items), message in zip(self._messages, messages):
+                # A message edited in place has the same identity, but not the same items
+                if message is not seen_message or tuple(message.items()) != seen_items:
+                    break
+                common += 1
+            del self._messages[common:]
+            del self._totals[common:]
+            total = self._totals[-1] if self._totals else 0
+            new_messages = messages[common:]
+            for message, count in zip(new_messages, self.token_counter.count_message_list(new_messages, self.model)):
+                total += count
+                self._messages.append((message, tuple(message.items())))
+                self._totals.append(total)
+            if not self._totals:
+                return 0
+            return total + get_model_info(self.model).tokens_per_reply
+
+
+@lru_cache(maxsize=None)
+def _get_encoding_token_counter(encoding_name: str) -> TokenCounter:
     """
-    Count the number of tokens in the given text.
+    Get the shared TokenCounter of an encoding.
+    :param encoding_name: The name of the encoding.
+    :return: The TokenCounter.
+    """
+    return TokenCounter(encoding_name=encoding_name)
+
+
+def get_token_counter(model: str = MODEL_NAME) -> TokenCounter:
+    """
+    Get the shared TokenCounter of a model, models that share an encoding share their cached counts.
+    :param model: The name of the model.
+    :return: The TokenCounter.
+    """
+    return _get_encoding_token_counter(get_model_info(model).encoding_name)
+
+
+TOKEN_COUNTER = get_token_counter(MODEL_NAME)
+
+
+def count_tokens(text: str, model: str = MODEL_NAME) -> int:
+    """
+    Count the number of tokens in the given text, the counts are cached by the model's TokenCounter.
     :param text: The input text to tokenize.
+    :param model: The name of the model.
     :return: The number of tokens in the text.
     """
-    return len(TOKENIZER.encode(text))
+    return get_token_counter(model).count(text)
+
+
+def count_tokens_many(texts: Sequence[str], model: str = MODEL_NAME) -> List[int]:
+    """
+    Count the number of tokens in each of the given texts, encoding the ones not cached yet in one threaded batch.
+    :param texts: The input texts to tokenize.
+    :param model: The name of the model.
+    :return: The number of tokens in each text.
+    """
+    return get_token_counter(model).count_many(texts)
 
 
-def tokenize(text: str) -> List[int]:
+def tokenize(text: str, model: str = MODEL_NAME) -> List[int]:
     """
     Encode the given text to a list of integers representing tokens.
     :param text: The input text to tokenize.
+    :param model: The name of the model.
     :return: A list of integers representing tokens.
     """
-    return TOKENIZER.encode(text)
+    return get_tokenizer(model).encode(text)
+
+
+def tokenize_many(texts: Sequence[str], num_threads: int = DEFAULT_NUM_THREADS, model: str = MODEL_NAME) -> List[List[int]]:
+    """
+    Encode each of the given texts to a list of tokens, in one batch on several threads.
+    :param texts: The input texts to tokenize.
+    :param num_threads: The number of threads to encode with.
+    :param model: The name of the model.
+    :return: A list of tokens for each text.
+    """
+    return get_tokenizer(model).encode_batch(list(texts), num_threads=num_threads)
 
 
-def print_pricing_message(token_count: int):
+def print_pricing_message(token_count: int, model: str = MODEL_NAME):
     """
-    Print the cost of generating text with the given token count.
-    :param token_count: The number of tokens for which to calculate the cost.
+    Print the cost of sending a prompt with the given token count to the model.
+    :param token_count: The number of prompt tokens for which to calculate the cost.
+    :param model: The name of the model.
     """
-    # Calculate the cost in USD and print a formatted message.
-    print(fg(1, 1, 0) + f"Token count: {token_count}, price at this context: ${(token_count / 1000) * 0.03:0.2f} USD" + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
+    price_usd = estimate_cost_usd(model, token_count)
+    print(fg(1, 1, 0) + f"Token count: {token_count}, price at this context: ${price_usd:0.2f} USD" + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
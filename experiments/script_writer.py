@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 import argparse
-from os.path import basename, dirname, join
+import atexit
+from os import makedirs
+from os.path import basename, dirname
 from typing import Tuple
 
 import re
@@ -8,14 +10,15 @@ import re
 import openai
 
 from experiments.config import OPEN_AI_KEY
-from experiments.constants import MODEL_NAME, SCRIPT_WRITER_DIR
-
-ALL_COMPLETIONS_PATH = join(SCRIPT_WRITER_DIR, "all_completions.json")
-from experiments.gptlib.dictdict.dictdict import DictDict
+from experiments.constants import ALL_COMPLETIONS_LOG_PATH, ALL_COMPLETIONS_PATH, MODEL_NAME, SCRIPT_WRITER_DIR
+from experiments.gptlib.dictdict.lazy_dictdict import LazyDictDict
+from experiments.gptlib.dictdict.log_dictdict import open_migrated
 from experiments.gptlib.whitespace_trimmer.remove_whitespace import remove_leading_whitespace
+from experiments.helpers.chat_client import get_chat_client
+from experiments.helpers.completion_cache import build_completion_record, replay_completion, upgrade_cached_completion
 from experiments.helpers.file_helpers import load_text_asset, generate_run_dir, is_jupyter_script, save_notebook, save_python_script
 from experiments.helpers.io_helpers import multiline_input
-from experiments.helpers.openai_api_helpers import backoff_completion, merge_completion_stream
+from experiments.helpers.openai_api_helpers import merge_completion_stream
 from experiments.helpers.terminal_color_helper import fg, BG_DEFAULT_COLOR, FG_DEFAULT_COLOR
 
 openai.api_key = OPEN_AI_KEY
@@ -106,44 +109,52 @@ def get_user_prompt() -> Tuple[str, str]:
     return user_prompt, remove_leading_whitespace(full_prompt)
 
 
-known_completions = DictDict()
+known_completions = None
 
 
 def load_previous_completions():
     global known_completions
-    try:
-        known_completions = DictDict.load(ALL_COMPLETIONS_PATH)
-    except FileNotFoundError:
+    makedirs(SCRIPT_WRITER_DIR, exist_ok=True)
+    # The completions used to be saved whole to ALL_COMPLETIONS_PATH, they are imported into the log the first time.
+    # Only the index of the log is loaded, each completion is read from the log when it is first looked up.
+    known_completions = open_migrated(ALL_COMPLETIONS_LOG_PATH, ALL_COMPLETIONS_PATH, store_class=LazyDictDict)
+    # Closing saves the index, so the next run loads it instead of scanning the whole log
+    atexit.register(known_completions.close)
+    if len(known_completions) == 0:
         print("No previous completions found")
 
 
-load_previous_completions()
+def get_known_completions():
+    # Loaded on the first completion rather than on import, so --help and importing this module stay fast
+    if known_completions is None:
+        load_previous_completions()
+    return known_completions
 
 
-def add_completion_to_previous_completions(prompt, initial_messages, completion):
-    key = {"prompt": prompt, "initial_messages": initial_messages}
-    known_completions[key] = {"prompt": prompt, "initial_messages": initial_messages, "completion": completion}
-    known_completions.save(ALL_COMPLETIONS_PATH)
+def add_completion_to_previous_completions(prompt, initial_messages, completion, key=None):
+    if key is None:
+        key = {"prompt": prompt, "initial_messages": initial_messages}
+    # Appends one record to the log, rather than rewriting every completion
+    get_known_completions()[key] = {"prompt": prompt, "initial_messages": initial_messages, "completion": completion}
 
 
-def get_completion(prompt, initial_messages=None):
+def get_completion(prompt, initial_messages=None, simulate_stream=False):
     print(fg(0, 1, 0) + "Prompt:\n    " + prompt + BG_DEFAULT_COLOR + FG_DEFAULT_COLOR)
     if initial_messages is None:
         initial_messages = []
     messages = initial_messages + [{"role": "user", "content": prompt}]
-    key = {"prompt": prompt, "initial_messages": initial_messages}
+    known_completions = get_known_completions()
+    # The key holds the whole conversation, so it is hashed once and not on every lookup
+    key = known_completions.hash_key({"prompt": prompt, "initial_messages": initial_messages})
     if key in known_completions:
-        completion = known_completions[key]["completion"]
+        # Completions cached before the record format are converted on the fly, the migration rewrites them for good
+        record = upgrade_cached_completion(known_completions[key], MODEL_NAME)["completion"]
+        full_text = replay_completion(record, simulate_stream=simulate_stream)
     else:
-        completion = backoff_completion(
-            model=MODEL_NAME,
-            messages=messages,
-            stream=True,
-        )
-    full_completion, full_text = merge_completion_stream(completion)
-
-    if key not in known_completions:
-        add_completion_to_previous_completions(prompt, initial_messages, full_completion)
+        completion = get_chat_client().stream(messages, model=MODEL_NAME)
+        full_completion, full_text = merge_completion_stream(completion)
+        record = build_completion_record(full_completion, full_text, messages, MODEL_NAME)
+        add_completion_to_previous_completions(prompt, initial_messages, record, key)
 
     messages.append({"role": "assistant", "content": full_text})
     return full_text, messages
@@ -186,7 +197,7 @@ def prompt_to_improve_script(args):
     prompt += f"""# {basename(args.script)}"""
     full_prompt = prompt + f"\n```python\n{script_content}\n```\n"
 
-    full_text, messages = get_completion(remove_leading_whitespace(full_prompt))
+    full_text, messages = get_completion(remove_leading_whitespace(full_prompt), simulate_stream=args.simulate_stream)
     return user_prompt, full_prompt, full_text, messages
 
 
@@ -195,6 +206,7 @@ def main():
     parser.add_argument("--script", help="Path to the script file to generate a test for.")
     parser.add_argument("--comment-lines", action="store_true", help="Write a comment for every line of code.")
     parser.add_argument("--add-docstrings", action="store_true", help="Write a docstring for every class and function.")
+    parser.add_argument("--simulate-stream", action="store_true", help="Print cached completions a word at a time.")
 
     args = parser.parse_args()
     if args.script:
@@ -204,7 +216,7 @@ def main():
         run_dir = generate_run_dir(SCRIPT_WRITER_DIR)
         user_prompt, full_prompt = get_user_prompt()
 
-        full_text, messages = get_completion(full_prompt)
+        full_text, messages = get_completion(full_prompt, simulate_stream=args.simulate_stream)
 
     print("=" * 60)
     scripts, function_names_by_script = save_scripts(full_text, user_prompt, run_dir)
@@ -260,7 +272,7 @@ def main():
                 
             ```python\n{FIBONACCI_EXAMPLE_TEST_SCRIPT}\n```
         """
-        next_full_text, next_messages = get_completion(prompt, messages)
+        next_full_text, next_messages = get_completion(prompt, messages, simulate_stream=args.simulate_stream)
 
         scripts, function_names_by_script = save_scripts(next_full_text, user_prompt, run_dir)
 